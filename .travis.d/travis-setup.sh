@@ -13,7 +13,8 @@ export PATH=~/miniconda2/bin:${PATH}
 conda config --add channels r
 conda config --add channels bioconda
 
-conda create -y -n hlama-0.1 yara=0.9.6 razers3=3.5.0 optitype=2015.10.20
+conda create -y -n hlama-0.1 yara=0.9.6 razers3=3.5.0 optitype=2015.10.20 \
+    samtools pigz
 
 # Install HLA-MA
 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the consistency engines on synthetic cohorts
+
+Times parsing of pedigrees and tumor/normal sheets, the pedigree and
+tumor/normal consistency checks, the graph checks of multi-generation
+pedigrees, and the whole report step (all shards and the merge) on
+synthetic data without running Yara or OptiType.
+
+Usage::
+
+    py.test benchmarks/bench_engines.py [--benchmark-autosave]
+    HLAMA_BENCH_SIZES=10,1000 py.test benchmarks/bench_engines.py
+
+``HLAMA_BENCH_SIZES`` gives the numbers of members, by default 10, 1000,
+10000, and 100000.  Compare against a saved run with
+``--benchmark-compare`` for catching scaling regressions.
+"""
+
+import os
+
+import pytest
+
+from hlama import __version__
+from hlama import base
+from hlama import matched_pairs
+from hlama import mendel
+from hlama import pedigree
+from hlama import report
+from hlama.base import HLAType
+from hlama.snake import HlamaSchema
+
+import synthetic
+
+pytest.importorskip('pytest_benchmark')
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Numbers of members to benchmark
+SIZES = [int(x) for x in os.environ.get(
+    'HLAMA_BENCH_SIZES', '10,1000,10000,100000').split(',')]
+
+
+def parse_calls(calls):
+    """Return calls as ``dict`` of ``HLAType`` lists by gene, by name"""
+    return {name: {gene: sorted(map(HLAType.parse, alleles))
+                   for gene, alleles in sample_calls.items()}
+            for name, sample_calls in calls.items()}
+
+
+@pytest.fixture(scope='module', params=SIZES)
+def ped(request):
+    """Synthetic pedigree text and parsed calls"""
+    text, calls = synthetic.pedigree(request.param)
+    return text, calls, parse_calls(calls)
+
+
+@pytest.fixture(scope='module', params=SIZES)
+def tsv(request):
+    """Synthetic tumor/normal text and parsed calls"""
+    text, calls = synthetic.cohort(request.param)
+    return text, calls, parse_calls(calls)
+
+
+def make_schema(members, schema):
+    """Return ``HlamaSchema`` for the given ``data.json`` members"""
+    return HlamaSchema({
+        'schema': schema, 'members': members, 'config': None,
+        'version': __version__, 'num_threads': 1, 'ilp_threads': 1,
+        'kmer_prescreen': False, 'low_scratch': False,
+        'keep_prefiltered': False, 'call_store': None,
+        'env_snapshot': None, 'serve_socket': None,
+    })
+
+
+def run_report(schema):
+    """Write all report shards and merge them, as the Snakefile does"""
+    base.clear_calls_cache()
+    shards = schema.get_report_shards()
+    for path in shards:
+        shard = os.path.basename(path)[:-len('.txt')]
+        schema.write_report_shard(shard, path)
+    report.merge_shards('report.txt', shards)
+
+
+def test_pedigree_parse(benchmark, ped):
+    text, calls, _ = ped
+    result = benchmark(lambda: pedigree.Pedigree.parse(
+        synthetic.as_file(text)))
+    assert len(result.members) == len(calls)
+
+
+def test_pedigree_check_consistency(benchmark, ped):
+    text, _, calls = ped
+    the_pedigree = pedigree.Pedigree.parse(synthetic.as_file(text))
+    trios = [(calls[m.name], calls[m.father], calls[m.mother])
+             for m in the_pedigree.members if m.father != '0']
+
+    def run():
+        return sum(pedigree.check_consistency(precision, *trio)
+                   for trio in trios for precision in (2, 4))
+
+    benchmark(run)
+
+
+def test_pedigree_check_identity(benchmark, ped):
+    text, _, calls = ped
+    the_pedigree = pedigree.Pedigree.parse(synthetic.as_file(text))
+    pairs = [(calls[m.name], calls[parent])
+             for m in the_pedigree.members if m.father != '0'
+             for parent in (m.father, m.mother)]
+
+    def run():
+        return sum(pedigree.check_identity(precision, *pair)
+                   for pair in pairs for precision in (2, 4))
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize('num_members', SIZES)
+def test_pedigree_graph_check(benchmark, num_members):
+    text, calls = synthetic.generations(num_members)
+    the_pedigree = pedigree.Pedigree.parse(synthetic.as_file(text))
+    calls = {name: sum(sample_calls.values(), [])
+             for name, sample_calls in parse_calls(calls).items()}
+    benchmark(mendel.check_pedigree, the_pedigree, calls)
+
+
+def test_cohort_parse(benchmark, tsv):
+    text, calls, _ = tsv
+    result = benchmark(lambda: matched_pairs.Cohort.parse(
+        synthetic.as_file(text)))
+    assert len(result.members) == len(calls)
+
+
+def test_pairs_check_consistency(benchmark, tsv):
+    text, _, calls = tsv
+    cohort = matched_pairs.Cohort.parse(synthetic.as_file(text))
+    pairs = [(sum(calls[m.reference_sample].values(), []),
+              sum(calls[m.sample].values(), []))
+             for m in cohort.members if m.sample != m.reference_sample]
+
+    def run():
+        return sum(matched_pairs.check_consistency(precision, *pair)
+                   for pair in pairs for precision in (2, 4))
+
+    benchmark(run)
+
+
+def test_pedigree_report(benchmark, ped, tmpdir, monkeypatch):
+    text, calls, _ = ped
+    synthetic.write_calls(tmpdir, calls)
+    tmpdir.mkdir('report.d')
+    monkeypatch.chdir(tmpdir)
+    members = {
+        m.name: {'family': m.family, 'name': m.name, 'father': m.father,
+                 'mother': m.mother, 'gender': m.gender,
+                 'disease': m.disease}
+        for m in pedigree.Pedigree.parse(synthetic.as_file(text)).members}
+    schema = make_schema(members, 'hla_pedigree')
+    benchmark.pedantic(run_report, args=(schema,), rounds=3)
+
+
+def test_pairs_report(benchmark, tsv, tmpdir, monkeypatch):
+    text, calls, _ = tsv
+    synthetic.write_calls(tmpdir, calls)
+    tmpdir.mkdir('report.d')
+    monkeypatch.chdir(tmpdir)
+    members = {
+        m.name: {'donor': m.donor, 'sample': m.sample, 'name': m.name,
+                 'reference': m.reference_sample, 'seq_type': m.seq_type}
+        for m in matched_pairs.Cohort.parse(synthetic.as_file(text)).members}
+    schema = make_schema(members, 'hla_check_pairs')
+    benchmark.pedantic(run_report, args=(schema,), rounds=3)
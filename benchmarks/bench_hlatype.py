@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for parsing and comparing HLA types
+
+Parses a million HLA type strings and compares calls the way the
+consistency checks do, once using the integer keys and once using the
+precision strings.
+
+Usage::
+
+    python benchmarks/bench_hlatype.py [--num-calls 1000000]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from hlama.base import HLAType
+from hlama.pedigree import check_identity
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def random_hla_strs(rng, num):
+    """Return ``num`` random HLA type strings"""
+    return ['HLA-{}*{:02d}:{:02d}'.format(rng.choice('ABC'),
+                                          rng.randint(1, 80),
+                                          rng.randint(1, 30))
+            for _ in range(num)]
+
+
+def timed(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print('{:<40} {:8.3f} s'.format(label, time.time() - start))
+    return result
+
+
+def compare_keys(calls, precision):
+    """Count identical neighbouring samples using the integer keys"""
+    return sum(check_identity(precision, lhs, rhs)
+               for lhs, rhs in zip(calls, calls[1:]))
+
+
+def compare_strs(calls, precision):
+    """Count identical neighbouring samples using the precision strings"""
+    def to_set(hlas):
+        return set(hla.prec_str(precision) for hla in hlas)
+
+    return sum(all(to_set(lhs[gene]) == to_set(rhs[gene]) for gene in 'ABC')
+               for lhs, rhs in zip(calls, calls[1:]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-calls', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    hla_strs = random_hla_strs(random.Random(args.seed), args.num_calls)
+    hlas = timed('parse {} calls'.format(len(hla_strs)),
+                 lambda: [HLAType.parse(s) for s in hla_strs])
+
+    calls = []
+    for i in range(0, len(hlas) - 5, 6):
+        sample = {'A': [], 'B': [], 'C': []}
+        for hla in hlas[i:i + 6]:
+            sample[hla.gene_name].append(hla)
+        calls.append(sample)
+    for precision in (2, 4):
+        timed('compare {} samples, keys, {} digits'.format(
+            len(calls), precision), compare_keys, calls, precision)
+        timed('compare {} samples, strings, {} digits'.format(
+            len(calls), precision), compare_strs, calls, precision)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
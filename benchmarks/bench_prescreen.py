@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Benchmark for the k-mer pre-screen on the test data
+
+The test reads are simulated from HLA alleles only.  To mimic exome or
+genome data where almost all reads are off-target, random background read
+pairs are mixed in.  Reports the reduction in reads and the wall-clock time
+of pre-screening and, if ``yara_mapper`` is in ``$PATH``, of mapping the
+reads with and without pre-screening.
+
+Usage::
+
+    python benchmarks/bench_prescreen.py [--background-factor 100]
+"""
+
+import argparse
+import gzip
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from hlama import prescreen
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Directory with the test data
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data',
+                        'tumor_normal')
+#: HLA reference
+HLA_REF = os.path.join(os.path.dirname(__file__), '..', 'hlama',
+                       'hla_reference_dna.fasta.gz')
+
+
+def read_fastq(path):
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    return [lines[i:i + 4] for i in range(0, len(lines), 4)]
+
+
+def write_input(tmp_dir, factor, seed):
+    """Write gzip-compressed FASTQ pairs with test and background reads"""
+    rng = random.Random(seed)
+    mates = [read_fastq(os.path.join(DATA_DIR, 'donor1_normal_{}.fq'.format(
+        i))) for i in (1, 2)]
+    paths = [os.path.join(tmp_dir, 'reads_{}.fq.gz'.format(i))
+             for i in (1, 2)]
+    outs = [gzip.open(path, 'wb', compresslevel=1) for path in paths]
+    num = 0
+    for pair in zip(*mates):
+        for out, record in zip(outs, pair):
+            out.writelines(record)
+        num += 1
+        for j in range(factor):
+            for out, record in zip(outs, pair):
+                seq = ''.join(rng.choice('ACGT')
+                              for _ in range(len(record[1]) - 1))
+                out.write('@bg.{}.{}\n{}\n+\n{}'.format(
+                    num, j, seq, record[3].decode()).encode())
+            num += 1
+    for out in outs:
+        out.close()
+    return paths, num
+
+
+def time_yara(tmp_dir, ref, paths, label):
+    """Return wall-clock time for mapping ``paths`` with Yara"""
+    start = time.time()
+    for path in paths:
+        subprocess.check_call(
+            'yara_mapper -e 4 {} {} | samtools view -c -F 4 - >/dev/null'
+            .format(ref, path), shell=True)
+    elapsed = time.time() - start
+    print('yara ({}): {:.2f} s'.format(label, elapsed))
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--background-factor', type=int, default=100,
+                        help='Background read pairs per HLA read pair')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--k', type=int, default=prescreen.DEFAULT_K)
+    parser.add_argument('--step', type=int, default=prescreen.DEFAULT_STEP)
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths, _ = write_input(tmp_dir, args.background_factor, args.seed)
+
+        start = time.time()
+        kmer_set = prescreen.KmerSet.from_fasta(HLA_REF, args.k)
+        print('k-mer set: {} k-mers, built in {:.2f} s'.format(
+            len(kmer_set), time.time() - start))
+
+        out_paths = [os.path.join(tmp_dir, 'screened_{}.fq'.format(i))
+                     for i in (1, 2)]
+        start = time.time()
+        num_in, num_out = prescreen.screen_fastq(
+            kmer_set, paths, out_paths, args.step)
+        elapsed = time.time() - start
+        kept_hla = sum(1 for record in read_fastq(out_paths[0])
+                       if not record[0].startswith(b'@bg.'))
+        total_hla = len(read_fastq(os.path.join(
+            DATA_DIR, 'donor1_normal_1.fq')))
+        print('pre-screen: {} -> {} pairs ({:.2%}), {:.2f} s, '
+              '{:.0f} pairs/s'.format(num_in, num_out, num_out / num_in,
+                                      elapsed, num_in / elapsed))
+        print('HLA pairs kept: {} of {}'.format(kept_hla, total_hla))
+
+        if shutil.which('yara_mapper') and shutil.which('yara_indexer'):
+            ref = os.path.join(tmp_dir, 'ref.fasta')
+            subprocess.check_call('zcat {} >{} && yara_indexer -o {} {}'
+                                  .format(HLA_REF, ref, ref, ref),
+                                  shell=True, stdout=subprocess.DEVNULL)
+            full = time_yara(tmp_dir, ref, paths, 'all reads')
+            screened = time_yara(tmp_dir, ref, out_paths, 'pre-screened')
+            print('total with pre-screen: {:.2f} s vs. {:.2f} s'.format(
+                screened + elapsed, full))
+        else:
+            print('yara_mapper not in $PATH, skipping mapping times',
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark of the per-job startup overhead
+
+Each Snakemake invocation, including each cluster job, imports the modules
+used by the Snakefile, loads ``data.json`` into ``HlamaSchema``, and parses
+the Snakefile.  Times the imports in a fresh interpreter, building the
+schema for synthetic cohorts, and, if Snakemake is installed, listing the
+rules of the Snakefile.
+
+Usage::
+
+    py.test benchmarks/bench_startup.py [--benchmark-autosave]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from hlama import __version__
+from hlama import matched_pairs
+from hlama import snake
+
+import synthetic
+
+pytest.importorskip('pytest_benchmark')
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Numbers of members to benchmark
+SIZES = [int(x) for x in os.environ.get(
+    'HLAMA_BENCH_SIZES', '10,1000,10000,100000').split(',')]
+#: Modules imported by the Snakefile
+SNAKEFILE_IMPORTS = 'from hlama import fastq, metrics, report, snake'
+
+
+def write_data_json(work_dir, num_members):
+    """Write ``data.json`` of synthetic tumor/normal cohort"""
+    text, _ = synthetic.cohort(num_members)
+    members = {}
+    for m in matched_pairs.Cohort.parse(synthetic.as_file(text)).members:
+        members[m.name] = {
+            'donor': m.donor, 'sample': m.sample, 'name': m.name,
+            'reference': m.reference_sample, 'seq_type': m.seq_type,
+            'mode': 'paired-end', 'files': [
+                '/data/{}_R1.fastq.gz'.format(m.name),
+                '/data/{}_R2.fastq.gz'.format(m.name)],
+            'max_hla_reads': 0, 'fingerprint': None, 'precomputed': False}
+    work_dir.join('data.json').write(json.dumps({
+        'schema': 'hla_check_pairs', 'members': members, 'config': None,
+        'version': __version__, 'num_threads': 1, 'ilp_threads': 1,
+        'kmer_prescreen': False, 'low_scratch': False,
+        'keep_prefiltered': False, 'call_store': None,
+        'env_snapshot': None, 'serve_socket': None,
+    }))
+
+
+def test_import(benchmark):
+    benchmark(subprocess.check_call, [sys.executable, '-c',
+                                      SNAKEFILE_IMPORTS])
+
+
+@pytest.mark.parametrize('num_members', SIZES)
+def test_build_schema(benchmark, num_members, tmpdir, monkeypatch):
+    write_data_json(tmpdir, num_members)
+    monkeypatch.chdir(tmpdir)
+    benchmark(snake.build_schema, 'data.json')
+
+
+@pytest.mark.parametrize('num_members', SIZES)
+def test_parse_snakefile(benchmark, num_members, tmpdir):
+    pytest.importorskip('snakemake')
+    write_data_json(tmpdir, num_members)
+    snakefile = os.path.join(os.path.dirname(snake.__file__), 'Snakefile')
+    benchmark(subprocess.check_call, [
+        sys.executable, '-m', 'snakemake', '--snakefile', snakefile,
+        '--directory', str(tmpdir), '--list'],
+        stdout=subprocess.DEVNULL)
@@ -0,0 +1,24 @@
+#!/bin/bash
+# Stand-in for a cluster scheduler for trying out the job declarations and
+# grouping without a cluster, e.g.:
+#
+#   hlama --tumor-normal matched.tsv ... \
+#       --cluster "$PWD/benchmarks/local_cluster.sh {threads} {resources.mem_mb}" \
+#       --jobs 8 --group-size 50
+#
+# Appends the requested threads and memory of each submitted job to the file
+# $HLAMA_CLUSTER_LOG (default: cluster_jobs.tsv in the work directory) and
+# runs the job script in the background, as a scheduler would.  The output
+# of the jobs goes to cluster_logs/ in the work directory.
+
+set -e -o pipefail
+
+threads=$1
+mem_mb=$2
+jobscript=$3
+
+echo -e "$(date +%s)\t${threads}\t${mem_mb}\t$(basename $jobscript)" \
+    >> ${HLAMA_CLUSTER_LOG:-cluster_jobs.tsv}
+
+mkdir -p cluster_logs
+nohup bash $jobscript >cluster_logs/$(basename $jobscript).log 2>&1 &
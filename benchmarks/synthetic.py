@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Generator of synthetic pedigrees and tumor/normal cohorts
+
+The alleles are drawn from approximate European allele frequencies of the
+most common four-digit alleles of each gene, with the remaining frequency
+spread over a long tail of rare alleles.  Children inherit one allele per
+gene from each parent and tumors carry the alleles of their normal, except
+for a small fraction of sample swaps and typing errors.
+"""
+
+import io
+import random
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Common alleles and their approximate frequencies
+COMMON_ALLELES = {
+    'A': [('02:01', .28), ('01:01', .15), ('03:01', .14), ('24:02', .09),
+          ('11:01', .06), ('26:01', .03), ('32:01', .03), ('68:01', .03),
+          ('31:01', .02), ('29:02', .02)],
+    'B': [('07:02', .13), ('08:01', .11), ('44:02', .09), ('15:01', .06),
+          ('35:01', .06), ('40:01', .05), ('44:03', .05), ('51:01', .05),
+          ('18:01', .04), ('57:01', .04)],
+    'C': [('07:01', .16), ('07:02', .14), ('04:01', .11), ('05:01', .09),
+          ('06:02', .09), ('03:04', .08), ('12:03', .05), ('02:02', .05),
+          ('03:03', .05), ('16:01', .03)],
+}
+#: Number of rare alleles per gene sharing the remaining frequency
+NUM_RARE = 200
+#: Fraction of samples with a typing error or swap
+ERROR_RATE = 0.01
+
+
+class AlleleSampler:
+    """Draw random alleles with realistic frequencies"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.alleles = {}
+        self.weights = {}
+        for gene, common in COMMON_ALLELES.items():
+            names = ['{}*{}'.format(gene, name) for name, _ in common]
+            weights = [freq for _, freq in common]
+            rest = 1 - sum(weights)
+            rare = ['{}*{:02d}:{:02d}'.format(gene, 80 + i // 50, i % 50 + 1)
+                    for i in range(NUM_RARE)]
+            # Zipf-like tail
+            norm = sum(1 / (i + 1) for i in range(NUM_RARE))
+            names += rare
+            weights += [rest / (i + 1) / norm for i in range(NUM_RARE)]
+            self.alleles[gene] = names
+            self.weights[gene] = weights
+
+    def draw(self, gene, k=2):
+        """Return list of ``k`` random alleles of ``gene``"""
+        return self.rng.choices(self.alleles[gene], self.weights[gene], k=k)
+
+    def individual(self):
+        """Return calls of a random individual, two alleles per gene"""
+        return {gene: self.draw(gene) for gene in 'ABC'}
+
+    def child(self, father, mother):
+        """Return calls of a child of ``father`` and ``mother``"""
+        calls = {gene: [self.rng.choice(father[gene]),
+                        self.rng.choice(mother[gene])] for gene in 'ABC'}
+        return self.maybe_mutate(calls)
+
+    def maybe_mutate(self, calls):
+        """Replace an allele by a random one with ``ERROR_RATE``"""
+        if self.rng.random() < ERROR_RATE:
+            gene = self.rng.choice('ABC')
+            calls = dict(calls)
+            calls[gene] = [calls[gene][0]] + self.draw(gene, 1)
+        return calls
+
+
+def pedigree(num_members, seed=42):
+    """Return synthetic pedigree as PED file text and calls by member
+
+    The pedigree consists of trios and quartets (two children).
+    """
+    rng = random.Random(seed)
+    sampler = AlleleSampler(rng)
+    lines = []
+    calls = {}
+    family = 0
+    while len(calls) < num_members:
+        family += 1
+        fam = 'FAM{}'.format(family)
+        father, mother = '{}_father'.format(fam), '{}_mother'.format(fam)
+        calls[father] = sampler.individual()
+        calls[mother] = sampler.individual()
+        lines.append([fam, father, '0', '0', '1', '1'])
+        lines.append([fam, mother, '0', '0', '2', '1'])
+        for i in range(rng.choice((1, 1, 2))):
+            child = '{}_child{}'.format(fam, i + 1)
+            calls[child] = sampler.child(calls[father], calls[mother])
+            lines.append([fam, child, father, mother, rng.choice('12'), '2'])
+    text = ''.join('\t'.join(line + ['{}_1.fq'.format(line[1])]) + '\n'
+                   for line in lines)
+    return text, calls
+
+
+def generations(num_members, num_generations=4, seed=42):
+    """Return synthetic multi-generation pedigree text and calls by member
+
+    Each family starts with a couple of founders.  In each following
+    generation, each child of the previous one has children with a new
+    founder.  A fraction of the non-founders is not genotyped, i.e., has no
+    calls.
+    """
+    rng = random.Random(seed)
+    sampler = AlleleSampler(rng)
+    lines = []
+    calls = {}
+    ungenotyped = set()
+    family = 0
+    while len(calls) < num_members:
+        family += 1
+        fam = 'FAM{}'.format(family)
+        founders = ['{}_{}'.format(fam, i) for i in (1, 2)]
+        for name, sex in zip(founders, '12'):
+            calls[name] = sampler.individual()
+            lines.append([fam, name, '0', '0', sex, '1'])
+        couples = [founders]
+        for generation in range(1, num_generations):
+            children = []
+            for father, mother in couples:
+                for _ in range(rng.choice((1, 2, 2, 3))):
+                    child = '{}_{}'.format(fam, len(calls) + 1)
+                    calls[child] = sampler.child(calls[father],
+                                                 calls[mother])
+                    sex = rng.choice('12')
+                    lines.append([fam, child, father, mother, sex, '2'])
+                    if rng.random() < 0.1:
+                        ungenotyped.add(child)
+                    children.append((child, sex))
+            couples = []
+            for child, sex in children[:4]:
+                spouse = '{}_{}'.format(fam, len(calls) + 1)
+                calls[spouse] = sampler.individual()
+                lines.append([fam, spouse, '0', '0', '2' if sex == '1'
+                              else '1', '1'])
+                couples.append((child, spouse) if sex == '1'
+                               else (spouse, child))
+    text = ''.join('\t'.join(line + ['{}_1.fq'.format(line[1])]) + '\n'
+                   for line in lines)
+    return text, {name: value for name, value in calls.items()
+                  if name not in ungenotyped}
+
+
+def cohort(num_members, seed=42):
+    """Return synthetic tumor/normal cohort as TSV text and calls by sample
+
+    Each donor has a normal and a tumor sample, some also an RNA sample.
+    """
+    rng = random.Random(seed)
+    sampler = AlleleSampler(rng)
+    lines = []
+    calls = {}
+    donor = 0
+    while len(calls) < num_members:
+        donor += 1
+        name = 'donor{}'.format(donor)
+        normal = '{}_normal'.format(name)
+        calls[normal] = sampler.individual()
+        lines.append([name, normal, normal, 'DNA'])
+        samples = [('tumor', 'DNA')]
+        if rng.random() < 0.2:
+            samples.append(('tumor_rna', 'RNA'))
+        for suffix, seq_type in samples:
+            sample = '{}_{}'.format(name, suffix)
+            calls[sample] = sampler.maybe_mutate(calls[normal])
+            lines.append([name, sample, normal, seq_type])
+    text = ''.join('\t'.join(line + ['{}_1.fq'.format(line[1])]) + '\n'
+                   for line in lines)
+    return text, calls
+
+
+def write_calls(work_dir, calls):
+    """Write ``{name}.d/hla_types.txt`` files below ``work_dir``"""
+    for name, sample_calls in calls.items():
+        work_dir.mkdir('{}.d'.format(name)).join('hla_types.txt').write(
+            ''.join(allele + '\n' for gene in 'ABC'
+                    for allele in sample_calls[gene]))
+
+
+def as_file(text):
+    """Return file-like object for parsing ``text``"""
+    return io.StringIO(text)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Library API for checking HLA calls within a Python process
+
+The command line application types samples with Snakemake and writes the
+results to the work directory.  For checking calls that are available
+already, e.g., from earlier runs, this module offers the checks on
+in-memory objects.  It neither reads nor writes files and does not import
+Snakemake, so it can be used in long-running services::
+
+    from hlama import api
+
+    calls = {
+        'father': api.parse_calls(['A*01:01', 'A*02:01', 'B*07:02', ...]),
+        'mother': api.parse_calls(...),
+        'child': api.parse_calls(...),
+    }
+    result = api.check_trio(
+        calls['child'], calls['father'], calls['mother'], name='child')
+    if not result.ok:
+        print(result.mismatches_2, result.mismatches_4, result.flags)
+
+    for result in api.check_pedigree(pedigree, calls):
+        ...
+
+Calls are ``dict`` objects with the sorted list of ``HLAType`` objects of
+each gene as returned by ``parse_calls()``.  The functions taking calls
+also accept lists of HLA type strings.
+"""
+
+from . import matched_pairs
+from . import pedigree as pedigree_mod
+from .base import GENES, HLAType
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: The precisions checked, in digits
+PRECISIONS = (2, 4)
+
+
+def parse_calls(hla_types):
+    """Return calls as ``dict`` with sorted ``HLAType`` lists by gene
+
+    ``hla_types`` is an iterable of HLA type strings (e.g., the lines of
+    an ``hla_types.txt`` file, empty lines are skipped) or ``HLAType``
+    objects.
+    """
+    result = {gene: [] for gene in GENES}
+    parsed = []
+    for hla_type in hla_types:
+        if not isinstance(hla_type, HLAType):
+            hla_type = hla_type.strip()
+            if not hla_type:
+                continue
+            hla_type = HLAType.parse(hla_type)
+        parsed.append(hla_type)
+    for hla_type in sorted(parsed):
+        result.setdefault(hla_type.gene_name, []).append(hla_type)
+    return result
+
+
+def _as_calls(calls):
+    """Return ``calls`` parsed with ``parse_calls()`` unless a ``dict``"""
+    if calls is None or isinstance(calls, dict):
+        return calls
+    return parse_calls(calls)
+
+
+class TrioResult:
+    """Result of checking the calls of an index against its parents"""
+
+    def __init__(self, name, num_parents, mismatches_2, mismatches_4,
+                 identities):
+        #: Name of the index
+        self.name = name
+        #: Number of parents with calls
+        self.num_parents = num_parents
+        #: Number of mismatching alleles at two and four digits precision
+        self.mismatches_2 = mismatches_2
+        self.mismatches_4 = mismatches_4
+        #: List of ``(parent, digits)`` pairs, the parents (``'father'`` or
+        #: ``'mother'``) with calls identical to the index at the given
+        #: precision
+        self.identities = list(identities)
+
+    @property
+    def ok(self):
+        """Whether the calls are consistent and differ from the parents"""
+        return not (self.mismatches_2 or self.mismatches_4 or
+                    self.identities)
+
+    @property
+    def flags(self):
+        """Warnings as written to the report"""
+        return ['WARN:identity-{}:{}'.format(parent, digits)
+                for parent, digits in self.identities]
+
+    def to_line(self):
+        """Return line of the pedigree report"""
+        return '\t'.join(map(str, [
+            self.name, self.num_parents, self.mismatches_2 or 'OK',
+            self.mismatches_4 or 'OK', ','.join(self.flags) or 'OK']))
+
+    def __repr__(self):
+        return ('TrioResult(name={!r}, num_parents={}, mismatches_2={}, '
+                'mismatches_4={}, identities={!r})').format(
+                    self.name, self.num_parents, self.mismatches_2,
+                    self.mismatches_4, self.identities)
+
+
+class PairResult:
+    """Result of checking the calls of a sample against its reference"""
+
+    def __init__(self, sample, reference, mismatches_2, mismatches_4):
+        #: Names of the sample and the reference (e.g., normal) sample
+        self.sample = sample
+        self.reference = reference
+        #: Number of alleles of the reference missing from the sample at
+        #: two and four digits precision
+        self.mismatches_2 = mismatches_2
+        self.mismatches_4 = mismatches_4
+
+    @property
+    def ok(self):
+        """Whether the calls of sample and reference match"""
+        return not (self.mismatches_2 or self.mismatches_4)
+
+    def to_line(self):
+        """Return line of the tumor/normal report"""
+        return '\t'.join(map(str, [
+            self.sample, self.mismatches_2 or 'OK',
+            self.mismatches_4 or 'OK']))
+
+    def __repr__(self):
+        return ('PairResult(sample={!r}, reference={!r}, mismatches_2={}, '
+                'mismatches_4={})').format(
+                    self.sample, self.reference, self.mismatches_2,
+                    self.mismatches_4)
+
+
+def check_trio(index_calls, father_calls=None, mother_calls=None,
+               name=None):
+    """Check calls of an index against the calls of one or both parents
+
+    Return ``TrioResult``.  Raise ``ValueError`` without parent calls.
+    """
+    index_calls = _as_calls(index_calls)
+    parents = (('father', _as_calls(father_calls)),
+               ('mother', _as_calls(mother_calls)))
+    parents = [(parent, calls) for parent, calls in parents if calls]
+    if not parents:
+        raise ValueError('Need calls of at least one parent')
+    identities = [
+        (parent, digits) for digits in PRECISIONS
+        for parent, calls in parents
+        if pedigree_mod.check_identity(digits, index_calls, calls)]
+    father_calls, mother_calls = (
+        dict(parents).get('father'), dict(parents).get('mother'))
+    mismatches = [pedigree_mod.check_consistency(
+        digits, index_calls, father_calls, mother_calls)
+        for digits in PRECISIONS]
+    return TrioResult(name, len(parents), *mismatches,
+                      identities=identities)
+
+
+def check_pair(reference_calls, sample_calls, sample=None, reference=None):
+    """Check calls of a sample (e.g., tumor) against its reference (normal)
+
+    Return ``PairResult``.
+    """
+    reference_calls = sum(_as_calls(reference_calls).values(), [])
+    sample_calls = sum(_as_calls(sample_calls).values(), [])
+    mismatches = [matched_pairs.check_consistency(
+        digits, reference_calls, sample_calls) for digits in PRECISIONS]
+    return PairResult(sample, reference, *mismatches)
+
+
+def check_pedigree(pedigree, calls):
+    """Check all members of ``pedigree`` with at least one parent
+
+    ``pedigree`` is a ``Pedigree`` or a list of ``PedigreeMember`` objects
+    and ``calls`` maps the member names to their calls.  Return list of
+    ``TrioResult`` objects in the order of the pedigree.
+    """
+    members = getattr(pedigree, 'members', pedigree)
+    calls = {name: _as_calls(value) for name, value in calls.items()}
+    result = []
+    for member in members:
+        if member.father == '0' and member.mother == '0':
+            continue
+        result.append(check_trio(
+            calls[member.name], calls.get(member.father),
+            calls.get(member.mother), name=member.name))
+    return result
+
+
+def check_pairs(cohort, calls):
+    """Check all samples of ``cohort`` against their reference samples
+
+    ``cohort`` is a ``Cohort`` or a list of ``Donor`` objects and ``calls``
+    maps the sample names to their calls.  Return list of ``PairResult``
+    objects sorted by sample name, without the reference samples.
+    """
+    members = getattr(cohort, 'members', cohort)
+    calls = {name: _as_calls(value) for name, value in calls.items()}
+    return [check_pair(calls[member.reference_sample], calls[member.sample],
+                       sample=member.sample,
+                       reference=member.reference_sample)
+            for member in sorted(members, key=lambda m: m.sample)
+            if member.sample != member.reference_sample]
@@ -2,18 +2,33 @@
 """Main command line application for hlama"""
 
 import argparse
+import concurrent.futures
 import fnmatch
+import glob
+import importlib
+import io
 import json
 import os
 import sys
 import textwrap
+import threading
+import time
 
+from . import call_store
+from . import config
+from . import environment
 from . import pedigree
+from . import plan
+from . import report
 from . import matched_pairs
+from . import serve
+from .base import (
+    ALIGNED, INDEX_EXTS, PAIRED_END, PATTERNS_ALIGNED, PATTERNS_R1,
+    PATTERNS_R2, SINGLE_END)
+from .fastq import DEFAULT_MAX_HLA_READS
+from .snake import TYPING_GROUP, HlamaSchema
 from hlama import __version__
 
-import snakemake
-
 
 # ASCII art banner
 BANNER = r"""
@@ -24,29 +39,36 @@ BANNER = r"""
     |_| |_|_|\__,_|_| |_| |_|\__,_|
 """
 
-# Single-end mode
-SINGLE_END = 'single-end'
-# Paired-end mode
-PAIRED_END = 'paired-end'
-
-# Patterns for first read
-PATTERNS_R1 = [
-    '*_1*.fastq.gz', '*_1*.fq.gz', '*_R1_*.fq.gz', '*_R1_*.fastq.gz',
-    '*_R1.fastq.gz',
-    '*_1*.fastq', '*_1*.fq', '*_R1_*.fq', '*_R1_*.fastq',
-]
-# Patterns for second read
-PATTERNS_R2 = [
-    '*_2*.fastq.gz', '*_2*.fq.gz', '*_R2_*.fq.gz', '*_R2_*.fastq.gz',
-    '*_R2.fastq.gz',
-    '*_2*.fastq', '*_2*.fq', '*_R2_*.fq', '*_R2_*.fastq',
-]
-
 
 class InputDataException(Exception):
     """Raised on problems with input data"""
 
 
+#: Keys of the member entries whose changes require typing the member again
+RETYPE_KEYS = ('files', 'mode', 'seq_type', 'max_hla_reads', 'fingerprint')
+
+
+def _diff_members(old_members, new_members, keys=None):
+    """Return lists of added, removed, and changed member names
+
+    Only the ``keys`` of the members are compared, by default all of them.
+    Whether the calls of a member were taken from the call store is
+    ignored.
+    """
+    def strip(member):
+        if keys is not None:
+            return {key: member.get(key) for key in keys}
+        return {key: value for key, value in member.items()
+                if key != 'precomputed'}
+
+    added = sorted(set(new_members) - set(old_members))
+    removed = sorted(set(old_members) - set(new_members))
+    changed = sorted(
+        name for name in set(old_members) & set(new_members)
+        if strip(old_members[name]) != strip(new_members[name]))
+    return added, removed, changed
+
+
 class BaseApp:
     """Base class for the application
 
@@ -58,23 +80,43 @@ class BaseApp:
     pieces.
     """
 
+    #: Path of the result file(s) in the work dir, for display
+    RESULT = 'report.txt'
+
     def __init__(self, args):
         #: Command line arguments
         self.args = args
+        #: Resolved path by path as given, ``None`` for missing files
+        self.located = {}
+        #: Directory listing by directory path, ``None`` if not listable
+        self.listings = {}
+        #: Lock by directory path, for listing each directory only once
+        self.listing_locks = {}
 
     def run(self):
         """Perform the checking"""
         print(BANNER + '\n', file=sys.stderr)
-        # Create output directory and load information
-        self.create_out_dir()
+        # Create output directory and load information, --plan leaves the
+        # work dir untouched
+        if not self.args.plan:
+            self.create_out_dir()
+        self.conf = self.load_config()
         self.info = self.load_info()
-        # Check input data
+        # Resolve input file paths concurrently and check input data
+        start = time.time()
+        self.locate_files(self.info)
         if self.args.perform_checks:
             self.check_info(self.info)
-        # Create Snakefile
-        with open(os.path.join(self.args.work_dir, 'data.json'), 'wt') as f:
-            self.create_data_json(f, self.info)
-        self.create_snakefile_link()
+        print('Located {} input files in {:.1f}s ({} directory '
+              'listings)'.format(len(self.located), time.time() - start,
+                                 len(self.listings)), file=sys.stderr)
+        # Create Snakefile, only print the estimated costs with --plan
+        data_json = self.build_data_json(self.info)
+        if self.args.plan:
+            plan.write_table(sys.stdout, self.plan, self.plan_slots(),
+                             self.args.num_threads)
+            return
+        self.write_work_dir(data_json)
         # Stop here if we are not to run Snakemake or run it and display
         # where the result file is afterwards.
         if self.args.run_snakemake:
@@ -82,6 +124,116 @@ class BaseApp:
         else:
             self.dont_run_snakemake()
 
+    def build_data_json(self, info):
+        """Return contents of ``data.json`` for ``info``
+
+        Also estimates the cost of the members into ``self.plan``, for
+        starting the most expensive ones first.
+        """
+        data_json = io.StringIO()
+        self.create_data_json(data_json, info)
+        self.plan = plan.make_plan(
+            HlamaSchema(json.loads(data_json.getvalue())), self.plan_slots())
+        return data_json.getvalue()
+
+    def write_work_dir(self, data_json):
+        """Write ``data.json`` with contents ``data_json`` to the work dir
+
+        When updating, only the outputs affected by changed members are
+        invalidated.
+        """
+        path = os.path.join(self.args.work_dir, 'data.json')
+        if self.args.update:
+            self.update_work_dir(path, json.loads(data_json))
+        if not self.file_has_contents(path, data_json):
+            with open(path, 'wt') as f:
+                f.write(data_json)
+        self.create_snakefile_link()
+
+    def update_work_dir(self, path, new_data):
+        """Remove outputs of the work dir invalidated by ``new_data``
+
+        Members in the ``data.json`` file at ``path`` and in ``new_data``
+        are compared.  The calls and kept pre-filtered reads of members with
+        changed input files are removed (unless found in the call store), as
+        are the report shards of the donors or families with added, removed,
+        or changed members, and the merged reports.  The outputs of all other
+        members are kept, so Snakemake only types the new members and the
+        members with changed input files.  In batch mode, the reports of
+        each sheet are updated this way.
+        """
+        if not os.path.exists(path):
+            raise InputDataException(
+                'No data.json in {} to update'.format(self.args.work_dir))
+        with open(path, 'rt') as f:
+            old_data = json.load(f)
+        if old_data['schema'] != new_data['schema']:
+            raise InputDataException(
+                'Cannot update {} work directory in {} mode'.format(
+                    old_data['schema'], new_data['schema']))
+
+        new_members = new_data['members']
+        # Changed relations (e.g., parents or donor) only affect the reports
+        added, removed, retyped = _diff_members(
+            old_data['members'], new_members, RETYPE_KEYS)
+        print('Updating {}: {} added, {} removed, {} members with changed '
+              'input files'.format(self.args.work_dir, len(added),
+                                   len(removed), len(retyped)),
+              file=sys.stderr)
+        for name in retyped:
+            if not new_members[name]['precomputed']:
+                self.remove_output('{}.d/hla_types.txt'.format(name))
+            # Pre-filtered reads kept from the old input files
+            for lane_path in sorted(glob.glob(os.path.join(
+                    self.args.work_dir, '{}.d'.format(name), 'prefilter',
+                    'lane_*'))):
+                self.remove_output(
+                    os.path.relpath(lane_path, self.args.work_dir))
+        if new_data['schema'] == 'hla_batch':
+            old_sheets, new_sheets = old_data['sheets'], new_data['sheets']
+            for name in sorted(set(old_sheets) | set(new_sheets)):
+                schema = (new_sheets.get(name) or old_sheets[name])['schema']
+                self.update_reports(
+                    schema, old_sheets.get(name, {}).get('members', {}),
+                    new_sheets.get(name, {}).get('members', {}),
+                    'sheets/{}/'.format(name))
+        else:
+            self.update_reports(new_data['schema'], old_data['members'],
+                                new_members)
+
+    def update_reports(self, schema, old_members, new_members, prefix=''):
+        """Remove the report shards and reports affected by changed members
+
+        ``prefix`` is the directory of the reports below the work dir.
+        """
+        added, removed, changed = _diff_members(old_members, new_members)
+        if not (added or removed or changed):
+            return
+        key = report.shard_key(schema)
+        if key:
+            shards = sorted(
+                {old_members[name][key] for name in removed + changed} |
+                {new_members[name][key] for name in added + changed})
+            for shard in shards:
+                self.remove_output('{}report.d/{}.txt'.format(prefix, shard))
+        for out_path in ('report.txt', 'cohort_report.txt',
+                         'mendel_report.txt'):
+            self.remove_output(prefix + out_path)
+
+    def file_has_contents(self, path, contents):
+        """Return whether the file at ``path`` exists with ``contents``"""
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rt') as f:
+            return f.read() == contents
+
+    def remove_output(self, path):
+        """Remove output file at ``path`` relative to the work dir"""
+        full_path = os.path.join(self.args.work_dir, path)
+        if os.path.exists(full_path):
+            print('Removing outdated {}'.format(path), file=sys.stderr)
+            os.unlink(full_path)
+
     def create_snakefile_link(self):
         if not os.path.exists(os.path.join(self.args.work_dir, 'Snakefile')):
             os.symlink(os.path.join(os.path.dirname(__file__), 'Snakefile'),
@@ -90,16 +242,47 @@ class BaseApp:
     def run_snakemake(self):
         """Run Snakemake and display result files afterwards"""
         print('\nRunning Snakemake\n=================\n', file=sys.stderr)
-        snakemake.snakemake(
-            snakefile=os.path.join(self.args.work_dir, 'Snakefile'),
-            workdir=self.args.work_dir,
-        )
+        self.call_snakemake()
         # TODO: check Snakemake result
 
         print('\nThe End\n=======\n', file=sys.stderr)
         print('\n'.join(textwrap.wrap(textwrap.dedent(r"""
-            You can find the results in the "{}/report.txt" file.
-            """).format(self.args.work_dir).lstrip())), file=sys.stderr)
+            You can find the results in the "{}/{}" file.
+            """).format(self.args.work_dir, self.RESULT).lstrip())),
+            file=sys.stderr)
+
+    def plan_slots(self):
+        """Return number of members that can be typed concurrently"""
+        if self.args.cluster:
+            return self.args.jobs
+        return max(1, self.args.cores // self.args.num_threads)
+
+    def call_snakemake(self, targets=None):
+        """Call Snakemake in the work directory, return ``True`` on success
+
+        ``targets`` are the paths to create, by default the final outputs.
+        """
+        import snakemake  # only needed for running the workflow
+        kwargs = {}
+        if self.args.cluster:
+            kwargs = {
+                'cluster': self.args.cluster,
+                'nodes': self.args.jobs,
+                'group_components': {TYPING_GROUP: self.args.group_size},
+            }
+        return snakemake.snakemake(
+            snakefile=os.path.join(self.args.work_dir, 'Snakefile'),
+            workdir=self.args.work_dir,
+            targets=targets,
+            cores=self.args.cores,
+            restart_times=self.args.restart_times,
+            # Jobs killed, e.g., by preemption are run again
+            force_incomplete=True,
+            prioritytargets=[
+                '{}.d/hla_types.txt'.format(entry.name)
+                for entry in self.plan if entry.priority],
+            **kwargs
+        )
 
     def dont_run_snakemake(self):
         """Don't run Snakemake and only display what to do afterwards"""
@@ -111,8 +294,9 @@ class BaseApp:
             cluster environment.
 
             After running Snakemake, you will find the results in the
-            "report.txt" file.
-            """.format(self.args.work_dir)).lstrip(), 78)), file=sys.stderr)
+            "{}" file.
+            """.format(self.args.work_dir, self.RESULT)).lstrip(), 78)),
+            file=sys.stderr)
 
     def create_out_dir(self):
         """Create output directory if it does not exist"""
@@ -124,6 +308,13 @@ class BaseApp:
             print('Output directory {} already exists.'.format(
                 self.args.work_dir), file=sys.stderr)
 
+    def load_config(self):
+        """Load configuration"""
+        if self.args.config and not os.path.exists(self.args.config):
+            raise InputDataException('No configuration file at {}'.format(
+                self.args.config))
+        return config.Configuration.find(self.args.config)
+
     def load_info(self):
         """Load pedigree/matched sample file"""
         raise NotImplementedError('Override me!')
@@ -134,17 +325,27 @@ class BaseApp:
         In particular, this is the right place to check for file paths,
         single-end, and paired and mode.
         """
-        raise NotImplementedError('Override me!')
+        for member in info.members:
+            self.check_member_paths(member.name, member.data[0].split(','))
 
     def create_data_json(self, file, info):
         """Write out Snakefile"""
         raise NotImplementedError('Override me!')
 
     def get_mode(self, paths):
-        """Return ``SINGLE_END`` or ``PAIRED_END`` from list of file paths
+        """Return ``SINGLE_END``, ``PAIRED_END``, or ``ALIGNED`` from paths
 
         Raise InputDataException if non-existing.
         """
+        aligned = [path for path in paths
+                   if any(fnmatch.fnmatch(os.path.basename(path), pattern)
+                          for pattern in PATTERNS_ALIGNED)]
+        if aligned and len(aligned) != len(paths):
+            raise InputDataException(
+                'Cannot mix BAM/CRAM and FASTQ files in {}'.format(
+                    ','.join(paths)))
+        elif aligned:
+            return ALIGNED
         seen = {0: 0, 1: 0}  # counters
         for path in paths:
             filename = os.path.basename(path)
@@ -154,180 +355,469 @@ class BaseApp:
                         seen[i] += 1
                         break
         if not seen[0] and seen[1]:
-            raise InvalidDataException('Have seen only R2 in {}!'.format(
+            raise InputDataException('Have seen only R2 in {}!'.format(
                 ','.join(paths)))
         if seen[1] and seen[0] != seen[1]:
-            raise InvalidDataException(
+            raise InputDataException(
                 'Have seen different number of R1 and R2 reads in {}'.format(
                     ','.join(paths)))
         return (PAIRED_END if seen[1] else SINGLE_END)
 
+    def check_member_paths(self, name, paths):
+        """Check the input files of a member for existence and consistency
+
+        Raise InputDataException on problems.
+        """
+        if not paths:
+            tpl = 'Individual {} has no FASTQ or BAM/CRAM files!'
+            raise InputDataException(tpl.format(name))
+        # Check that all files exist
+        resolved = []
+        for path in paths:
+            try:
+                resolved.append(self.locate_file(path))
+            except InputDataException as e:
+                tpl = 'Individual {} refers to non-existing path {}!'
+                raise InputDataException(tpl.format(name, path))
+        # Determine single-end, paired-end, or aligned mode
+        if self.get_mode(resolved) == ALIGNED:
+            for path in resolved:
+                self.check_index(path)
+
+    def build_pair_members(self, cohort):
+        """Return ``data.json`` member entries of tumor/normal ``cohort``"""
+        result = {}
+        for member in cohort.members:
+            paths = member.data[0].split(',')
+            result[member.name] = {
+                'donor': member.donor,
+                'sample': member.sample,
+                'name': member.sample,
+                'seq_type': member.seq_type,
+                'reference': member.reference_sample,
+                'files': list(map(self.locate_file, paths)),
+                'mode': self.get_mode(paths),
+                'max_hla_reads': self.get_max_hla_reads(member.seq_type),
+            }
+        return result
+
+    def build_pedigree_members(self, pedigree):
+        """Return ``data.json`` member entries of ``pedigree``"""
+        result = {}
+        for member in pedigree.members:
+            paths = member.data[0].split(',')
+            result[member.name] = {
+                'family': member.family,
+                'name': member.name,
+                'father': member.father,
+                'mother': member.mother,
+                'gender': member.gender,
+                'disease': member.disease,
+                'files': list(map(self.locate_file, paths)),
+                'mode': self.get_mode(paths),
+                'max_hla_reads': self.get_max_hla_reads('DNA'),
+            }
+        return result
+
+    def get_max_hla_reads(self, seq_type):
+        """Return maximal number of HLA reads to collect for ``seq_type``"""
+        if self.args.max_hla_reads is not None:
+            return self.args.max_hla_reads
+        else:
+            return DEFAULT_MAX_HLA_READS.get(seq_type, 0)
+
+    def get_call_store(self):
+        """Return ``CallStore`` or ``None`` if disabled"""
+        if self.args.use_call_store and self.conf.call_store_path:
+            return call_store.CallStore(self.conf.call_store_path)
+        else:
+            return None
+
+    def lookup_calls(self, member_data):
+        """Pre-populate HLA calls of member from the call store
+
+        Sets the ``fingerprint`` of the member's input files and whether
+        its calls are ``precomputed`` in ``member_data``.  With ``--plan``,
+        the calls are not written to the work dir.
+        """
+        member_data['fingerprint'] = None
+        member_data['precomputed'] = False
+        store = self.get_call_store()
+        if not store:
+            return
+        member_data['fingerprint'] = call_store.fingerprint(
+            member_data['files'], self.conf.call_store_hash_bytes,
+            seq_type=member_data.get('seq_type', 'DNA'),
+            max_hla_reads=member_data['max_hla_reads'], version=__version__)
+        hla_types = store.get(member_data['fingerprint'])
+        if not hla_types:
+            return
+        member_data['precomputed'] = True
+        if self.args.plan:
+            return
+        # Both outputs of the typing step, so Snakemake does not type again
+        sample_dir = os.path.join(self.args.work_dir,
+                                  '{}.d'.format(member_data['name']))
+        outputs = [
+            ('hla_types.txt', ''.join(line + '\n' for line in hla_types)),
+            ('metrics.json', json.dumps(
+                {'sample': member_data['name'], 'precomputed': True},
+                sort_keys=True, indent=4)),
+        ]
+        for name, contents in outputs:
+            path = os.path.join(sample_dir, name)
+            if self.file_has_contents(path, contents):
+                continue  # keep timestamp
+            if name == 'hla_types.txt':
+                print('Using stored HLA calls for {}'.format(
+                    member_data['name']), file=sys.stderr)
+            os.makedirs(sample_dir, exist_ok=True)
+            with open(path, 'wt') as f:
+                f.write(contents)
+
+    def add_common_data(self, result):
+        """Add the settings shared by all members to ``data.json`` dict"""
+        result['config'] = self.args.config
+        result['version'] = __version__
+        result['num_threads'] = self.args.num_threads
+        result['ilp_threads'] = self.args.ilp_threads
+        result['kmer_prescreen'] = self.args.kmer_prescreen
+        result['low_scratch'] = self.args.low_scratch
+        result['keep_prefiltered'] = self.args.keep_prefiltered
+        result['call_store'] = (self.conf.call_store_path
+                                if self.get_call_store() else None)
+        result['env_snapshot'] = self.snapshot_environment()
+        result['serve_socket'] = (
+            os.path.expanduser(self.args.serve_socket)
+            if self.args.serve_socket else None)
+
+    def snapshot_environment(self):
+        """Load or take snapshot of the environment providing the tools
+
+        Return path to the snapshot in the work dir, see
+        ``hlama.environment``, or ``None`` if the tools are in ``$PATH``.
+        Raise InputDataException if setting up the environment fails.
+        """
+        if self.conf.dep_source == 'in_path':
+            return None
+        path = os.path.join(self.args.work_dir, environment.SNAPSHOT_JSON)
+        if self.args.plan:
+            # Not needed for the estimates, use existing snapshot only
+            return path if os.path.exists(path) else None
+        start = time.time()
+        try:
+            snapshot, taken = environment.load_or_take(
+                path, self.conf.cmd_prefix(), refresh=self.args.refresh_env)
+        except environment.SnapshotException as e:
+            raise InputDataException(str(e))
+        if taken:
+            print('Took environment snapshot in {:.1f}s'.format(
+                time.time() - start), file=sys.stderr)
+        for tool in snapshot.missing_tools():
+            print('WARNING: {} not found in environment'.format(tool),
+                  file=sys.stderr)
+        return path
+
+    def lookup_all_calls(self, members):
+        """Call ``lookup_calls()`` for all members concurrently"""
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.args.check_threads) as pool:
+            list(pool.map(self.lookup_calls, members))
+
+    def check_index(self, path):
+        """Check that the BAM/CRAM file at ``path`` is indexed
+
+        Raise InputDataException if no index file could be found.
+        """
+        stem, ext = os.path.splitext(path)
+        for index_ext in INDEX_EXTS[ext]:
+            if (self.path_exists(path + index_ext) or
+                    self.path_exists(stem + index_ext)):
+                return
+        raise InputDataException('No index for {} found!'.format(path))
+
+    def list_dir(self, path):
+        """Return ``frozenset`` of the entries of directory at ``path``
+
+        The listing is cached, ``None`` is returned if the directory cannot
+        be listed.
+        """
+        if path not in self.listings:
+            with self.listing_locks.setdefault(path, threading.Lock()):
+                if path not in self.listings:
+                    try:
+                        listing = frozenset(os.listdir(path or '.'))
+                    except OSError:
+                        listing = None
+                    self.listings[path] = listing
+        return self.listings[path]
+
+    def path_exists(self, path):
+        """Return whether ``path`` exists, using the cached listings"""
+        dirname, basename = os.path.split(path)
+        listing = self.list_dir(dirname)
+        if listing is None:
+            return os.path.exists(path)
+        else:
+            return basename in listing
+
+    def forget_files(self):
+        """Forget the located files and directory listings, for locating
+        files that appeared since
+        """
+        self.located = {}
+        self.listings = {}
+
+    def locate_files(self, info):
+        """Resolve the paths of all input files of ``info`` concurrently
+
+        The results are memoized for ``locate_file()``.
+        """
+        paths = sorted({path for member in info.members
+                        for path in member.data[0].split(',')})
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.args.check_threads) as pool:
+            for path, full_path in zip(
+                    paths, pool.map(self._locate_file, paths)):
+                self.located[path] = full_path
+
     def locate_file(self, path):
         """Return full path to file at given path
 
-        Will interpret ``self.args.reads_base_dirs``.
+        Will interpret ``self.args.reads_base_dirs``.  Raise
+        InputDataException if the file does not exist.
         """
-        if path.startswith('/'):
-            if not os.path.exists(path):
-                tpl = 'Missing file at absolute path {}'
-                raise InputDataException(tpl.format(path))
-            else:
-                return path
+        if path not in self.located:
+            self.located[path] = self._locate_file(path)
+        if self.located[path] is not None:
+            return self.located[path]
+        elif path.startswith('/'):
+            tpl = 'Missing file at absolute path {}'
+            raise InputDataException(tpl.format(path))
         else:
-            for base_dir in self.args.reads_base_dirs or ['.']:
-                full_path = os.path.join(base_dir, path)
-                if os.path.exists(full_path):
-                    return full_path
-            else:
-                tpl = 'Missing file at relative path {}'
-                raise InputDataException(tpl.format(path))
+            tpl = 'Missing file at relative path {}'
+            raise InputDataException(tpl.format(path))
+
+    def _locate_file(self, path):
+        """Return full path to file at given path or ``None`` if missing"""
+        if path.startswith('/'):
+            return path if self.path_exists(path) else None
+        for base_dir in self.args.reads_base_dirs or ['.']:
+            full_path = os.path.join(base_dir, path)
+            if self.path_exists(full_path):
+                return full_path
+        return None
 
 
 class SomaticApp(BaseApp):
     """Application for the case of matched somatic samples"""
 
+    #: Schema of the ``data.json`` file
+    SCHEMA = 'hla_check_pairs'
+
     def load_info(self):
         """Load config tsv and return it"""
         print('Loading tumor/normal pairs from {}...'.format(
-            self.args.tumor_normal.name), file=sys.stderr)
-        result = matched_pairs.Cohort.parse(self.args.tumor_normal)
+            self.args.tumor_normal[0].name), file=sys.stderr)
+        result = matched_pairs.Cohort.parse(self.args.tumor_normal[0])
         print('>>> pairs <<<', file=sys.stderr)
         result.print(sys.stderr)
         print('>>> /pairs <<<', file=sys.stderr)
         return result
 
-    def check_info(self, config):
-        """Check files for existence"""
-        for member in config.members:
-            paths = member.data[0].split(',')
-            if not paths:
-                tpl = 'Individual {} has no FASTQ files!'
-                raise InputDataException(tpl.format(member.name))
-            # Check that all files exist
-            resolved = []
-            for path in paths:
-                try:
-                    resolved.append(self.locate_file(path))
-                except InputDataException as e:
-                    tpl = 'Individual {} refers to non-existing path {}!'
-                    raise InputDataException(tpl.format(
-                        member.name, path))
-            # Determine single-end or paired-end mode
-            self.get_mode(resolved)
-
     def create_data_json(self, file, config):
         """Create ``data.json``"""
-        result = {'schema': 'hla_check_pairs', 'members': {}}
-        for member in config.members:
-            paths = member.data[0].split(',')
-            result['members'][member.name] = {
-                'donor': member.donor,
-                'sample': member.sample,
-                'name': member.sample,
-                'seq_type': member.seq_type,
-                'reference': member.reference_sample,
-                'files': list(map(self.locate_file, paths)),
-                'mode': self.get_mode(paths),
-            }
-        result['config'] = self.args.config
-        result['version'] = __version__
-        result['num_threads'] = self.args.num_threads
+        result = {'schema': self.SCHEMA,
+                  'members': self.build_pair_members(config)}
+        self.lookup_all_calls(result['members'].values())
+        self.add_common_data(result)
         json.dump(result, file, sort_keys=True, indent=4)
 
 
 class PedigreeApp(BaseApp):
     """Application for the case of samples from a pedigree"""
 
+    #: Schema of the ``data.json`` file
+    SCHEMA = 'hla_pedigree'
+
     def load_info(self):
         """Load pedigree and return it"""
         print('Loading pedigree from {}...'.format(
-            self.args.pedigree.name), file=sys.stderr)
-        result = pedigree.Pedigree.parse(self.args.pedigree)
+            self.args.pedigree[0].name), file=sys.stderr)
+        result = pedigree.Pedigree.parse(self.args.pedigree[0])
         print('>>> pedigree <<<', file=sys.stderr)
         result.print(sys.stderr)
         print('>>> /pedigree <<<', file=sys.stderr)
         return result
 
-    def check_info(self, pedigree):
-        """Check files for existence"""
-        for member in pedigree.members:
-            paths = member.data[0].split(',')
-            if not paths:
-                tpl = 'Individual {} has no FASTQ files!'
-                raise InputDataException(tpl.format(member.name))
-            # Check that all files exist
-            resolved = []
-            for path in paths:
-                try:
-                    resolved.append(self.locate_file(path))
-                except InputDataException as e:
-                    tpl = 'Individual {} refers to non-existing path {}!'
-                    raise InputDataException(tpl.format(
-                        member.name, path))
-            # Determine single-end or paired-end mode
-            self.get_mode(resolved)
-
     def create_data_json(self, file, pedigree):
         """Create ``data.json``"""
-        result = {'schema': 'hla_pedigree', 'members': {}}
-        for member in pedigree.members:
-            paths = member.data[0].split(',')
-            result['members'][member.name] = {
-                'family': member.family,
-                'name': member.name,
-                'father': member.father,
-                'mother': member.mother,
-                'gender': member.gender,
-                'disease': member.disease,
-                'files': list(map(self.locate_file, paths)),
-                'mode': self.get_mode(paths),
-            }
-        result['config'] = self.args.config
-        result['version'] = __version__
-        result['num_threads'] = self.args.num_threads
+        result = {'schema': self.SCHEMA,
+                  'members': self.build_pedigree_members(pedigree)}
+        self.lookup_all_calls(result['members'].values())
+        self.add_common_data(result)
         json.dump(result, file, sort_keys=True, indent=4)
 
 
+class Batch:
+    """The sheets of a batch, see ``BatchApp``"""
+
+    def __init__(self, sheets):
+        #: List of ``(name, schema, info)`` triples with the sheet name, the
+        #: ``data.json`` schema, and the ``Cohort`` or ``Pedigree``
+        self.sheets = sheets
+
+    @property
+    def members(self):
+        """Members of all sheets"""
+        return [member for _, _, info in self.sheets
+                for member in info.members]
+
+
+def sheet_name(path):
+    """Return name of the sheet at ``path``, the file name up to the first
+    dot
+    """
+    return os.path.basename(path).split('.')[0]
+
+
+class BatchApp(BaseApp):
+    """Application for multiple tumor/normal and pedigree sheets at once
+
+    All sheets share the work directory and one Snakemake run, and thus its
+    cores.  Samples listed in more than one sheet are typed once, each
+    sheet gets its own reports below ``sheets/{name}/``.
+    """
+
+    RESULT = 'sheets/*/report.txt'
+
+    #: Schema of the ``data.json`` file
+    SCHEMA = 'hla_batch'
+
+    #: Keys of the member entries shared by all sheets
+    TYPING_KEYS = ('name', 'files', 'mode', 'max_hla_reads', 'seq_type')
+
+    def load_info(self):
+        """Load all sheets and return ``Batch``"""
+        sheets = []
+        for schema, files, parse in (
+                ('hla_check_pairs', self.args.tumor_normal,
+                 matched_pairs.Cohort.parse),
+                ('hla_pedigree', self.args.pedigree,
+                 pedigree.Pedigree.parse)):
+            for f in files or []:
+                print('Loading sheet {}...'.format(f.name), file=sys.stderr)
+                sheets.append((sheet_name(f.name), schema, parse(f)))
+        names = [name for name, _, _ in sheets]
+        for name in sorted(set(names)):
+            if names.count(name) > 1:
+                raise InputDataException(
+                    'More than one sheet with the name {}'.format(name))
+        return Batch(sheets)
+
+    def create_data_json(self, file, batch):
+        """Create ``data.json``"""
+        result = {'schema': self.SCHEMA, 'members': {}, 'sheets': {}}
+        for name, schema, info in batch.sheets:
+            if schema == 'hla_check_pairs':
+                members = self.build_pair_members(info)
+            else:
+                members = self.build_pedigree_members(info)
+            result['sheets'][name] = {'schema': schema, 'members': members}
+            for member_name, member in members.items():
+                typing = {key: member.get(key, 'DNA')
+                          for key in self.TYPING_KEYS}
+                if result['members'].setdefault(
+                        member_name, typing) != typing:
+                    raise InputDataException(
+                        ('Sample {} is listed with different input files or '
+                         'sequence types in more than one sheet').format(
+                             member_name))
+        print('Batch of {} sheets with {} distinct samples'.format(
+            len(result['sheets']), len(result['members'])), file=sys.stderr)
+        self.lookup_all_calls(result['members'].values())
+        self.add_common_data(result)
+        json.dump(result, file, sort_keys=True, indent=4)
+
+
+def make_app(args):
+    """Return application for the sheets in the command line arguments"""
+    if len(args.tumor_normal or []) + len(args.pedigree or []) > 1:
+        return BatchApp(args)
+    elif args.tumor_normal:
+        return SomaticApp(args)
+    else:
+        return PedigreeApp(args)
+
+
 def run(args):
     """Main entry point after parsing command line parameters"""
     try:
-        if args.tumor_normal:
-            return SomaticApp(args).run()
-        else:
-            return PedigreeApp(args).run()
+        return make_app(args).run()
     except InputDataException as e:
         print('ERROR: {}'.format(e), file=sys.stderr)
         return 1
 
 
-def main(argv=None):
-    """Main entry point into the hlama application
-
-    Parse command line and then call ``run()`` for the actual processing.
-    """
-    parser = argparse.ArgumentParser(
-        description='HLA-typing based HTS sample matching')
+#: Sub commands, mapping name to module with ``main(argv)`` function
+COMMANDS = {
+    'identify': 'hlama.identify',
+    'serve': 'hlama.serve',
+    'stats': 'hlama.stats',
+    'watch': 'hlama.watch',
+}
 
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument('--tumor-normal', type=argparse.FileType('rt'),
-                       help=('Path to tumor/normal TSV file, '
-                             'starts tumor/normal mode'))
-    group.add_argument('--pedigree', type=argparse.FileType('rt'),
-                       help=('Path to pedigree file, starts pedigree '
-                             'mode'))
 
+def add_sheet_args(parser):
+    """Add arguments for the tumor/normal and pedigree sheets to ``parser``
+    """
+    parser.add_argument('--tumor-normal', type=argparse.FileType('rt'),
+                        action='append',
+                        help=('Path to tumor/normal TSV file, starts '
+                              'tumor/normal mode, give multiple times '
+                              'together with --pedigree for batch mode'))
+    parser.add_argument('--pedigree', type=argparse.FileType('rt'),
+                        action='append',
+                        help=('Path to pedigree file, starts pedigree '
+                              'mode, give multiple times together with '
+                              '--tumor-normal for batch mode'))
+
+
+def add_common_args(parser, work_dir='hlama_work'):
+    """Add arguments for configuring and running the typing to ``parser``
+    """
     parser.add_argument('--config', type=str,
                         help=('Optional explicit path to configuration '
                               'file, by default ~/.hlama.cfg is searched '
                               'for'))
 
-    parser.add_argument('--work-dir', type=str, default='hlama_work',
+    parser.add_argument('--work-dir', type=str, default=work_dir,
                         help='Directory to create the Snakefile in')
     parser.add_argument('--reads-base-dir', type=str, action='append',
                         dest='reads_base_dirs', default=[],
                         help=('Base directory for reads, give multiple '
                               'times for multiple places to search'))
 
+    parser.add_argument('--check-threads', type=int, default=16,
+                        help=('Number of threads for locating and checking '
+                              'input files, defaults to 16'))
+
+    parser.add_argument('--update', default=False, action='store_true',
+                        help=('Update existing work directory, only typing '
+                              'new and changed members and re-creating the '
+                              'affected parts of the report'))
+
+    parser.add_argument('--refresh-env', default=False, action='store_true',
+                        help=('Set up the environment of the tools again '
+                              'instead of using the snapshot in the work '
+                              'directory'))
+
+    parser.add_argument('--plan', default=False, action='store_true',
+                        help=('Only print the estimated cost of typing each '
+                              'member and the predicted core-hours, '
+                              'without updating data.json or running '
+                              'Snakemake'))
+
     parser.add_argument('--dont-run-snakemake', dest='run_snakemake',
                         default=True, action='store_false',
                         help=('Only create Snakefile but do not run '
@@ -337,15 +827,93 @@ def main(argv=None):
                         default=True, action='store_false',
                         help='Disable input checks')
 
-    parser.add_argument('--num-threads', default=1,
+    parser.add_argument('--num-threads', default=1, type=int,
                         help=('Number of threads to use for read mapping, '
                               ' defaults to 1'))
+    parser.add_argument('--ilp-threads', default=1, type=int,
+                        help=('Number of threads for the ILP solver of '
+                              'OptiType, defaults to 1'))
+    parser.add_argument('--kmer-prescreen', default=False,
+                        action='store_true',
+                        help=('Drop reads without any k-mer of the HLA '
+                              'reference before mapping them with Yara'))
+    parser.add_argument('--low-scratch', default=False,
+                        action='store_true',
+                        help=('Keep the pre-filtered reads compressed with '
+                              'pigz, for nodes with little local scratch '
+                              'space'))
+    parser.add_argument('--keep-prefiltered', default=False,
+                        action='store_true',
+                        help=('Keep the pre-filtered reads of the lanes '
+                              'after typing, by default they are removed '
+                              'once the sample is typed'))
+    parser.add_argument('--max-hla-reads', type=int, default=None,
+                        help=('Maximal number of HLA reads (or pairs) to '
+                              'pass to OptiType, 0 for no limit, defaults '
+                              'to {DNA} for DNA and {RNA} for RNA').format(
+                                  **DEFAULT_MAX_HLA_READS))
+    parser.add_argument('--no-call-store', dest='use_call_store',
+                        default=True, action='store_false',
+                        help=('Do not use HLA calls from and do not add '
+                              'HLA calls to the call store'))
+    parser.add_argument('--cores', default=1, type=int,
+                        help=('Number of cores Snakemake may use for '
+                              'running jobs concurrently, e.g., the '
+                              'pre-filtering of the lanes, defaults to 1'))
+    parser.add_argument('--serve-socket', type=str, default=None,
+                        help=('Run the typing jobs in the "hlama serve" '
+                              'daemon at this socket when it is running, '
+                              'e.g., {}, by default the jobs run '
+                              'themselves').format(serve.DEFAULT_SOCKET))
+    parser.add_argument('--cluster', type=str, default=None,
+                        help=('Submit jobs with the given command, e.g., '
+                              '"sbatch -c {threads} --mem {resources.mem_mb}"'
+                              ', see Snakemake\'s --cluster'))
+    parser.add_argument('--jobs', default=100, type=int,
+                        help=('Maximal number of concurrent cluster jobs, '
+                              'defaults to 100'))
+    parser.add_argument('--group-size', default=1, type=int,
+                        help=('Number of samples whose typing jobs are '
+                              'submitted as one cluster job, defaults to 1'))
+    parser.add_argument('--restart-times', default=0, type=int,
+                        help=('Number of times to restart failing jobs, '
+                              'with more memory each time, defaults to 0'))
+
+
+def make_paths_absolute(args):
+    """Make paths in parsed common arguments absolute"""
+    args.reads_base_dirs = [os.path.abspath(d) for d in args.reads_base_dirs]
+    args.work_dir = os.path.abspath(args.work_dir)
+
+
+def main(argv=None):
+    """Main entry point into the hlama application
+
+    Parse command line and then call ``run()`` for the actual processing.
+    If the first argument is the name of a sub command (see ``COMMANDS``),
+    the sub command's ``main()`` is called with the remaining arguments.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        module = importlib.import_module(COMMANDS[argv[0]])
+        return module.main(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        description='HLA-typing based HTS sample matching',
+        epilog='sub commands: {}, use "hlama COMMAND --help" for help'.format(
+            ', '.join(sorted(COMMANDS))))
+
+    add_sheet_args(parser)
+    add_common_args(parser)
 
     args = parser.parse_args(argv)
+    if not (args.tumor_normal or args.pedigree):
+        parser.error('at least one --tumor-normal or --pedigree file is '
+                     'required')
 
     # Make paths absolute
-    args.reads_base_dirs = [os.path.abspath(d) for d in args.reads_base_dirs]
-    args.work_dir = os.path.abspath(args.work_dir)
+    make_paths_absolute(args)
 
     return run(args)
 
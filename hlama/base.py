@@ -1,35 +1,113 @@
 # -*- coding: utf-8 -*-
 """Code usable for both somatic and pedigree sample checking"""
 
+import functools
+import os
 import re
+import threading
+
+#: Regular expression for HLA type strings
+HLA_RE = re.compile(r'(?:HLA-)?([ABC]+)(?:\*(\d+)(?::(\d+))?)?')
+
+#: The HLA genes that are typed
+GENES = 'ABC'
+
+# Single-end mode
+SINGLE_END = 'single-end'
+# Paired-end mode
+PAIRED_END = 'paired-end'
+# Reads are extracted from coordinate-sorted and indexed BAM/CRAM files
+ALIGNED = 'aligned'
+
+# Patterns for first read
+PATTERNS_R1 = [
+    '*_1*.fastq.gz', '*_1*.fq.gz', '*_R1_*.fq.gz', '*_R1_*.fastq.gz',
+    '*_R1.fastq.gz',
+    '*_1*.fastq', '*_1*.fq', '*_R1_*.fq', '*_R1_*.fastq',
+]
+# Patterns for second read
+PATTERNS_R2 = [
+    '*_2*.fastq.gz', '*_2*.fq.gz', '*_R2_*.fq.gz', '*_R2_*.fastq.gz',
+    '*_R2.fastq.gz',
+    '*_2*.fastq', '*_2*.fq', '*_R2_*.fq', '*_R2_*.fastq',
+]
+# Patterns for aligned reads
+PATTERNS_ALIGNED = ['*.bam', '*.cram']
+# Extensions of BAM/CRAM index files, appended to the full or the stripped
+# file name
+INDEX_EXTS = {'.bam': ('.bai', '.csi'), '.cram': ('.crai',)}
+
+#: Maximal number of ``hla_types.txt`` file versions cached by
+#: ``load_calls()``
+CALLS_CACHE_SIZE = 100000
+
+#: Integer keys of the (gene, two digits, four digits) prefixes, local to
+#: the process
+_KEYS = {}
+#: Protects assigning new keys, calls are parsed in threads
+_KEYS_LOCK = threading.Lock()
+
+
+def _intern_key(prefix):
+    """Return integer key for the given prefix tuple"""
+    key = _KEYS.get(prefix)
+    if key is None:
+        with _KEYS_LOCK:
+            key = _KEYS.setdefault(prefix, len(_KEYS))
+    return key
 
 
 class HLAType:
-    """Representation of an HLA type (up to 4 digits)"""
+    """Representation of an HLA type (up to 4 digits)
+
+    Objects are immutable and interned by ``parse()``.  The integer keys
+    for comparing at 0, 2, and 4 digits precision are computed once, see
+    ``key()``.
+    """
+
+    __slots__ = ('gene_name', 'two_digits', 'four_digits', 'keys')
+
+    #: Interned ``HLAType`` objects by parsed string
+    _parsed = {}
 
     @classmethod
     def parse(klass, hla_str):
-        m = re.match(r'(?:HLA-)?([ABC]+)(?:\*(\d+)(?::(\d+))?)?', hla_str)
-        if not m:
-            raise RuntimeError('HLA string invalid {}'.format(hla_str))
-        return HLAType(*list(m.groups()))
+        result = klass._parsed.get(hla_str)
+        if result is None:
+            m = HLA_RE.match(hla_str)
+            if not m:
+                raise RuntimeError('HLA string invalid {}'.format(hla_str))
+            result = klass._parsed.setdefault(
+                hla_str, HLAType(*list(m.groups())))
+        return result
 
     def __init__(self, gene_name, two_digits=None, four_digits=None):
         self.gene_name = gene_name
         self.two_digits = two_digits
         self.four_digits = four_digits
+        #: Integer keys for precision 0, 2, and 4, with the same fallback
+        #: to lower precision as ``prec_str()``
+        key_0 = _intern_key((gene_name,))
+        key_2 = _intern_key((gene_name, two_digits)) if two_digits else key_0
+        key_4 = (_intern_key((gene_name, two_digits, four_digits))
+                 if two_digits and four_digits else key_2)
+        self.keys = (key_0, key_2, key_4)
+
+    def __reduce__(self):
+        # The keys are local to the process and computed again on unpickling
+        return (HLAType, (self.gene_name, self.two_digits, self.four_digits))
 
     def __lt__(self, other):
         return ((self.gene_name, self.two_digits, self.four_digits) <
                 (other.gene_name, other.two_digits, other.four_digits))
 
     def __eq__(self, other):
-        return ((self.gene_name, self.two_digits, self.four_digits) ==
-                (other.gene_name, other.two_digits, other.four_digits))
+        if not isinstance(other, HLAType):
+            return NotImplemented
+        return self.keys[2] == other.keys[2]
 
     def __hash__(self):
-        return (hash(self.gene_name) ^ hash(self.two_digits) ^
-                hash(self.four_digits))
+        return hash(self.keys[2])
 
     def same_gene(self, other):
         """Return whether the genes equal"""
@@ -45,6 +123,10 @@ class HLAType:
         return (self.equal_two_digits(other) and
                 self.four_digits == other.four_digits)
 
+    def key(self, precision):
+        """Return integer key, equal for equal ``prec_str(precision)``"""
+        return self.keys[precision // 2]
+
     def prec_str(self, precision):
         """Precision string"""
         assert precision in (0, 2, 4)
@@ -69,3 +151,27 @@ class HLAType:
             return 'HLA-{self.gene_name}*{self.two_digits}'.format(self=self)
         else:
             return 'HLA-{self.gene_name}'.format(self=self)
+
+
+def load_calls(path):
+    """Return tuple of ``HLAType`` objects from ``hla_types.txt`` file
+
+    The result is cached by absolute path, modification time, and size, so
+    each version of a file is only read and parsed once, also when reading
+    the files of several work directories or of retyped samples in one
+    process.
+    """
+    stat = os.stat(path)
+    return _load_calls(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=CALLS_CACHE_SIZE)
+def _load_calls(path, mtime_ns, size):
+    with open(path, 'rt') as f:
+        return tuple(HLAType.parse(line.strip()) for line in f
+                     if line.strip())
+
+
+def clear_calls_cache():
+    """Clear the cache of ``load_calls()``, e.g., for benchmarks"""
+    _load_calls.cache_clear()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""SQLite-backed store of HLA calls shared between work directories
+
+The same sample often appears in several tumor/normal and pedigree files.
+The store keeps the calls of each sample keyed by a fingerprint of its
+input files, the sequence type and the hlama version, so a sample is only
+typed once as long as its input files do not change.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Schema of the database
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    fingerprint TEXT PRIMARY KEY,
+    hla_types TEXT NOT NULL,
+    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def fingerprint(paths, hash_bytes=0, **kwargs):
+    """Return fingerprint of the files at ``paths``
+
+    The fingerprint covers path, size and modification time of each file
+    and, if ``hash_bytes`` is positive, the first and last ``hash_bytes``
+    bytes of the file.  The keyword arguments (e.g., ``seq_type`` and
+    ``version``) are included as well.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(json.dumps(
+            [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]).encode())
+        if hash_bytes > 0:
+            with open(path, 'rb') as f:
+                digest.update(f.read(hash_bytes))
+                if stat.st_size > 2 * hash_bytes:
+                    f.seek(-hash_bytes, os.SEEK_END)
+                    digest.update(f.read(hash_bytes))
+    digest.update(json.dumps(kwargs, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class CallStore:
+    """Store of HLA calls in an SQLite database"""
+
+    def __init__(self, path):
+        #: Path to the database
+        self.path = path
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Open connection to the database, committing on success"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                conn.execute(SCHEMA)
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, fingerprint):
+        """Return list of HLA type strings or ``None`` if unknown"""
+        with self.connect() as conn:
+            row = conn.execute(
+                'SELECT hla_types FROM calls WHERE fingerprint = ?',
+                (fingerprint,)).fetchone()
+        return row[0].splitlines() if row else None
+
+    def put(self, fingerprint, hla_types):
+        """Store list of HLA type strings for the fingerprint"""
+        with self.connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO calls (fingerprint, hla_types) '
+                'VALUES (?, ?)', (fingerprint, '\n'.join(hla_types)))
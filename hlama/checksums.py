@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Durable, checksummed intermediate files
+
+The pre-filtered reads of each lane are kept in ``{sample}.d/prefilter/``
+until the sample has been typed, so a failed or preempted typing job only
+redoes the missing lanes and OptiType.  For relying on the kept files, the
+pre-filtering job flushes them to disk and records their SHA-256 checksums
+in its metrics (see ``seal()``), and the typing job verifies them before
+using them (see ``verify()``).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Size of the chunks read for computing checksums
+CHUNK_SIZE = 1024 * 1024
+
+
+class ChecksumException(Exception):
+    """Raised when intermediate files are missing or do not match their
+    checksums
+    """
+
+
+def sha256(path):
+    """Return hex SHA-256 digest of the file at ``path``"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync(path):
+    """Flush the file or directory at ``path`` to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def seal(paths):
+    """Flush the files at ``paths`` to disk and return their checksums
+
+    Return ``dict`` with the hex SHA-256 digest by path.
+    """
+    result = {}
+    for path in paths:
+        _fsync(path)
+        result[path] = sha256(path)
+    for dir_path in sorted({os.path.dirname(os.path.abspath(path))
+                            for path in paths}):
+        _fsync(dir_path)
+    return result
+
+
+def verify(checksums):
+    """Return sorted paths of ``checksums`` that are missing or differ"""
+    return sorted(path for path, digest in checksums.items()
+                  if not os.path.exists(path) or sha256(path) != digest)
+
+
+def write_json(path, data):
+    """Write ``data`` as JSON to ``path`` atomically and durably"""
+    dir_path = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+            'wt', dir=dir_path, suffix='.json', delete=False) as f:
+        json.dump(data, f, sort_keys=True, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+    _fsync(dir_path)
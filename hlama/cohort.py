@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""All-vs-all comparison of the HLA calls of a cohort
+
+Sample swaps between unrelated donors cannot be found by only checking the
+declared pairs and trios.  This module compares the calls of all samples
+with each other.  The alleles are encoded as integers and the distances are
+computed block-wise with NumPy, so cohorts with 10k+ samples are compared
+in seconds.
+"""
+
+import numpy as np
+
+from .base import GENES
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Number of alleles per gene
+PLOIDY = 2
+#: Code for missing alleles
+MISSING = -1
+
+
+def encode_calls(calls, precision):
+    """Encode calls of samples as integer matrix
+
+    ``calls`` is a list with a list of ``HLAType`` objects for each sample.
+    Return ``numpy.int64`` matrix of the allele keys (see
+    ``HLAType.key()``) with one row per sample and two sorted columns per
+    gene, missing alleles come last.
+    """
+    codes = np.full((len(calls), len(GENES) * PLOIDY), MISSING,
+                    dtype=np.int64)
+    for row, sample_calls in enumerate(calls):
+        for col, gene in enumerate(GENES):
+            gene_codes = sorted(hla.key(precision) for hla in sample_calls
+                                if hla.gene_name == gene)
+            gene_codes = gene_codes[:PLOIDY]
+            codes[row, col * PLOIDY:col * PLOIDY + len(gene_codes)] = \
+                gene_codes
+    return codes
+
+
+def distances(lhs, rhs):
+    """Return matrix of allele mismatches between rows of ``lhs`` and ``rhs``
+
+    The distance is the number of alleles (out of six) that are not shared
+    by the two samples, missing alleles never match.
+    """
+    # Use a different code for missing alleles on the right so they never
+    # compare equal to the ones on the left
+    rhs = np.where(rhs == MISSING, MISSING - 1, rhs)
+    result = np.full((len(lhs), len(rhs)), len(GENES) * PLOIDY,
+                     dtype=np.int8)
+    for col in range(0, len(GENES) * PLOIDY, PLOIDY):
+        a1, a2 = lhs[:, np.newaxis, col], lhs[:, np.newaxis, col + 1]
+        b1, b2 = rhs[np.newaxis, :, col], rhs[np.newaxis, :, col + 1]
+        # Size of the intersection of the sorted allele pairs: if any
+        # allele matches at the same position, the matches at the same
+        # positions, else the crosswise matches
+        direct = (a1 == b1).view(np.int8) + (a2 == b2).view(np.int8)
+        cross = (a1 == b2).view(np.int8) + (a2 == b1).view(np.int8)
+        result -= np.where(direct > 0, direct, cross)
+    return result
+
+
+def compare_all(names, calls, groups, max_distance=1, block_size=1024,
+                out_2=None, out_4=None):
+    """Compare all samples with each other
+
+    ``groups`` gives the group of each sample; samples in the same group
+    (e.g., tumor and normal of the same donor) are expected to match.
+    Pairs from different groups with a four-digit distance of at most
+    ``max_distance`` are returned as suspicious, as list of tuples of the
+    two names and the two- and four-digit distances, sorted by distance.
+
+    If given, the full distance matrices are written to the writable
+    ``(N, N)`` arrays ``out_2`` and ``out_4``, e.g., memory-mapped ``.npy``
+    files.
+    """
+    codes_2 = encode_calls(calls, 2)
+    codes_4 = encode_calls(calls, 4)
+    # Smaller integers compare faster
+    if codes_4.max(initial=0) < np.iinfo(np.int16).max:
+        codes_2 = codes_2.astype(np.int16)
+        codes_4 = codes_4.astype(np.int16)
+    group_codes = {}
+    group_ids = np.array([group_codes.setdefault(group, len(group_codes))
+                          for group in groups], dtype=np.int64)
+    suspicious = []
+    for begin in range(0, len(names), block_size):
+        end = min(begin + block_size, len(names))
+        dist_2 = distances(codes_2[begin:end], codes_2)
+        dist_4 = distances(codes_4[begin:end], codes_4)
+        if out_2 is not None:
+            out_2[begin:end] = dist_2
+        if out_4 is not None:
+            out_4[begin:end] = dist_4
+        # Only consider each pair once and only pairs across groups
+        rows, cols = np.nonzero(dist_4 <= max_distance)
+        rows += begin
+        keep = (rows < cols) & (group_ids[rows] != group_ids[cols])
+        for row, col in zip(rows[keep], cols[keep]):
+            suspicious.append((names[row], names[col],
+                               int(dist_2[row - begin, col]),
+                               int(dist_4[row - begin, col])))
+    return sorted(suspicious, key=lambda x: (x[3], x[2], x[0], x[1]))
+
+
+def write_report(f, suspicious):
+    """Write ranked list of suspicious matches to file-like object ``f``"""
+    for lhs, rhs, dist_2, dist_4 in suspicious:
+        print('\t'.join(map(str, [lhs, rhs, dist_2, dist_4])), file=f)
@@ -11,6 +11,7 @@ of HLA-MA.
 """
 
 import configparser
+import os
 
 __author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
 
@@ -24,6 +25,21 @@ class Configuration:
         config.read(path)
         return Configuration(config)
 
+    @classmethod
+    def find(klass, path=None):
+        """Load configuration from ``path`` or the default location
+
+        Without ``path``, ``~/.hlama.cfg`` is used if it exists and the
+        ``default_config.ini`` shipped with hlama otherwise.
+        """
+        if path:
+            return klass.load(path)
+        elif os.path.exists(os.path.expanduser('~/.hlama.cfg')):
+            return klass.load(os.path.expanduser('~/.hlama.cfg'))
+        else:
+            return klass.load(os.path.join(
+                os.path.dirname(__file__), 'default_config.ini'))
+
     def __init__(self, config):
         """Load configuration with values from the given path"""
         self.config = config
@@ -32,6 +48,13 @@ class Configuration:
     def dep_source(self):
         return self.config.get('hlama', 'dep_source', fallback='in_path')
 
+    @property
+    def index_cache_path(self):
+        """Path to the shared Yara index cache, ``None`` if disabled"""
+        path = self.config.get('hlama.index_cache', 'path',
+                               fallback='~/.cache/hlama/yara')
+        return path or None
+
     def cmd_prefix(self):
         """Return necessary command prefix"""
         if self.dep_source == 'bioconda':
@@ -54,3 +77,28 @@ class Configuration:
             return '# Load environment modules\n{}'.format(s)
         else:
             return '# Dependencies are assumed to be in env PATH'
+
+    @property
+    def call_store_path(self):
+        """Path to the HLA call store database, ``None`` if disabled"""
+        path = self.config.get('hlama.call_store', 'path', fallback='')
+        return os.path.expanduser(path) if path else None
+
+    @property
+    def call_store_hash_bytes(self):
+        """Number of bytes from start and end of files to fingerprint"""
+        return self.config.getint('hlama.call_store', 'hash_bytes',
+                                  fallback=1024 * 1024)
+
+    @property
+    def mhc_regions(self):
+        """Regions to extract reads from BAM/CRAM files from"""
+        return self.config.get(
+            'hlama.aligned_input', 'mhc_regions',
+            fallback='chr6:28477797-33480577 6:28477797-33480577').split()
+
+    @property
+    def cram_reference(self):
+        """Path to reference FASTA for decoding CRAM files or ``None``"""
+        return self.config.get('hlama.aligned_input', 'reference',
+                               fallback=None) or None
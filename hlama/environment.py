@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Snapshot of the environment providing the external tools
+
+Activating a Conda environment or loading environment modules takes
+seconds, which adds up over thousands of jobs.  Instead of running the
+configured command prefix (see ``Configuration.cmd_prefix()``) in each
+job, it is run once when ``hlama`` is launched.  The environment variables
+it sets or unsets and the absolute paths of the tools are kept in the work
+directory:
+
+- ``env.json`` with the snapshot, including the command prefix it was
+  taken for, so changing the configuration takes a new snapshot
+- ``env.sh`` for sourcing in the jobs instead of the command prefix
+"""
+
+import json
+import os
+import re
+import shlex
+import subprocess
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: File names of the snapshot and the script to source in the work dir
+SNAPSHOT_JSON = 'env.json'
+SNAPSHOT_SH = 'env.sh'
+#: The external tools called by the Snakefile
+TOOLS = ('yara_indexer', 'yara_mapper', 'samtools', 'razers3',
+         'OptiTypePipeline.py', 'pigz')
+#: Variables of the shell itself that are not part of the snapshot
+IGNORED = ('_', 'PWD', 'OLDPWD', 'SHLVL')
+#: Separates the environment before and after running the prefix
+SEPARATOR = '--hlama-snapshot--'
+#: Regular expression for names of variables, e.g., not exported Bash
+#: functions such as ``BASH_FUNC_module%%``
+NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class SnapshotException(Exception):
+    """Raised when running the command prefix fails"""
+
+
+class EnvSnapshot:
+    """Environment variables and tool paths set up by a command prefix"""
+
+    def __init__(self, cmd_prefix, set_vars, unset_vars, tools):
+        #: The command prefix the snapshot was taken for
+        self.cmd_prefix = cmd_prefix
+        #: Value by name of the variables set or changed by the prefix
+        self.set_vars = dict(set_vars)
+        #: Names of the variables unset by the prefix
+        self.unset_vars = sorted(unset_vars)
+        #: Absolute path by tool name, ``None`` for tools not found
+        self.tools = dict(tools)
+
+    @classmethod
+    def take(klass, cmd_prefix, tools=TOOLS):
+        """Run ``cmd_prefix`` in Bash and return snapshot of its effect"""
+        # The output of the prefix itself goes to stderr
+        script = '\n'.join([
+            'set -e', 'env -0', 'printf "\\0{}\\0"'.format(SEPARATOR),
+            '{', cmd_prefix, '} >&2',
+            'printf "\\0{}\\0"'.format(SEPARATOR), 'env -0',
+            'printf "\\0{}\\0"'.format(SEPARATOR)] + [
+                'printf "%s\\0" "$(command -v {})"'.format(shlex.quote(tool))
+                for tool in tools])
+        proc = subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise SnapshotException(
+                'Setting up the environment failed:\n{}'.format(
+                    proc.stderr.decode('utf-8', 'replace')))
+        before, _, after, paths = proc.stdout.decode('utf-8').split(
+            '\0{}\0'.format(SEPARATOR))
+        before, after = _parse_env(before), _parse_env(after)
+        set_vars = {name: value for name, value in after.items()
+                    if before.get(name) != value and name not in IGNORED}
+        unset_vars = [name for name in before
+                      if name not in after and name not in IGNORED]
+        tools = {tool: path or None
+                 for tool, path in zip(tools, paths.split('\0'))}
+        return klass(cmd_prefix, set_vars, unset_vars, tools)
+
+    @classmethod
+    def load(klass, path):
+        """Load snapshot from JSON file at ``path``"""
+        with open(path, 'rt') as f:
+            data = json.load(f)
+        return klass(data['cmd_prefix'], data['set'], data['unset'],
+                     data['tools'])
+
+    def save(self, path):
+        """Write snapshot to JSON file at ``path`` and the script to source
+        next to it
+        """
+        with open(path, 'wt') as f:
+            json.dump({'cmd_prefix': self.cmd_prefix, 'set': self.set_vars,
+                       'unset': self.unset_vars, 'tools': self.tools},
+                      f, sort_keys=True, indent=4)
+        with open(script_path(path), 'wt') as f:
+            f.write(self.to_script())
+
+    def to_script(self):
+        """Return Bash script reproducing the snapshot"""
+        lines = ['# Environment snapshot taken by hlama, see env.json']
+        lines += ['unset {}'.format(name) for name in self.unset_vars]
+        lines += ['export {}={}'.format(name, shlex.quote(value))
+                  for name, value in sorted(self.set_vars.items())]
+        return '\n'.join(lines) + '\n'
+
+    def missing_tools(self):
+        """Return names of the tools not found in the environment"""
+        return sorted(tool for tool, path in self.tools.items() if not path)
+
+
+def _parse_env(text):
+    """Parse output of ``env -0`` into ``dict``"""
+    result = {}
+    for entry in text.split('\0'):
+        name, sep, value = entry.partition('=')
+        if sep and NAME_RE.match(name):
+            result[name] = value
+    return result
+
+
+def script_path(path):
+    """Return path of the script to source for the snapshot at ``path``"""
+    return os.path.join(os.path.dirname(path), SNAPSHOT_SH)
+
+
+def load_or_take(path, cmd_prefix, refresh=False):
+    """Return snapshot for ``cmd_prefix`` cached at ``path``
+
+    A new snapshot is taken and written if there is none, if it was taken
+    for another command prefix, or if ``refresh`` is set.  Return pair of
+    the snapshot and whether it was taken anew.
+    """
+    if not refresh and os.path.exists(path):
+        snapshot = EnvSnapshot.load(path)
+        if (snapshot.cmd_prefix == cmd_prefix and
+                os.path.exists(script_path(path))):
+            return snapshot, False
+    snapshot = EnvSnapshot.take(cmd_prefix)
+    snapshot.save(path)
+    return snapshot, True
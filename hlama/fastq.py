@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Helpers for reading and merging FASTQ files"""
+
+import contextlib
+import gzip
+import itertools
+import re
+import subprocess
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Default maximal number of HLA reads (or pairs) per sequence type
+DEFAULT_MAX_HLA_READS = {
+    'DNA': 500000,
+    'RNA': 1000000,
+}
+
+#: Regular expression for the read name in a FASTQ header line, without
+#: the optional "/1" or "/2" suffix
+NAME_RE = re.compile(rb'@(\S+?)(?:/[12])?(?:\s|$)')
+#: Number of reads (or pairs) per chunk when splitting lanes with a read
+#: budget
+CHUNK_SIZE = 1000000
+
+
+def open_fastq(path, mode='rb'):
+    """Open (gzip-compressed) FASTA or FASTQ file with a large buffer"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    else:
+        return open(path, mode, buffering=4 * 1024 * 1024)
+
+
+@contextlib.contextmanager
+def open_compressed(path, threads, cmd_prefix=''):
+    """Open ``path`` for writing binary data compressed by ``pigz``
+
+    ``pigz`` runs with ``threads`` threads in a Bash shell after running
+    ``cmd_prefix``, e.g., for activating the environment providing it.
+    """
+    with open(path, 'wb') as out:
+        proc = subprocess.Popen(
+            '{}\npigz -1 -p {}'.format(cmd_prefix, threads), shell=True,
+            executable='/bin/bash', stdin=subprocess.PIPE, stdout=out)
+    try:
+        yield proc.stdin
+    finally:
+        proc.stdin.close()
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def has_records(path):
+    """Return whether the (gzip-compressed) FASTQ file has any records"""
+    with open_fastq(path) as f:
+        return bool(f.read(1))
+
+
+def count_records(path):
+    """Return number of records in (gzip-compressed) FASTQ file"""
+    with open_fastq(path) as f:
+        return sum(1 for _ in f) // 4
+
+
+def read_chunk(f, chunk_size):
+    """Return list of FASTQ records (lists of four lines) from ``f``"""
+    lines = list(itertools.islice(f, 4 * chunk_size))
+    if len(lines) % 4:
+        raise ValueError('Truncated FASTQ file {}'.format(f.name))
+    return [lines[i:i + 4] for i in range(0, len(lines), 4)]
+
+
+def read_records(f, chunk_size=10000):
+    """Yield FASTQ records (lists of four lines) from ``f``"""
+    while True:
+        chunk = read_chunk(f, chunk_size)
+        if not chunk:
+            return
+        yield from chunk
+
+
+def read_name(record):
+    """Return read name of FASTQ record without "/1" or "/2" suffix"""
+    m = NAME_RE.match(record[0])
+    if not m:
+        raise ValueError('Invalid FASTQ header {}'.format(record[0]))
+    return m.group(1)
+
+
+def split_lane(in_paths, chunk_paths, chunk_size=CHUNK_SIZE, opener=None):
+    """Split the reads of a lane into chunks of ``chunk_size`` reads (or
+    pairs)
+
+    ``in_paths`` contains the path to one FASTQ file or the paths of the
+    first and second reads of a pair, which are read together.  Each chunk
+    is written to ``chunk_paths``, replacing the previous one, before
+    yielding the number of reads (or pairs) in it.  Reading stops when the
+    caller stops iterating.  The chunk files are opened with
+    ``opener(path)``, by default as plain binary files.
+    """
+    opener = opener or (lambda path: open(path, 'wb'))
+    ins = [open_fastq(path) for path in in_paths]
+    try:
+        while True:
+            chunks = [read_chunk(f, chunk_size) for f in ins]
+            if len(set(map(len, chunks))) != 1:
+                raise ValueError('Different number of reads in {}'.format(
+                    ', '.join(in_paths)))
+            if not chunks[0]:
+                return
+            for chunk, path in zip(chunks, chunk_paths):
+                with opener(path) as out:
+                    out.writelines(itertools.chain.from_iterable(chunk))
+            yield len(chunks[0])
+    finally:
+        for f in ins:
+            f.close()
+
+
+class ReadBudget:
+    """Collect the first ``max_reads`` pre-filtered reads (or pairs) of a
+    lane
+
+    The chunks of the lane are added in order, each with the first and
+    second reads pre-filtered independently such that either mate may be
+    missing.  In each chunk, the reads are selected by name, first reads in
+    order and then second reads whose mate was dropped, a pair counting
+    once, and written with their mates to ``outs``, the binary files of
+    the first and second reads.
+    """
+
+    def __init__(self, outs, max_reads):
+        #: The output files of the first and second reads
+        self.outs = outs
+        #: The maximal number of reads (or pairs) to collect
+        self.max_reads = max_reads
+        #: The number of reads (or pairs) collected
+        self.num_reads = 0
+        #: Whether reads were dropped because of the budget
+        self.truncated = False
+
+    @property
+    def full(self):
+        """Whether the budget is used up"""
+        return self.num_reads >= self.max_reads
+
+    def add(self, in_paths):
+        """Add the pre-filtered reads of the chunk at ``in_paths``"""
+        names = set()
+        for path in in_paths:
+            with open_fastq(path) as f:
+                for record in read_records(f):
+                    name = read_name(record)
+                    if name in names:
+                        continue
+                    elif self.num_reads + len(names) >= self.max_reads:
+                        self.truncated = True
+                        break
+                    names.add(name)
+        for path, out in zip(in_paths, self.outs):
+            with open_fastq(path) as f:
+                for record in read_records(f):
+                    if read_name(record) in names:
+                        out.writelines(record)
+        self.num_reads += len(names)
+
+    def to_dict(self):
+        """Return ``dict`` with the number of reads collected and whether
+        reads were dropped
+        """
+        return {'hla_reads': self.num_reads, 'truncated': self.truncated}
+
+
+def merge_lanes(lanes, out_paths, max_reads=0, opener=None):
+    """Merge pre-filtered reads of lanes, keeping at most ``max_reads``
+
+    ``lanes`` is a list of ``(first, second)`` paths of the pre-filtered
+    reads, ``out_paths`` the paths of the merged first and second reads.
+    The lanes are read in order and reading stops once ``max_reads`` reads
+    have been collected, ``0`` disables the limit.  A read counts once
+    together with its mate and mates are always kept together.
+
+    The output files are opened with ``opener(path)``, by default as plain
+    binary files.
+
+    Return ``dict`` with the limit, the number of reads collected, and
+    whether subsampling happened.
+    """
+    opener = opener or (lambda path: open(path, 'wb'))
+    num_reads = 0
+    subsampled = False
+    with opener(out_paths[0]) as out_first, \
+            opener(out_paths[1]) as out_second:
+        for first, second in lanes:
+            if max_reads and num_reads >= max_reads:
+                subsampled = subsampled or has_records(first) or \
+                    has_records(second)
+                continue
+            names = set()
+            with open_fastq(first) as f:
+                for record in read_records(f):
+                    if max_reads and num_reads >= max_reads:
+                        subsampled = True
+                        break
+                    out_first.writelines(record)
+                    names.add(read_name(record))
+                    num_reads += 1
+            with open_fastq(second) as f:
+                for record in read_records(f):
+                    if read_name(record) in names:
+                        out_second.writelines(record)
+                    elif not max_reads or num_reads < max_reads:
+                        out_second.writelines(record)
+                        num_reads += 1
+                    else:
+                        subsampled = True
+    return {
+        'max_hla_reads': max_reads,
+        'hla_reads': num_reads,
+        'subsampled': subsampled,
+    }
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Identify the donor of a sample from the HLA calls of known donors
+
+The calls of all samples typed so far are kept in an on-disk inverted
+index that maps each allele (at two- and four-digit precision, counting
+homozygous alleles twice) to the samples carrying it.  A query sample is
+typed through the usual ``call_hla`` path (or its calls are given
+directly) and the known samples are ranked by the number of alleles they
+share with it.  The index consists of ``.npy`` files that are memory-mapped
+on loading, so a query against hundreds of thousands of samples only
+touches the postings of its six alleles and takes milliseconds.
+
+Usage::
+
+    hlama identify index --index DIR WORK_DIR [WORK_DIR ...]
+    hlama identify query --index DIR --calls hla_types.txt
+    hlama identify query --index DIR --sample NAME --reads FILE [FILE ...]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from . import app
+from .base import HLAType, load_calls
+from .cohort import GENES, PLOIDY, MISSING
+from .matched_pairs import Cohort, Donor
+from hlama import __version__
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Version of the index layout
+INDEX_VERSION = 1
+#: The precisions the index is built for, in order of importance
+PRECISIONS = (4, 2)
+#: Default number of matches to return
+DEFAULT_TOP_K = 10
+
+
+def allele_copies(calls, precision):
+    """Return list of ``(allele, copy)`` pairs of the calls of a sample
+
+    ``allele`` is the allele string at the given precision and ``copy``
+    counts the occurrences of the same string within the gene, such that
+    homozygous alleles are shared twice with homozygous samples only.
+    """
+    result = []
+    for gene in GENES:
+        alleles = sorted(_allele_str(hla, precision) for hla in calls
+                         if hla.gene_name == gene)[:PLOIDY]
+        for i, allele in enumerate(alleles):
+            result.append((allele, alleles[:i].count(allele)))
+    return result
+
+
+#: Cache of allele strings, the same alleles occur in many samples
+_ALLELE_STRS = {}
+
+
+def _allele_str(hla, precision):
+    """Return ``hla.prec_str(precision)``, cached"""
+    key = (hla.key(precision), precision)
+    if key not in _ALLELE_STRS:
+        _ALLELE_STRS[key] = hla.prec_str(precision)
+    return _ALLELE_STRS[key]
+
+
+class Entry:
+    """Known sample in the index"""
+
+    def __init__(self, donor, sample, calls):
+        #: Name of the donor
+        self.donor = donor
+        #: Name of the sample
+        self.sample = sample
+        #: List of ``HLAType`` objects
+        self.calls = calls
+
+    def __repr__(self):
+        return 'Entry({})'.format(', '.join(
+            map(repr, [self.donor, self.sample, self.calls])))
+
+
+class Match:
+    """Known sample matching a query"""
+
+    def __init__(self, donor, sample, dist_2, dist_4):
+        #: Name of the donor
+        self.donor = donor
+        #: Name of the sample
+        self.sample = sample
+        #: Number of alleles not shared at two-digit precision
+        self.dist_2 = dist_2
+        #: Number of alleles not shared at four-digit precision
+        self.dist_4 = dist_4
+
+    def __repr__(self):
+        return 'Match({})'.format(', '.join(
+            map(repr, [self.donor, self.sample, self.dist_2, self.dist_4])))
+
+
+class DonorIndex:
+    """Inverted index from alleles to known samples
+
+    For each precision, the postings of the key ``allele * PLOIDY + copy``
+    are ``postings[offsets[key]:offsets[key + 1]]``, the sorted ids of the
+    samples carrying the allele at least ``copy + 1`` times.
+    """
+
+    @classmethod
+    def build(klass, entries):
+        """Build ``DonorIndex`` from list of ``Entry`` objects"""
+        copies = {precision: [allele_copies(entry.calls, precision)
+                              for entry in entries]
+                  for precision in PRECISIONS}
+        alleles = {}
+        postings = {}
+        for precision in PRECISIONS:
+            vocab = sorted({allele for entry_copies in copies[precision]
+                            for allele, _ in entry_copies})
+            codes = {allele: i for i, allele in enumerate(vocab)}
+            keys = np.fromiter(
+                (codes[allele] * PLOIDY + copy
+                 for entry_copies in copies[precision]
+                 for allele, copy in entry_copies), dtype=np.int64)
+            ids = np.repeat(
+                np.arange(len(entries), dtype=np.int32),
+                [len(entry_copies) for entry_copies in copies[precision]])
+            order = np.argsort(keys, kind='stable')
+            offsets = np.zeros(len(vocab) * PLOIDY + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=len(vocab) * PLOIDY),
+                      out=offsets[1:])
+            alleles[precision] = vocab
+            postings[precision] = (offsets, ids[order])
+        calls = np.full((len(entries), len(GENES) * PLOIDY), MISSING,
+                        dtype=np.int32)
+        codes = {allele: i for i, allele in enumerate(alleles[4])}
+        for i, entry_copies in enumerate(copies[4]):
+            calls[i, :len(entry_copies)] = [
+                codes[allele] for allele, _ in entry_copies]
+        return DonorIndex(
+            np.array([entry.donor for entry in entries], dtype=np.str_),
+            np.array([entry.sample for entry in entries], dtype=np.str_),
+            calls, alleles, postings)
+
+    @classmethod
+    def load(klass, path):
+        """Load ``DonorIndex`` from directory written with ``save()``"""
+        with open(os.path.join(path, 'meta.json'), 'rt') as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise app.InputDataException(
+                'Incompatible donor index version {} in {}'.format(
+                    meta['version'], path))
+
+        def load_array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        return DonorIndex(
+            load_array('donors'), load_array('samples'), load_array('calls'),
+            {int(p): vocab for p, vocab in meta['alleles'].items()},
+            {p: (load_array('offsets_{}'.format(p)),
+                 load_array('postings_{}'.format(p)))
+             for p in PRECISIONS})
+
+    def __init__(self, donors, samples, calls, alleles, postings):
+        #: Array of donor names
+        self.donors = donors
+        #: Array of sample names
+        self.samples = samples
+        #: ``(N, 6)`` matrix of the sample's alleles at four-digit precision,
+        #: as indices into ``alleles[4]``
+        self.calls = calls
+        #: Sorted allele strings for each precision
+        self.alleles = alleles
+        #: Pair of offsets and postings arrays for each precision
+        self.postings = postings
+        #: Allele string to code, for each precision
+        self.codes = {precision: {allele: i for i, allele in enumerate(vocab)}
+                      for precision, vocab in alleles.items()}
+
+    def __len__(self):
+        return len(self.donors)
+
+    def entries(self):
+        """Yield ``Entry`` objects of the indexed samples"""
+        vocab = self.alleles[4]
+        for donor, sample, row in zip(self.donors, self.samples, self.calls):
+            yield Entry(str(donor), str(sample),
+                        [HLAType.parse(vocab[code]) for code in row
+                         if code != MISSING])
+
+    def save(self, path):
+        """Save index to directory ``path``, replacing it atomically"""
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(
+            prefix='.{}.'.format(os.path.basename(path)), dir=parent)
+        try:
+            arrays = {'donors': self.donors, 'samples': self.samples,
+                      'calls': self.calls}
+            for precision, (offsets, postings) in self.postings.items():
+                arrays['offsets_{}'.format(precision)] = offsets
+                arrays['postings_{}'.format(precision)] = postings
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp_dir, name + '.npy'), arr)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'wt') as f:
+                json.dump({'version': INDEX_VERSION, 'hlama': __version__,
+                           'size': len(self), 'alleles': self.alleles},
+                          f, sort_keys=True, indent=4)
+            if os.path.exists(path):
+                old_dir = tempfile.mkdtemp(
+                    prefix='.{}.old.'.format(os.path.basename(path)),
+                    dir=parent)
+                os.rename(path, os.path.join(old_dir, 'index'))
+                os.rename(tmp_dir, path)
+                shutil.rmtree(old_dir, ignore_errors=True)
+            else:
+                os.rename(tmp_dir, path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def shared(self, calls, precision):
+        """Return array with the number of alleles shared with ``calls``"""
+        offsets, postings = self.postings[precision]
+        codes = self.codes[precision]
+        hits = []
+        for allele, copy in allele_copies(calls, precision):
+            if allele in codes:
+                key = codes[allele] * PLOIDY + copy
+                hits.append(postings[offsets[key]:offsets[key + 1]])
+        if not hits:
+            return np.zeros(len(self), dtype=np.int64)
+        return np.bincount(np.concatenate(hits), minlength=len(self))
+
+    def query(self, calls, top_k=DEFAULT_TOP_K):
+        """Return list of the ``top_k`` best ``Match`` objects for ``calls``
+
+        Samples are ranked by the number of shared alleles at four-digit
+        precision first and at two-digit precision second.
+        """
+        num_alleles = len(GENES) * PLOIDY
+        shared_4 = self.shared(calls, 4)
+        shared_2 = self.shared(calls, 2)
+        scores = shared_4 * (num_alleles + 1) + shared_2
+        top_k = min(top_k, len(self))
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [Match(str(self.donors[i]), str(self.samples[i]),
+                      num_alleles - int(shared_2[i]),
+                      num_alleles - int(shared_4[i]))
+                for i in best]
+
+
+def load_work_dir(work_dir):
+    """Return list of ``Entry`` objects for the typed samples of work dir
+
+    Samples without ``hla_types.txt`` file are skipped with a warning.
+    In batch work dirs, the donors are taken from the sheets.
+    """
+    with open(os.path.join(work_dir, 'data.json'), 'rt') as f:
+        data = json.load(f)
+    donors = {}
+    for sheet in data.get('sheets', {}).values():
+        for name, member in sheet['members'].items():
+            donors.setdefault(name, member.get('donor', name))
+    result = []
+    for name, member in sorted(data['members'].items()):
+        path = os.path.join(work_dir, '{}.d'.format(member['name']),
+                            'hla_types.txt')
+        if not os.path.exists(path):
+            print('WARNING: no HLA calls for {} in {}, skipping'.format(
+                name, work_dir), file=sys.stderr)
+            continue
+        result.append(Entry(member.get('donor', donors.get(name, name)),
+                            member['name'], load_calls(path)))
+    return result
+
+
+class IdentifyApp(app.BaseApp):
+    """Application for typing a single query sample"""
+
+    def load_info(self):
+        """Return ``Cohort`` with the query sample as its only member"""
+        return Cohort([Donor(
+            self.args.sample, self.args.sample, '.', self.args.seq_type,
+            data=[','.join(self.args.reads)])])
+
+    def create_data_json(self, file, cohort):
+        """Create ``data.json``"""
+        sample = cohort.members[0]
+        paths = sample.data[0].split(',')
+        result = {'schema': 'hla_identify', 'members': {}}
+        result['members'][sample.name] = {
+            'name': sample.name,
+            'seq_type': sample.seq_type,
+            'files': list(map(self.locate_file, paths)),
+            'mode': self.get_mode(paths),
+            'max_hla_reads': self.get_max_hla_reads(sample.seq_type),
+        }
+        self.lookup_all_calls(result['members'].values())
+        self.add_common_data(result)
+        json.dump(result, file, sort_keys=True, indent=4)
+
+    def run_snakemake(self):
+        """Run Snakemake for typing the query sample"""
+        print('\nRunning Snakemake\n=================\n', file=sys.stderr)
+        if not self.call_snakemake():
+            raise app.InputDataException(
+                'Typing of {} failed, see Snakemake output above'.format(
+                    self.args.sample))
+
+    def calls_path(self):
+        """Return path to the ``hla_types.txt`` file of the query sample"""
+        return os.path.join(self.args.work_dir,
+                            '{}.d'.format(self.args.sample), 'hla_types.txt')
+
+
+def run_index(args):
+    """Add the typed samples of the work directories to the index"""
+    entries = {}
+    if os.path.exists(args.index) and not args.rebuild:
+        for entry in DonorIndex.load(args.index).entries():
+            entries[(entry.donor, entry.sample)] = entry
+    num_old = len(entries)
+    for work_dir in args.work_dirs:
+        for entry in load_work_dir(work_dir):
+            entries[(entry.donor, entry.sample)] = entry
+    index = DonorIndex.build([entries[key] for key in sorted(entries)])
+    index.save(args.index)
+    print('Wrote index with {} samples ({} before) to {}'.format(
+        len(index), num_old, args.index), file=sys.stderr)
+
+
+def run_query(args):
+    """Type the query sample if necessary and print the best matches"""
+    if args.calls:
+        calls = load_calls(args.calls)
+    elif not args.sample:
+        raise app.InputDataException('--reads requires --sample')
+    else:
+        identify_app = IdentifyApp(args)
+        identify_app.run()
+        if args.plan or not args.run_snakemake:
+            return
+        calls = load_calls(identify_app.calls_path())
+    start = time.time()
+    index = DonorIndex.load(args.index)
+    matches = index.query(calls, args.top_k)
+    print('Queried {} samples in {:.1f} ms'.format(
+        len(index), 1000 * (time.time() - start)), file=sys.stderr)
+    for rank, match in enumerate(matches, 1):
+        print('\t'.join(map(str, [rank, match.donor, match.sample,
+                                  match.dist_2, match.dist_4])))
+
+
+def run(args):
+    """Main entry point after parsing command line parameters"""
+    try:
+        if args.command == 'index':
+            return run_index(args)
+        else:
+            return run_query(args)
+    except app.InputDataException as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 1
+
+
+def main(argv=None):
+    """Main entry point of ``hlama identify``"""
+    parser = argparse.ArgumentParser(
+        prog='hlama identify',
+        description='Identify the donor of a sample from known HLA calls')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_index = subparsers.add_parser(
+        'index', help='Add typed samples of work directories to the index')
+    parser_index.add_argument('--index', type=str, required=True,
+                              help='Path to the index directory')
+    parser_index.add_argument('--rebuild', default=False,
+                              action='store_true',
+                              help=('Build the index from scratch instead '
+                                    'of adding to an existing one'))
+    parser_index.add_argument('work_dirs', nargs='+', metavar='WORK_DIR',
+                              help='hlama work directory with typed samples')
+
+    parser_query = subparsers.add_parser(
+        'query', help='Print the known samples best matching a sample')
+    parser_query.add_argument('--index', type=str, required=True,
+                              help='Path to the index directory')
+    parser_query.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+                              help=('Number of matches to print, defaults '
+                                    'to {}').format(DEFAULT_TOP_K))
+    group = parser_query.add_mutually_exclusive_group(required=True)
+    group.add_argument('--calls', type=str,
+                       help='Path to hla_types.txt file of the query sample')
+    group.add_argument('--reads', type=str, nargs='+',
+                       help='FASTQ or BAM/CRAM files of the query sample')
+    parser_query.add_argument('--sample', type=str,
+                              help='Name of the query sample for typing')
+    parser_query.add_argument('--seq-type', default='DNA',
+                              choices=('DNA', 'RNA'),
+                              help='Sequence type of the query sample')
+    app.add_common_args(parser_query, work_dir='hlama_identify')
+
+    args = parser.parse_args(argv)
+
+    # Make paths absolute
+    if args.command == 'query':
+        app.make_paths_absolute(args)
+
+    return run(args)
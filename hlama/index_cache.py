@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache for Yara indices of the HLA reference
+
+Building the Yara index is the same work for every work directory.  The
+cache keeps one copy of each index below a shared directory, keyed by the
+SHA-256 of the compressed reference FASTA and the ``yara_indexer`` version.
+Entries are filled under an exclusive file lock and moved into place
+atomically so concurrent hlama runs can share the cache safely.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: File name of the reference FASTA within a cache entry
+REF_NAME = 'ref.fasta'
+
+
+class IndexCache:
+    """Content-addressed cache of Yara indices"""
+
+    def __init__(self, path):
+        #: Directory containing the cache entries
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def key(self, ref_path, indexer_version):
+        """Return cache key for the given reference and indexer version"""
+        digest = hashlib.sha256()
+        with open(ref_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(indexer_version.strip().encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        """Return path to the directory of the entry with the given key"""
+        return os.path.join(self.path, key)
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Hold an exclusive lock on the entry with the given key"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, key + '.lock'), 'at') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def fetch(self, key, build):
+        """Return path to the cache entry, building it if necessary
+
+        ``build`` is called with the path of the FASTA file to write and
+        index.  Entries only appear after ``build`` returned successfully,
+        so an existing entry directory is always complete.
+        """
+        entry = self.entry_path(key)
+        if os.path.isdir(entry):
+            return entry
+        with self.lock(key):
+            if os.path.isdir(entry):  # filled by a concurrent run
+                return entry
+            tmp_dir = tempfile.mkdtemp(prefix='.{}.'.format(key),
+                                       dir=self.path)
+            try:
+                build(os.path.join(tmp_dir, REF_NAME))
+                os.rename(tmp_dir, entry)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+        return entry
+
+    def link(self, entry, prefix, exts):
+        """Symlink the index files of ``entry`` to ``prefix`` + ext"""
+        for ext in exts:
+            dest = prefix + ext
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            os.symlink(os.path.join(entry, REF_NAME + ext), dest)
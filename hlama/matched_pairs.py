@@ -70,10 +70,10 @@ def check_consistency(precision, normal_calls, tumor_calls):
     Return number of mismatches
     """
 
-    def to_str(hla):
-        return hla.prec_str(precision)
+    def to_key(hla):
+        return hla.key(precision)
 
-    ref = Counter(map(to_str, normal_calls))
-    sample = Counter(map(to_str, tumor_calls))
+    ref = Counter(map(to_key, normal_calls))
+    sample = Counter(map(to_key, tumor_calls))
     mismatches = len(list((ref - sample).elements()))
     return mismatches
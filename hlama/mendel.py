@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Mendelian consistency checks of whole multi-generation pedigrees
+
+The trio checks of the report (see ``report.pedigree_lines()``) only look
+at index members and their parents, one trio at a time.  This module walks
+the pedigree once and checks the transmission of alleles along all
+parent-child edges of the pedigree graph, including:
+
+- children with one or both genotyped parents,
+- children of ungenotyped parents, against the genotyped grandparents of
+  that side, i.e., the alleles a parent can have transmitted,
+- groups of full siblings, which carry at most four distinct alleles per
+  gene, also without genotyped parents.
+
+The alleles are encoded as integers (see ``cohort.encode_calls()``) and
+the checks are done with NumPy on arrays with one row per child or sibling,
+so the run time grows with the size of the pedigree only.  Genes without
+calls are skipped instead of being counted as mismatches.
+"""
+
+import numpy as np
+
+from .base import GENES
+from .cohort import MISSING, PLOIDY, encode_calls
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: The precisions checked, in digits
+PRECISIONS = (2, 4)
+#: Number of distinct alleles per gene that parents can transmit
+MAX_SIBLING_ALLELES = 2 * PLOIDY
+#: Kinds of findings
+PARENTS = 'parents'
+GRANDPARENTS = 'grandparents'
+SIBLINGS = 'siblings'
+
+
+def _encode(names, calls, precision):
+    """Return allele codes of ``names`` with a trailing row without calls
+
+    The trailing row is addressed by index ``-1`` for missing relatives.
+    Genes with a single called allele are treated as homozygous.
+    """
+    codes = encode_calls([calls.get(name) or [] for name in names] + [[]],
+                         precision)
+    for col in range(0, len(GENES) * PLOIDY, PLOIDY):
+        second = codes[:, col + 1]
+        second[:] = np.where(second == MISSING, codes[:, col], second)
+    return codes
+
+
+def _build_graph(pedigree, calls):
+    """Walk ``pedigree`` once and return the arrays to check
+
+    Return tuple of the member names, the rows of the checked children,
+    the ``(children, side, slot)`` rows of the relatives whose alleles the
+    children inherit from the father's and mother's side (``-1`` for
+    none), and the rows and group IDs of the full siblings.
+    """
+    names = [member.name for member in pedigree.members]
+    rows = {name: i for i, name in enumerate(names)}
+
+    def called(name):
+        return name in rows and bool(calls.get(name))
+
+    children, sources = [], []
+    sibships = {}
+    for member in pedigree.members:
+        if not called(member.name):
+            continue
+        parents = (member.father, member.mother)
+        if '0' not in parents:
+            sibships.setdefault(parents, []).append(rows[member.name])
+        source = []
+        for parent in parents:
+            if called(parent):
+                source.append([rows[parent], -1])
+                continue
+            grandparents = ()
+            if parent in rows:
+                parent_member = pedigree.by_name[parent]
+                grandparents = (parent_member.father, parent_member.mother)
+            if grandparents and all(map(called, grandparents)):
+                source.append([rows[name] for name in grandparents])
+            else:
+                source.append([-1, -1])
+        if max(max(side) for side in source) >= 0:
+            children.append(rows[member.name])
+            sources.append(source)
+    # Two siblings never carry more than four alleles per gene
+    sibships = [rows_ for rows_ in sibships.values() if len(rows_) > 2]
+    siblings, groups = [], []
+    for group, rows_ in enumerate(sibships):
+        siblings += rows_
+        groups += [group] * len(rows_)
+    return (names, np.array(children, dtype=np.int64),
+            np.array(sources, dtype=np.int64).reshape(-1, 2, 2),
+            np.array(siblings, dtype=np.int64),
+            np.array(groups, dtype=np.int64))
+
+
+def _transmission_mismatches(codes, children, sources):
+    """Return number of child alleles not explained by the sources
+
+    For each gene, the child must carry one allele of each known side, in
+    a consistent assignment of the child's two alleles to the sides.
+    """
+    result = np.zeros(len(children), dtype=np.int64)
+    for col in range(0, len(GENES) * PLOIDY, PLOIDY):
+        child = codes[children, col:col + PLOIDY]
+        # Alleles of each side, up to two relatives with two alleles each
+        sides = codes[sources, col:col + PLOIDY].reshape(
+            len(children), 2, 2 * PLOIDY)
+        known = (sides != MISSING).any(axis=2)
+        called = child[:, 0] != MISSING
+        # found[i, side, allele]: allele of child i is found on the side
+        found = ((child[:, np.newaxis, :, np.newaxis] ==
+                  sides[:, :, np.newaxis, :]).any(axis=3) &
+                 called[:, np.newaxis, np.newaxis]).astype(np.int64)
+        both = 2 - np.maximum(found[:, 0, 0] + found[:, 1, 1],
+                              found[:, 0, 1] + found[:, 1, 0])
+        one = 1 - (found.any(axis=2) & known).any(axis=1)
+        result += np.where(
+            ~called, 0,
+            np.where(known.all(axis=1), both,
+                     np.where(known.any(axis=1), one, 0)))
+    return result
+
+
+def _sibling_mismatches(codes, siblings, groups):
+    """Return number of alleles beyond four per gene, by sibling group"""
+    num_groups = groups.max() + 1 if len(groups) else 0
+    result = np.zeros(num_groups, dtype=np.int64)
+    for col in range(0, len(GENES) * PLOIDY, PLOIDY):
+        alleles = codes[siblings, col:col + PLOIDY].ravel()
+        group_ids = np.repeat(groups, PLOIDY)
+        keep = alleles != MISSING
+        distinct = np.unique(
+            np.stack([group_ids[keep], alleles[keep]]), axis=1)
+        counts = np.bincount(distinct[0], minlength=num_groups)
+        result += np.maximum(counts - MAX_SIBLING_ALLELES, 0)
+    return result
+
+
+def check_pedigree(pedigree, calls):
+    """Check all parent-child edges and sibling groups of ``pedigree``
+
+    ``calls`` maps member names to lists of ``HLAType`` objects (see
+    ``base.load_calls()``), members without calls are skipped.  Return
+    list of the inconsistencies as tuples of family, kind (``PARENTS``,
+    ``GRANDPARENTS``, or ``SIBLINGS``), the checked members, the relatives
+    checked against, and the numbers of mismatching alleles at two and
+    four digits precision, sorted by family, kind, and members.
+    """
+    names, children, sources, siblings, groups = _build_graph(
+        pedigree, calls)
+    mismatches, sib_mismatches = {}, {}
+    for precision in PRECISIONS:
+        codes = _encode(names, calls, precision)
+        mismatches[precision] = _transmission_mismatches(
+            codes, children, sources)
+        sib_mismatches[precision] = _sibling_mismatches(
+            codes, siblings, groups)
+    result = []
+    for i in np.nonzero(mismatches[2] + mismatches[4])[0]:
+        child = pedigree.members[children[i]]
+        kind = GRANDPARENTS if (sources[i, :, 1] >= 0).any() else PARENTS
+        relatives = [names[row] for row in sources[i].ravel() if row >= 0]
+        result.append((child.family, kind, [child.name], relatives,
+                       int(mismatches[2][i]), int(mismatches[4][i])))
+    for group in np.nonzero(sib_mismatches[2] + sib_mismatches[4])[0]:
+        members = [pedigree.members[row]
+                   for row in siblings[groups == group]]
+        result.append((members[0].family, SIBLINGS,
+                       sorted(m.name for m in members),
+                       [members[0].father, members[0].mother],
+                       int(sib_mismatches[2][group]),
+                       int(sib_mismatches[4][group])))
+    return sorted(result, key=lambda x: (x[0], x[1], x[2]))
+
+
+def write_report(f, findings):
+    """Write inconsistencies to file-like object ``f``"""
+    for family, kind, members, relatives, mm2, mm4 in findings:
+        print('\t'.join(map(str, [
+            family, kind, ','.join(members), ','.join(relatives),
+            mm2 or 'OK', mm4 or 'OK'])), file=f)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Measuring the resource usage of the typing steps
+
+The resource usage of external programs is measured by running them
+through this module, e.g., in a pipeline::
+
+    python -m hlama.metrics stages/yara_mapper.json yara_mapper ... | ...
+
+which writes wall and CPU time and the peak RSS of the program (including
+its child processes) to the given JSON file.  Stages running within the
+Snakemake process are measured with ``Stages.measure()``, where the CPU
+time is the one of the calling thread (on Linux) as other jobs run in
+threads of the same process.  Their peak RSS cannot be told apart from the
+other jobs' and is not recorded.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Default interval in seconds between two disk usage measurements
+DEFAULT_INTERVAL = 1.0
+#: Resource usage of the calling thread where supported (Linux), of the
+#: process otherwise
+RUSAGE_STAGE = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+
+
+def disk_usage(paths):
+    """Return number of bytes allocated for the files and directories"""
+    result = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                result += disk_usage(os.path.join(root, name)
+                                     for name in files)
+        else:
+            try:
+                result += os.stat(path).st_blocks * 512
+            except FileNotFoundError:
+                pass  # not created yet or already removed
+    return result
+
+
+class ScratchMonitor:
+    """Track the peak disk usage of files and directories
+
+    Use as a context manager, the disk usage is measured in a background
+    thread every ``interval`` seconds and on entering and leaving.
+    """
+
+    def __init__(self, paths, interval=DEFAULT_INTERVAL):
+        #: Paths of the files and directories to measure
+        self.paths = list(paths)
+        #: Interval between two measurements in seconds
+        self.interval = interval
+        #: Peak disk usage in bytes
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def measure(self):
+        """Measure disk usage now and update ``peak``"""
+        self.peak = max(self.peak, disk_usage(self.paths))
+
+    def __enter__(self):
+        self.measure()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.measure()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.measure()
+
+
+def stage_stats(wall, cpu, max_rss_kb):
+    """Return ``dict`` with the resource usage of a stage
+
+    ``max_rss_kb`` is ``None`` if unknown.
+    """
+    return {'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3),
+            'max_rss_kb': max_rss_kb}
+
+
+def _cpu(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stages:
+    """Resource usage of named pipeline stages
+
+    Adding the usage of a stage more than once, e.g., for the first and
+    the second reads, sums up the times and keeps the larger known peak
+    RSS.
+    """
+
+    def __init__(self, stats=None):
+        #: Resource usage ``dict`` by stage name
+        self.stats = dict(stats or {})
+
+    def add(self, name, stats):
+        """Add resource usage ``stats`` of stage ``name``"""
+        if name in self.stats:
+            old = self.stats[name]
+            max_rss = [value for value in (old['max_rss_kb'],
+                                           stats['max_rss_kb'])
+                       if value is not None]
+            stats = stage_stats(old['wall_s'] + stats['wall_s'],
+                                old['cpu_s'] + stats['cpu_s'],
+                                max(max_rss) if max_rss else None)
+        self.stats[name] = stats
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Measure the stage ``name`` running in the calling thread
+
+        Only wall and CPU time are measured, the peak RSS is unknown.
+        """
+        start = time.time()
+        before = _cpu(resource.getrusage(RUSAGE_STAGE))
+        yield
+        after = _cpu(resource.getrusage(RUSAGE_STAGE))
+        self.add(name, stage_stats(time.time() - start, after - before,
+                                   None))
+
+    def load_dir(self, path):
+        """Add the stages written by ``run_command()`` to directory ``path``
+
+        The stage name is the file name up to the first dot, e.g., the
+        files ``yara_mapper.1.json`` and ``yara_mapper.2.json`` are added
+        to the stage ``yara_mapper``.
+        """
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.json'):
+                with open(os.path.join(path, name), 'rt') as f:
+                    self.add(name.split('.')[0], json.load(f))
+
+
+def run_command(out_path, args):
+    """Run command ``args`` and write its resource usage to ``out_path``
+
+    Return the exit code of the command, ``128 + signal`` if it was killed
+    by a signal (as in the shell).
+    """
+    start = time.time()
+    proc = subprocess.Popen(args)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = 0  # reaped by wait4()
+    with open(out_path, 'wt') as f:
+        json.dump(stage_stats(time.time() - start, _cpu(usage),
+                              usage.ru_maxrss), f)
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+def main(argv=None):
+    """Main entry point for running a command and measuring it"""
+    parser = argparse.ArgumentParser(
+        prog='python -m hlama.metrics',
+        description='Run command and write its resource usage as JSON')
+    parser.add_argument('out_path', metavar='OUT.json',
+                        help='Path to JSON file to write')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Command to run')
+    args = parser.parse_args(argv)
+    return run_command(args.out_path, args.command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -69,15 +69,15 @@ def check_consistency(precision, index_calls, father_calls, mother_calls):
     Return number of mismatches
     """
 
-    def to_str(hla):
-        return hla.prec_str(precision)
+    def to_key(hla):
+        return hla.key(precision)
 
     mismatches = 0
     for gene in 'ABC':
         summand = 0
-        index_set = set(map(to_str, index_calls[gene]))
-        father_set = set(map(to_str, father_calls[gene]))
-        mother_set = set(map(to_str, mother_calls[gene]))
+        index_set = set(map(to_key, index_calls[gene]))
+        father_set = set(map(to_key, (father_calls or {}).get(gene, [])))
+        mother_set = set(map(to_key, (mother_calls or {}).get(gene, [])))
         if father_calls and mother_calls:
             # have both mother and father calls, more complex
             # print('index', index_set, 'father', father_set, 'mother',
@@ -105,12 +105,12 @@ def check_consistency(precision, index_calls, father_calls, mother_calls):
 def check_identity(precision, lhs_calls, rhs_calls):
     """Check for identity up to the given precision"""
 
-    def to_str(hla):
-        return hla.prec_str(precision)
+    def to_key(hla):
+        return hla.key(precision)
 
     for gene in 'ABC':
-        lhs_set = set(map(to_str, lhs_calls[gene]))
-        rhs_set = set(map(to_str, rhs_calls[gene]))
+        lhs_set = set(map(to_key, lhs_calls[gene]))
+        rhs_set = set(map(to_key, rhs_calls[gene]))
         if lhs_set != rhs_set:
             return False
     return True
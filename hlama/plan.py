@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Cost estimates of the typing jobs and longest-job-first priorities
+
+Snakemake starts ready jobs in no particular order, so a single large
+sample (e.g., a 300 GB genome) starting last can double the running time
+of a batch.  Before running Snakemake, the cost of typing each member is
+estimated from the size of its input files, its sequence type, and its
+number of lanes.  The most expensive members, one per job slot, are passed
+to Snakemake as priority targets so they start first.
+
+With ``--plan``, hlama prints the estimates instead of running Snakemake::
+
+    hlama --tumor-normal matched.tsv ... --plan > plan.tsv
+
+The rates below are rough and meant for ordering the jobs and for capacity
+planning, ``hlama stats`` gives the actual timings.
+"""
+
+import heapq
+
+from .base import ALIGNED
+from .snake import BYTES_PER_READ
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Reads mapped by Yara per core and second when pre-filtering
+PREFILTER_READS_PER_CORE_S = 20000
+#: Fraction of the reads of BAM/CRAM files in the MHC region or unmapped,
+#: i.e., extracted and pre-filtered
+ALIGNED_READ_FRACTION = 0.02
+#: Core seconds for starting a pre-filtering job, e.g., loading the index
+LANE_STARTUP_CORE_S = 20
+#: Core seconds of OptiType without reads and per 1000 HLA reads
+OPTITYPE_CORE_S = 60
+OPTITYPE_CORE_S_PER_1K_READS = 3
+#: Columns of the plan table
+COLUMNS = ('sample', 'seq_type', 'lanes', 'input_gb', 'core_hours',
+           'priority')
+
+
+class Estimate:
+    """Estimated cost of typing one member"""
+
+    def __init__(self, name, seq_type, lanes, input_bytes, core_seconds):
+        #: Name of the member
+        self.name = name
+        #: Sequence type, ``'DNA'`` or ``'RNA'``
+        self.seq_type = seq_type
+        #: Number of lanes pre-filtered in jobs of their own
+        self.lanes = lanes
+        #: Total size of the input files
+        self.input_bytes = input_bytes
+        #: Estimated core seconds of pre-filtering and typing
+        self.core_seconds = core_seconds
+        #: Whether the member is a priority target
+        self.priority = False
+
+
+def estimate(schema, name):
+    """Return ``Estimate`` for the member ``name`` of ``HlamaSchema``
+
+    Members taken from the call store cost nothing.
+    """
+    member = schema.data['members'][name]
+    seq_type = member.get('seq_type', 'DNA')
+    input_bytes = schema.get_input_bytes(name)
+    if member['precomputed']:
+        return Estimate(name, seq_type, 0, input_bytes, 0)
+    lanes = len(schema.get_lanes(name))
+    reads = input_bytes / BYTES_PER_READ
+    if member['mode'] == ALIGNED:
+        reads *= ALIGNED_READ_FRACTION
+    core_seconds = (
+        lanes * LANE_STARTUP_CORE_S + reads / PREFILTER_READS_PER_CORE_S +
+        OPTITYPE_CORE_S + OPTITYPE_CORE_S_PER_1K_READS *
+        schema.get_expected_hla_reads(name) / 1000)
+    return Estimate(name, seq_type, lanes, input_bytes, core_seconds)
+
+
+def make_plan(schema, slots):
+    """Return list of ``Estimate`` for all members, most expensive first
+
+    The ``slots`` most expensive members (e.g., the number of concurrent
+    jobs) are marked as priority targets.
+    """
+    result = sorted((estimate(schema, name)
+                     for name in schema.data['members']),
+                    key=lambda e: (-e.core_seconds, e.name))
+    for entry in result[:slots]:
+        entry.priority = entry.core_seconds > 0
+    return result
+
+
+def makespan(plan, slots, threads=1):
+    """Return predicted wall-clock seconds for running ``plan``
+
+    The members are started longest first on ``slots`` slots with
+    ``threads`` threads each, as with the priorities.
+    """
+    finish = [0.0] * max(slots, 1)
+    for entry in plan:
+        start = heapq.heappop(finish)
+        heapq.heappush(finish, start + entry.core_seconds / threads)
+    return max(finish)
+
+
+def write_table(f, plan, slots, threads=1):
+    """Write ``plan`` as tab-separated table with a summary to ``f``"""
+    print('\t'.join(COLUMNS), file=f)
+    for entry in plan:
+        print('\t'.join(map(str, [
+            entry.name, entry.seq_type, entry.lanes,
+            round(entry.input_bytes / 1024 ** 3, 2),
+            round(entry.core_seconds / 3600, 2),
+            'yes' if entry.priority else 'no'])), file=f)
+    total = sum(entry.core_seconds for entry in plan)
+    print('# total core-hours: {:.2f}'.format(total / 3600), file=f)
+    print('# predicted wall-clock hours with {} slots of {} threads: '
+          '{:.2f}'.format(slots, threads,
+                          makespan(plan, slots, threads) / 3600), file=f)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Fast k-mer based pre-screening of reads before Yara mapping
+
+Only a tiny fraction of exome or genome reads stems from the HLA genes.
+The pre-screen builds the set of canonical k-mers of the HLA reference,
+packed into 64 bit integers, and keeps only those reads (and their mates)
+that share at least one sampled k-mer with the reference.  Everything else
+is dropped before the reads are passed to ``yara_mapper``.
+"""
+
+import contextlib
+import itertools
+
+import numpy as np
+
+from .fastq import open_fastq, read_chunk
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Default k-mer length
+DEFAULT_K = 25
+#: Default distance between the k-mers sampled from each read
+DEFAULT_STEP = 4
+#: Default number of reads to process at once
+DEFAULT_CHUNK_SIZE = 100000
+
+#: Number of bits of the hash table used for ruling out k-mers quickly
+FILTER_BITS = 24
+
+#: Code of characters that are not in ``ACGT``
+INVALID = 4
+
+#: Lookup table from ASCII character to 2 bit code
+CODES = np.full(256, INVALID, dtype=np.uint8)
+for _i, _c in enumerate(b'ACGT'):
+    CODES[_c] = _i
+    CODES[ord(chr(_c).lower())] = _i
+
+
+def encode(seq):
+    """Return ``numpy.uint8`` array of codes for the bytes ``seq``"""
+    return CODES[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def pack_kmers(codes, positions, k):
+    """Return canonical packed k-mers starting at ``positions``
+
+    Returns a pair of the packed k-mers and a mask of the valid ones, i.e.,
+    those not containing a character besides ``ACGT``.
+    """
+    fwd = np.zeros(len(positions), dtype=np.uint64)
+    rev = np.zeros(len(positions), dtype=np.uint64)
+    valid = np.ones(len(positions), dtype=bool)
+    two = np.uint64(2)
+    for j in range(k):
+        column = codes[positions + j]
+        valid &= column != INVALID
+        column = column.astype(np.uint64) & np.uint64(3)
+        fwd = (fwd << two) | column
+        rev |= (np.uint64(3) - column) << np.uint64(2 * j)
+    return np.minimum(fwd, rev), valid
+
+
+class KmerSet:
+    """Sorted array of the canonical k-mers of a reference"""
+
+    @classmethod
+    def from_fasta(klass, path, k=DEFAULT_K, block_size=1000000):
+        """Build ``KmerSet`` from the (gzip-compressed) FASTA at ``path``"""
+        with open_fastq(path) as f:
+            seqs = []
+            for line in f:
+                if line.startswith(b'>'):
+                    seqs.append(b'\n')  # separator
+                else:
+                    seqs.append(line.rstrip())
+        codes = encode(b''.join(seqs) + b'\n')
+        chunks = []
+        num_positions = max(0, len(codes) - k + 1)
+        for begin in range(0, num_positions, block_size):
+            positions = np.arange(begin, min(begin + block_size,
+                                             num_positions))
+            kmers, valid = pack_kmers(codes, positions, k)
+            chunks.append(np.unique(kmers[valid]))
+        if chunks:
+            kmers = np.unique(np.concatenate(chunks))
+        else:
+            kmers = np.zeros(0, dtype=np.uint64)
+        return KmerSet(kmers, k)
+
+    @classmethod
+    def load(klass, path):
+        """Load ``KmerSet`` from ``.npy`` file written with ``save()``"""
+        arr = np.load(path)
+        return KmerSet(arr[1:], int(arr[0]))
+
+    def __init__(self, kmers, k):
+        if not 0 < k < 32:
+            raise ValueError('k must be in [1, 31], was {}'.format(k))
+        #: Sorted ``numpy.uint64`` array of canonical k-mers
+        self.kmers = kmers
+        #: The k-mer length
+        self.k = k
+        #: Table of k-mer hash values for ruling out most k-mers before
+        #: performing the binary search.
+        self.filter = np.zeros(1 << FILTER_BITS, dtype=bool)
+        self.filter[_hash(kmers)] = True
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def save(self, path):
+        """Save to ``.npy`` file, the k-mer length is stored first"""
+        with open(path, 'wb') as f:
+            np.save(f, np.concatenate((np.array([self.k], dtype=np.uint64),
+                                       self.kmers)))
+
+    def contains(self, kmers):
+        """Return boolean array with membership of ``kmers``"""
+        result = self.filter[_hash(kmers)]
+        candidates = kmers[result]
+        idx = np.searchsorted(self.kmers, candidates)
+        idx[idx == len(self.kmers)] = 0
+        result[result] = self.kmers[idx] == candidates
+        return result
+
+    def hits(self, seqs, step=DEFAULT_STEP):
+        """Return boolean array, whether the sequences share a k-mer
+
+        ``seqs`` is a list of ``bytes`` objects, k-mers are sampled every
+        ``step`` positions and at the end of each sequence.
+        """
+        lengths = np.fromiter((len(s) for s in seqs), dtype=np.int64,
+                              count=len(seqs))
+        starts = np.zeros(len(seqs), dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+        codes = encode(b'\n'.join(seqs) + b'\n')
+        # Number of k-mers to sample from each sequence, plus the last one
+        counts = np.where(lengths >= self.k,
+                          (lengths - self.k) // step + 2, 0)
+        ids = np.repeat(np.arange(len(seqs)), counts)
+        firsts = np.cumsum(counts) - counts
+        offsets = (np.arange(len(ids)) - firsts[ids]) * step
+        offsets = np.minimum(offsets, lengths[ids] - self.k)
+        kmers, valid = pack_kmers(codes, starts[ids] + offsets, self.k)
+        result = np.zeros(len(seqs), dtype=bool)
+        result[ids[valid & self.contains(kmers)]] = True
+        return result
+
+
+def _hash(kmers):
+    """Return ``FILTER_BITS`` bit multiplicative hash values of ``kmers``"""
+    with np.errstate(over='ignore'):
+        hashed = kmers * np.uint64(0x9E3779B97F4A7C15)
+    return (hashed >> np.uint64(64 - FILTER_BITS)).astype(np.intp)
+
+
+def screen_fastq(kmer_set, in_paths, out_paths, step=DEFAULT_STEP,
+                 chunk_size=DEFAULT_CHUNK_SIZE, opener=None):
+    """Write reads sharing a k-mer with ``kmer_set`` to ``out_paths``
+
+    ``in_paths`` contains the path to one FASTQ file or the paths of the
+    first and second reads of a pair.  Pairs are kept if either mate shares
+    a k-mer.  The output files are opened with ``opener(path)``, by default
+    as plain binary files.  Returns the numbers of records read and written.
+    """
+    opener = opener or (lambda path: open(path, 'wb'))
+    num_in, num_out = 0, 0
+    with contextlib.ExitStack() as stack:
+        ins = [stack.enter_context(open_fastq(path)) for path in in_paths]
+        outs = [stack.enter_context(opener(path)) for path in out_paths]
+        while True:
+            chunks = [read_chunk(f, chunk_size) for f in ins]
+            if len(set(map(len, chunks))) != 1:
+                raise ValueError('Different number of reads in {}'.format(
+                    ', '.join(in_paths)))
+            if not chunks[0]:
+                break
+            keep = np.zeros(len(chunks[0]), dtype=bool)
+            for chunk in chunks:
+                keep |= kmer_set.hits([r[1].rstrip() for r in chunk], step)
+            for chunk, out in zip(chunks, outs):
+                out.writelines(itertools.chain.from_iterable(
+                    itertools.compress(chunk, keep)))
+            num_in += len(chunks[0])
+            num_out += int(keep.sum())
+    return num_in, num_out
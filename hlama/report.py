@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Creation of the consistency report, in shards
+
+The report is split into one shard per family (pedigree mode) or per donor
+(tumor/normal mode).  A shard only depends on the calls of its members, so
+it can be written as soon as these are available.  Merging the shards into
+``report.txt`` is a plain concatenation in sorted shard order.
+"""
+
+from . import api
+from . import base
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+#: Member key defining the report shards, by ``data.json`` schema
+SHARD_KEYS = {
+    'hla_check_pairs': 'donor',
+    'hla_pedigree': 'family',
+}
+
+
+def shard_key(schema):
+    """Return member key defining the report shards or ``None``"""
+    return SHARD_KEYS.get(schema)
+
+
+def load_calls(path):
+    """Return ``dict`` with sorted list of ``HLAType`` objects by gene
+
+    The file is read and parsed once for each version, see
+    ``base.load_calls()``.
+    """
+    return api.parse_calls(base.load_calls(path))
+
+
+def pedigree_lines(pedigree, calls):
+    """Yield report lines for the index members in ``pedigree``
+
+    ``calls`` maps the member names to the result of ``load_calls()``.
+    """
+    for result in api.check_pedigree(pedigree, calls):
+        yield result.to_line()
+
+
+def pair_lines(members, calls):
+    """Yield report lines for the non-reference samples in ``members``
+
+    ``members`` are the ``data.json`` entries of the samples of a donor,
+    ``calls`` maps the sample names to the result of ``load_calls()``.
+    """
+    for member in sorted(members, key=lambda m: m['sample']):
+        if member['sample'] == member['reference']:
+            continue
+        yield api.check_pair(
+            calls[member['reference']], calls[member['sample']],
+            sample=member['sample'], reference=member['reference']).to_line()
+
+
+def write_shard(path, lines):
+    """Write report lines of a shard to ``path``"""
+    with open(path, 'wt') as f:
+        for line in lines:
+            print(line, file=f)
+
+
+def merge_shards(out_path, shard_paths):
+    """Concatenate the shards at ``shard_paths`` in order to ``out_path``"""
+    with open(out_path, 'wt') as out:
+        for path in shard_paths:
+            with open(path, 'rt') as f:
+                out.write(f.read())
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""Warm worker daemon for the typing jobs
+
+For streams of small samples, e.g., targeted panels, the typing jobs are
+dominated by their startup: setting up the environment and reading the Yara
+index of the HLA reference from disk for each lane.  ``hlama serve`` runs a
+long-lived daemon on the local host that
+
+- keeps the Yara indices memory-mapped and touches their pages regularly
+  so they stay in the page cache, both the indices of the shared cache and
+  ``tmp/ref_*.fasta*`` of each work directory it served,
+- runs the shell scripts of the pre-filtering and typing jobs in a pool of
+  at most ``--workers`` concurrent jobs, taking them over a Unix socket.
+
+The Snakefile passes the scripts of the jobs to the client (see
+``HlamaSchema.serve_script()``), which runs them in the daemon when its
+socket is present and falls back to running them itself otherwise.  The
+scripts are the same in both cases, so the daemon writes
+``{sample}.d/hla_types.txt`` exactly as the rule does.  OptiType runs in a
+Python 2 interpreter of its own and is still started for each sample.
+
+Usage::
+
+    hlama serve [--socket PATH] [--workers N] [--warm PATH ...]
+
+The protocol is one JSON request per connection with the script, working
+directory, and environment of the job, answered by one JSON response with
+the exit code and the output of the script.  When the client closes the
+connection before, e.g., because the Snakemake job was killed, the script
+is killed as well.
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import select
+import shlex
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+
+from . import config
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Default path of the socket
+DEFAULT_SOCKET = '~/.cache/hlama/serve.sock'
+#: Seconds between touching the pages of the warm files
+WARM_INTERVAL = 60
+#: Patterns of the Yara index files in work directories
+WORK_DIR_INDEX = ('tmp/ref_dna.fasta*', 'tmp/ref_rna.fasta*')
+#: Delimiter of the here document passing scripts to the client
+HEREDOC = 'HLAMA_SERVE_SCRIPT'
+#: Options of Bash for running the scripts, as Snakemake's ``shell()``
+SHELL_PREFIX = 'set -e -o pipefail; '
+#: Seconds between checking whether the client of a running job is gone
+CLIENT_CHECK_INTERVAL = 1
+#: Seconds between terminating and killing the jobs of gone clients
+KILL_GRACE = 10
+
+
+class SubmitException(Exception):
+    """Raised when the daemon fails to answer a job"""
+
+
+def kill_job(proc, grace=KILL_GRACE):
+    """Terminate the process group of job ``proc``, kill it after ``grace``
+    seconds
+    """
+    for sig, timeout in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            break  # already gone
+        try:
+            proc.wait(timeout)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+
+
+class FileWarmer:
+    """Keep files memory-mapped and in the page cache"""
+
+    def __init__(self):
+        #: Memory map by path
+        self.maps = {}
+        #: Protects ``maps``
+        self.lock = threading.Lock()
+
+    def add(self, paths):
+        """Map the files at ``paths`` not mapped yet, recursing into
+        directories, and return number of newly mapped files
+        """
+        result = 0
+        for path in paths:
+            if os.path.isdir(path):
+                result += self.add(
+                    os.path.join(dir_path, name)
+                    for dir_path, _, names in os.walk(path)
+                    for name in names)
+                continue
+            path = os.path.realpath(path)
+            with self.lock:
+                if path in self.maps or not os.path.isfile(path):
+                    continue
+                with open(path, 'rb') as f:
+                    if not os.fstat(f.fileno()).st_size:
+                        continue  # empty files cannot be mapped
+                    self.maps[path] = mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self.maps[path], 'madvise'):
+                    self.maps[path].madvise(mmap.MADV_WILLNEED)
+            result += 1
+        return result
+
+    def touch(self):
+        """Read a byte of each page of the files, return number of bytes"""
+        with self.lock:
+            maps = list(self.maps.values())
+        total = 0
+        for data in maps:
+            for offset in range(0, len(data), mmap.PAGESIZE):
+                data[offset]  # faults the page in if it was evicted
+            total += len(data)
+        return total
+
+    def run(self, interval=WARM_INTERVAL, stop=None):
+        """Touch the pages every ``interval`` seconds until ``stop`` is set
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.touch()
+            stop.wait(interval)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Run the script of one job and answer with its result
+
+    The script runs in a process group of its own that is killed when the
+    client closes the connection, e.g., when the Snakemake job is killed,
+    so a retried job does not write the same outputs concurrently.
+    """
+
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        server = self.server
+        work_dir = request['cwd']
+        with server.work_dirs_lock:
+            if work_dir not in server.work_dirs:
+                server.work_dirs.add(work_dir)
+                server.warmer.add(path for pattern in WORK_DIR_INDEX
+                                  for path in glob.glob(
+                                      os.path.join(work_dir, pattern)))
+        with server.slots, tempfile.TemporaryFile() as stdout, \
+                tempfile.TemporaryFile() as stderr:
+            if self.client_gone():
+                return
+            proc = subprocess.Popen(
+                ['bash', '-c', SHELL_PREFIX + request['script']],
+                cwd=work_dir, env=request['env'], stdout=stdout,
+                stderr=stderr, start_new_session=True)
+            server.jobs.add(proc)
+            try:
+                while True:
+                    try:
+                        proc.wait(CLIENT_CHECK_INTERVAL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if self.client_gone():
+                            kill_job(proc)
+                            return
+            finally:
+                server.jobs.discard(proc)
+            stdout.seek(0)
+            stderr.seek(0)
+            self.wfile.write(json.dumps({
+                'returncode': proc.returncode,
+                'stdout': stdout.read().decode('utf-8', 'replace'),
+                'stderr': stderr.read().decode('utf-8', 'replace'),
+            }).encode('utf-8') + b'\n')
+
+    def client_gone(self):
+        """Return whether the client closed the connection"""
+        readable, _, _ = select.select([self.request], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.request.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Daemon taking jobs over a Unix socket"""
+
+    daemon_threads = True
+
+    def __init__(self, path, workers, warmer=None):
+        # Only the owner may connect, also right after binding
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(path, JobHandler)
+        finally:
+            os.umask(old_umask)
+        #: Limits the number of concurrently running jobs
+        self.slots = threading.BoundedSemaphore(workers)
+        #: Keeps the index files warm
+        self.warmer = warmer or FileWarmer()
+        #: Work directories whose index files are warm
+        self.work_dirs = set()
+        #: Guards ``work_dirs`` against concurrent jobs
+        self.work_dirs_lock = threading.Lock()
+        #: ``Popen`` objects of the running jobs
+        self.jobs = set()
+
+    def kill_jobs(self):
+        """Kill the running jobs, e.g., when shutting down"""
+        for proc in list(self.jobs):
+            kill_job(proc)
+
+
+def submit(path, script, cwd=None, env=None):
+    """Run ``script`` in the daemon listening at ``path``
+
+    Return the result ``dict`` with exit code and output of the script or
+    ``None`` if no daemon is listening.  Raise ``SubmitException`` if the
+    daemon closes the connection without a complete answer.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        sock.sendall(json.dumps({
+            'script': script, 'cwd': os.path.abspath(cwd or os.getcwd()),
+            'env': dict(os.environ if env is None else env),
+        }).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line.endswith(b'\n'):
+        raise SubmitException(
+            'hlama serve at {} stopped before the job finished'.format(path))
+    return json.loads(line.decode('utf-8'))
+
+
+def wrap_script(path, script, escape_braces=False):
+    """Return shell script passing ``script`` to the client for ``path``
+
+    The result runs ``script`` in the daemon if one is listening at
+    ``path`` and locally otherwise.  With ``escape_braces``, the braces of
+    the added lines are doubled for formatting the result with Snakemake's
+    ``shell()``.
+    """
+    head = '{} -m hlama.serve submit {} <<\'{}\''.format(
+        shlex.quote(sys.executable), shlex.quote(path), HEREDOC)
+    if escape_braces:
+        head = head.replace('{', '{{').replace('}', '}}')
+    return '{}\n{}\n{}\n'.format(head, script, HEREDOC)
+
+
+def run_submit(args):
+    """Run the script from stdin in the daemon or locally"""
+    script = sys.stdin.read()
+    try:
+        result = submit(args.socket, script)
+    except SubmitException as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 1
+    if result is None:
+        return subprocess.call(['bash', '-c', SHELL_PREFIX + script])
+    sys.stdout.write(result['stdout'])
+    sys.stderr.write(result['stderr'])
+    return result['returncode']
+
+
+def run_serve(args):
+    """Run the daemon until interrupted"""
+    path = os.path.expanduser(args.socket)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        if submit(path, 'true') is not None:
+            print('ERROR: hlama serve is already listening at {}'.format(
+                path), file=sys.stderr)
+            return 1
+        os.unlink(path)  # stale socket
+    warmer = FileWarmer()
+    conf = config.Configuration.find(args.config)
+    warm = list(args.warm)
+    if conf.index_cache_path:
+        warm.append(os.path.expanduser(conf.index_cache_path))
+    num_files = warmer.add(warm)
+    threading.Thread(target=warmer.run, args=(args.warm_interval,),
+                     daemon=True).start()
+    server = Server(path, args.workers, warmer)
+    print('Serving at {} with {} workers, keeping {} files warm'.format(
+        path, args.workers, num_files), file=sys.stderr)
+    # Remove the socket also when terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.kill_jobs()
+        os.unlink(path)
+    return 0
+
+
+def main(argv=None):
+    """Main entry point of ``hlama serve``"""
+    parser = argparse.ArgumentParser(
+        prog='hlama serve',
+        description=('Run typing jobs in a daemon keeping the Yara indices '
+                     'warm'))
+    subparsers = parser.add_subparsers(dest='command')
+    # Used by the Snakefile, see HlamaSchema.serve_script()
+    submit_parser = subparsers.add_parser(
+        'submit', help='Run script from stdin in the daemon or locally')
+    submit_parser.add_argument('socket', help='Path to the socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='Path to the socket, defaults to {}'.format(
+                            DEFAULT_SOCKET))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help=('Maximal number of concurrent jobs, defaults '
+                              'to the number of CPUs'))
+    parser.add_argument('--warm', action='append', default=[],
+                        metavar='PATH',
+                        help=('File or directory to keep in the page cache '
+                              'besides the Yara index cache, give multiple '
+                              'times for multiple paths'))
+    parser.add_argument('--warm-interval', type=float, default=WARM_INTERVAL,
+                        help=('Seconds between touching the pages of the '
+                              'warm files, defaults to {}').format(
+                                  WARM_INTERVAL))
+    parser.add_argument('--config', type=str,
+                        help=('Optional explicit path to configuration '
+                              'file, by default ~/.hlama.cfg is searched '
+                              'for'))
+    args = parser.parse_args(argv)
+    if args.command == 'submit':
+        return run_submit(args)
+    return run_serve(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,68 +1,234 @@
 # -*- coding: utf-8 -*-
-"""Connection between snakemake and HLAMA"""
+"""Connection between snakemake and HLAMA
+
+The Snakefile is parsed by each Snakemake invocation, including each job on
+a cluster, so this module only imports what is needed for parsing.  NumPy
+and the call store are imported by the methods using them.
+"""
 
 import fnmatch
 import json
 import os
+import shlex
 import sys
 import tempfile
 
-from .base import HLAType
-from .pedigree import Pedigree, PedigreeMember, check_consistency, \
-    check_identity
-from .matched_pairs import check_consistency as check_pair_consistency
+from .pedigree import Pedigree, PedigreeMember
 
-from .app import PATTERNS_R1, PATTERNS_R2
+from .base import ALIGNED, PATTERNS_R1, PATTERNS_R2, load_calls
 from . import config
+from . import environment
+from . import report
+from .index_cache import IndexCache
 
 from hlama import __version__
 
+#: Name of the rendered OptiType configuration in the work directory
+OPTITYPE_INI = 'optitype.ini'
+
+#: Name of the group of the typing jobs of a sample for cluster execution
+TYPING_GROUP = 'typing'
+#: Memory in MB for jobs running Yara against the HLA reference, and the
+#: additional memory per thread
+PREFILTER_MEM_MB = 2048
+PREFILTER_MEM_MB_PER_THREAD = 256
+#: Memory in MB of OptiType without reads, and per 1000 HLA reads
+OPTITYPE_MEM_MB = 2048
+OPTITYPE_MEM_MB_PER_1K_READS = 20
+#: Approximate number of bytes per read in compressed input files
+BYTES_PER_READ = 70
+#: Approximate fraction of the reads mapping to the HLA reference, by
+#: sequence type
+HLA_READ_FRACTION = {'DNA': 0.001, 'RNA': 0.01}
+#: awk program printing the positions of the mates of SAM records as BED
+#: intervals, for paired records with mapped mates.  ``PNEXT`` is 1-based,
+#: ``RNEXT`` is ``=`` for mates on the same contig.
+MATES_BED_AWK = (
+    r'int($2 / 1) % 2 && !(int($2 / 8) % 2) && $7 != "*" '
+    r'{ print ($7 == "=" ? $3 : $7) "\t" $8 - 1 "\t" $8 }')
+
 
 class HlamaSchema:
 
-    def __init__(self, data):
+    def __init__(self, data, prefix=''):
         self.data = data
         if self.data['version'] != __version__:
             raise Exception(('Incompatible data.json version, hlama '
                              'has version {}').format(__version__))
+        #: Prefix of the report paths, the directory of a batch's sheet
+        self.prefix = prefix
+        #: Member entries by report shard, see ``_get_shards()``
+        self._shards = None
+        #: Schemas of the sheets of a batch by name, see ``get_sheet()``
+        self._sheets = {}
+        #: Path to the rendered OptiType configuration, see
+        #: ``get_optitype_ini()``
+        self._optitype_ini = None
         self.load_config()
-        self.build_optitype_ini()
 
     def yara_threads(self):
         """Return number of threads to use for Yara"""
         return self.data['num_threads']
 
+    def ilp_threads(self):
+        """Return number of threads for OptiType's ILP solver"""
+        return self.data['ilp_threads']
+
+    def optitype_threads(self):
+        """Return number of threads of OptiType jobs
+
+        razers3 and the ILP solver run one after the other.
+        """
+        return max(self.yara_threads(), self.ilp_threads())
+
+    def kmer_prescreen(self):
+        """Return whether to pre-screen reads for HLA k-mers"""
+        return self.data['kmer_prescreen']
+
+    def low_scratch(self):
+        """Return whether to keep pre-filtered reads compressed"""
+        return self.data['low_scratch']
+
+    def keep_prefiltered(self):
+        """Return whether to keep the pre-filtered reads after typing"""
+        return self.data['keep_prefiltered']
+
+    def prefilter_ext(self):
+        """Return file extension of the pre-filtered reads"""
+        return '.fq.gz' if self.low_scratch() else '.fq'
+
     def load_config(self):
         config_path = self.data['config']
-        if config_path:
-            if not os.path.exists(config_path):
-                print('No configuration file at {}'.format(config_path),
-                      file=sys.stderr)
-                return 1
-            self.conf = config.Configuration.load(config_path)
-        elif os.path.exists(os.path.expanduser('~/.hlama.cfg')):
-            self.conf = config.Configuration.load(
-                os.path.expanduser('~/.hlama.cfg'))
-        else:
-            self.conf = config.Configuration.load(os.path.join(
-                os.path.dirname(__file__), 'default_config.ini'))
+        if config_path and not os.path.exists(config_path):
+            print('No configuration file at {}'.format(config_path),
+                  file=sys.stderr)
+            return 1
+        self.conf = config.Configuration.find(config_path)
 
     def command_prefix(self):
+        """Return shell commands setting up the environment of the tools
+
+        If a snapshot of the environment was taken, it is sourced instead of
+        activating the environment in each job.
+        """
+        path = self.data['env_snapshot']
+        if path:
+            return '# Load environment snapshot\nsource {}'.format(
+                shlex.quote(environment.script_path(path)))
         return self.conf.cmd_prefix()
 
-    def build_optitype_ini(self):
-        ini_in = os.path.join(os.path.dirname(__file__), 'optitype.ini')
-        with open(ini_in, 'rt') as f:
-            contents = f.read()
-        contents = contents.format(num_threads=self.data['num_threads'])
-        with tempfile.NamedTemporaryFile(
-                'wt', suffix='.ini', delete=False) as f:
-            f.write(contents)
-        self.optitype_ini_path = f.name
+    def get_tool_path(self, tool):
+        """Return absolute path of ``tool`` from the environment snapshot
+
+        Without a snapshot or if the tool was not found, return ``tool``
+        for looking it up in ``$PATH``.
+        """
+        path = self.data['env_snapshot']
+        if path:
+            return environment.EnvSnapshot.load(path).tools.get(tool) or tool
+        return tool
+
+    def mhc_regions(self):
+        """Return regions to extract reads from BAM/CRAM files from"""
+        return self.conf.mhc_regions
+
+    def samtools_reference_arg(self):
+        """Return samtools argument with reference for CRAM decoding"""
+        if self.conf.cram_reference:
+            return '-T {}'.format(self.conf.cram_reference)
+        else:
+            return ''
+
+    def serve_script(self, script):
+        """Return ``script`` for ``shell()``, run by the ``hlama serve``
+        daemon if its socket exists (see ``hlama.serve``)
+        """
+        path = self.data['serve_socket']
+        if not path or not os.path.exists(path):
+            return script
+        from . import serve
+        return serve.wrap_script(path, script, escape_braces=True)
+
+    def yara_index_cache(self):
+        """Return ``IndexCache`` for Yara indices or ``None`` if disabled"""
+        path = self.conf.index_cache_path
+        if path:
+            return IndexCache(path)
+        else:
+            return None
 
-    def cleanup(self):
-        """Remove tmemporary files"""
-        os.unlink(self.optitype_ini_path)
+    def get_optitype_ini(self, wildcards=None):
+        """Return absolute path to the OptiType configuration
+
+        The configuration is rendered into the work directory once and
+        reused by all jobs.  It is only rewritten (atomically) if its
+        contents changed, e.g., the number of threads.
+        """
+        if self._optitype_ini is None:
+            ini_in = os.path.join(os.path.dirname(__file__), 'optitype.ini')
+            with open(ini_in, 'rt') as f:
+                contents = f.read().format(
+                    num_threads=self.yara_threads(),
+                    ilp_threads=self.ilp_threads(),
+                    razers3=self.get_tool_path('razers3'))
+            path = os.path.abspath(OPTITYPE_INI)
+            if not _has_contents(path, contents):
+                with tempfile.NamedTemporaryFile(
+                        'wt', dir=os.path.dirname(path), suffix='.ini',
+                        delete=False) as f:
+                    f.write(contents)
+                os.replace(f.name, path)
+            self._optitype_ini = path
+        return self._optitype_ini
+
+    def get_final_outputs(self):
+        """Return the files to create with the ``all`` rule"""
+        if self.data['schema'] == 'hla_identify':
+            return list(self.get_report_input())
+        elif self.data['schema'] == 'hla_batch':
+            return [path for name in sorted(self.data['sheets'])
+                    for path in self.get_sheet(name).get_final_outputs()]
+        elif self.data['schema'] == 'hla_pedigree':
+            return [self.prefix + 'report.txt',
+                    self.prefix + 'cohort_report.txt',
+                    self.prefix + 'mendel_report.txt']
+        else:
+            return [self.prefix + 'report.txt',
+                    self.prefix + 'cohort_report.txt']
+
+    def get_sheet(self, name):
+        """Return ``HlamaSchema`` for the sheet ``name`` of a batch
+
+        The sheet's members combine the entries of the sheet with the
+        shared typing entries, its reports go to ``sheets/{name}/``.
+        """
+        if name not in self._sheets:
+            sheet = self.data['sheets'][name]
+            data = {key: value for key, value in self.data.items()
+                    if key not in ('schema', 'members', 'sheets')}
+            data['schema'] = sheet['schema']
+            data['members'] = {
+                member_name: dict(member, **self.data['members'][member_name])
+                for member_name, member in sheet['members'].items()}
+            self._sheets[name] = HlamaSchema(
+                data, 'sheets/{}/'.format(name))
+        return self._sheets[name]
+
+    def get_sheet_report_shards(self, wildcards):
+        """Return paths of the report shards of a batch's sheet"""
+        return self.get_sheet(wildcards.sheet).get_report_shards()
+
+    def get_sheet_report_shard_metrics(self, wildcards):
+        """Return paths of the shard metrics files of a batch's sheet"""
+        return self.get_sheet(wildcards.sheet).get_report_shard_metrics()
+
+    def get_sheet_shard_input(self, wildcards):
+        """Return paths to the calls of a report shard of a batch's sheet"""
+        return self.get_sheet(wildcards.sheet).get_shard_input(wildcards)
+
+    def get_sheet_report_input(self, wildcards):
+        """Return paths to the calls of the members of a batch's sheet"""
+        return list(self.get_sheet(wildcards.sheet).get_report_input())
 
     def get_report_input(self):
         result = []
@@ -80,126 +246,265 @@ class HlamaSchema:
 
     def get_first_read_paths(self, wildcards):
         member = self.data['members'][wildcards.sample]
-        for path in member['files']:
-            for pattern in PATTERNS_R1:
-                if fnmatch.fnmatch(path, pattern):
-                    yield path
+        return _match_paths(member['files'], PATTERNS_R1)
 
     def get_second_read_paths(self, wildcards):
         member = self.data['members'][wildcards.sample]
-        for path in member['files']:
-            for pattern in PATTERNS_R2:
-                if fnmatch.fnmatch(path, pattern):
-                    yield path
+        return _match_paths(member['files'], PATTERNS_R2)
+
+    def get_lanes(self, sample):
+        """Return list of ``(first, second)`` read paths of each lane
+
+        For single-end data, ``second`` is ``None``.  For BAM/CRAM input,
+        each file is a lane and the paths point to the extracted reads.
+        """
+        member = self.data['members'][sample]
+        if member['mode'] == ALIGNED:
+            tpl = '{}.d/extracted/aligned_{}_{}.fq'
+            return [(tpl.format(sample, i, 1), tpl.format(sample, i, 2))
+                    for i in range(len(member['files']))]
+        first = _match_paths(member['files'], PATTERNS_R1)
+        second = _match_paths(member['files'], PATTERNS_R2)
+        return [(path, second[i] if i < len(second) else None)
+                for i, path in enumerate(first)]
+
+    def get_lane_read_paths(self, wildcards):
+        """Return input read paths of one lane for pre-filtering"""
+        lane = self.get_lanes(wildcards.sample)[int(wildcards.lane)]
+        return [path for path in lane if path]
+
+    def get_aligned_path(self, wildcards):
+        """Return path to BAM/CRAM file to extract reads from"""
+        member = self.data['members'][wildcards.sample]
+        return member['files'][int(wildcards.index)]
+
+    def get_prefiltered_first_reads(self, wildcards):
+        """Return paths to pre-filtered first reads, in lane order
+
+        Empty if the calls were taken from the call store.
+        """
+        return self._get_lane_outputs(
+            wildcards.sample, '_1' + self.prefilter_ext())
+
+    def get_prefiltered_second_reads(self, wildcards):
+        """Return paths to pre-filtered second reads, in lane order
+
+        Empty if the calls were taken from the call store.
+        """
+        return self._get_lane_outputs(
+            wildcards.sample, '_2' + self.prefilter_ext())
+
+    def get_prefilter_metrics(self, wildcards):
+        """Return paths to metrics files of the pre-filter jobs"""
+        return self._get_lane_outputs(wildcards.sample, '_metrics.json')
+
+    def _get_lane_outputs(self, sample, suffix):
+        if self.data['members'][sample]['precomputed']:
+            return []
+        tpl = '{}.d/prefilter/lane_{}{}'
+        return [tpl.format(sample, i, suffix)
+                for i in range(len(self.get_lanes(sample)))]
+
+    def get_prefilter_mem_mb(self, wildcards, attempt=1):
+        """Return memory in MB to request for pre-filtering a lane
+
+        The memory is increased for each attempt after running out of
+        memory, see ``--restart-times`` of Snakemake.
+        """
+        return attempt * (PREFILTER_MEM_MB +
+                          PREFILTER_MEM_MB_PER_THREAD * self.yara_threads())
+
+    def get_input_bytes(self, sample):
+        """Return total size of the input files of ``sample``"""
+        size = 0
+        for path in self.data['members'][sample]['files']:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass  # the checks were disabled
+        return size
+
+    def get_expected_hla_reads(self, sample):
+        """Return expected number of HLA reads passed on to OptiType
+
+        Estimated from the size of the input files and the sequence type,
+        limited by the read budget.
+        """
+        member = self.data['members'][sample]
+        size = self.get_input_bytes(sample)
+        seq_type = member.get('seq_type', 'DNA')
+        result = int(size / BYTES_PER_READ * HLA_READ_FRACTION[seq_type])
+        if member['max_hla_reads']:
+            result = min(result, member['max_hla_reads'])
+        return result
+
+    def get_optitype_mem_mb(self, wildcards, attempt=1):
+        """Return memory in MB to request for typing a sample
+
+        OptiType's memory grows with the number of HLA reads, see
+        ``get_expected_hla_reads()``.  The memory is increased for each
+        attempt after running out of memory.
+        """
+        reads = self.get_expected_hla_reads(wildcards.sample)
+        return attempt * (OPTITYPE_MEM_MB +
+                          OPTITYPE_MEM_MB_PER_1K_READS * reads // 1000)
 
     def get_seq_type(self, wildcards):
         member = self.data['members'][wildcards.sample]
         return member.get('seq_type', 'DNA')
 
+    def store_calls(self, wildcards):
+        """Add the calls of the sample to the call store, if enabled"""
+        member = self.data['members'][wildcards.sample]
+        if not self.data['call_store'] or not member['fingerprint']:
+            return
+        from .call_store import CallStore
+        with open('{}.d/hla_types.txt'.format(wildcards.sample), 'rt') as f:
+            hla_types = [line.strip() for line in f if line.strip()]
+        CallStore(self.data['call_store']).put(
+            member['fingerprint'], hla_types)
+
+    def get_max_hla_reads(self, wildcards):
+        """Return maximal number of HLA reads to collect, ``0`` for all"""
+        return self.data['members'][wildcards.sample]['max_hla_reads']
+
     def get_schema_type(self):
         return(self.data['schema'])
 
-    def _build_pedigree(self):
-        members = []
-        for member in self.data['members'].values():
-            members.append(PedigreeMember(
+    def _build_pedigree(self, members=None):
+        if members is None:
+            members = self.data['members'].values()
+        result = []
+        for member in members:
+            result.append(PedigreeMember(
                 member['family'],
                 member['name'],
                 member['father'],
                 member['mother'],
                 member['gender'],
                 member['disease']))
-        return Pedigree(members)
-
-    # TODO: refactor out of here, only applies to pedigree
-    def check_consistency(self, out_path, mode):
-        if mode == "hla_pedigree":
-            pedigree = self._build_pedigree()
-
-            print('Loading HLA calls...', file=sys.stderr)
-            all_calls = {}
-            calls = {}
-            for member in pedigree.members:
-                donor = member.name
-                all_calls[donor] = []
-                calls[donor] = {'A': [], 'B': [], 'C': []}
-                with open('{}.d/hla_types.txt'.format(donor), 'rt') as fcalls:
-                    for hla_type in sorted(HLAType.parse(line.strip())
-                                           for line in fcalls):
-                        calls[donor][hla_type.gene_name].append(hla_type)
-                        all_calls[donor].append(hla_type)
-
-            print('Collecting index members...', file=sys.stderr)
-            index_members = [member.name for member in pedigree.members
-                             if member.father != '0' or member.mother != '0']
-
-            print('Checking for consistency...', file=sys.stderr)
-            with open(out_path, 'wt') as f:
-                for index in index_members:
-                    # get IDs of parents
-                    index_member = pedigree.by_name[index]
-                    father = index_member.father
-                    mother = index_member.mother
-                    # check for identity to any parent, flag warning
-                    flags = []
-                    for digits in (2, 4):
-                        if check_identity(digits, calls[index],
-                                          calls.get(father)):
-                            flags.append('WARN:identity-father:{}'.format(
-                                digits))
-                        if check_identity(digits, calls[index],
-                                          calls.get(mother)):
-                            flags.append('WARN:identity-mother:{}'.format(
-                                digits))
-                    # check for 4 digit consistency
-                    mm4 = check_consistency(4, calls[index], calls.get(father),
-                                            calls.get(mother))
-                    # check for 2 digit consistency
-                    mm2 = check_consistency(2, calls[index], calls.get(father),
-                                            calls.get(mother))
-                    # get count of present parents
-                    num_parents = len({father, mother} - {'0'})
-                    # print result line
-                    print('\t'.join(map(str, [
-                        index, num_parents, mm2 or 'OK', mm4 or 'OK',
-                        ','.join(flags) or 'OK'
-                    ])), file=f)
-        ######################################################################
-        elif mode == "hla_check_pairs":
-            print('Loading HLA calls...', file=sys.stderr)
-            for sample in self.data['members'].values():
-                sname = sample['sample']
-                if sample['sample'] == sample['reference']:
-                    continue
-                else:
-                    ftumor = sample['sample'] + ".d/hla_types.txt"
-                    fnormal = sample['reference'] + ".d/hla_types.txt"
-
-                print(sname, fnormal, ftumor, file=sys.stderr)
-                ncalls = {}
-                tcalls = {}
-
-                ncalls[sname] = []
-                with open(fnormal, 'rt') as calls:
-                    for hla_type in sorted(HLAType.parse(line.strip())
-                                           for line in calls):
-                        ncalls[sname].append(hla_type)
-
-                tcalls[sname] = []
-                with open(ftumor, 'rt') as calls:
-                    for hla_type in sorted(HLAType.parse(line.strip())
-                                           for line in calls):
-                        tcalls[sname].append(hla_type)
-                print('Checking for consistency...', file=sys.stderr)
-                # check for 4 digit consistency
-                mm4 = check_pair_consistency(4, ncalls[sname], tcalls[sname])
-                # check for 2 digit consistency
-                mm2 = check_pair_consistency(2, ncalls[sname], tcalls[sname])
-                # print result line
-                with open(out_path, 'at') as f:
-                    print('\t'.join(map(str, [
-                        sname, mm2 or 'OK', mm4 or 'OK'
-                    ])), file=f)
+        return Pedigree(result)
+
+    def get_cohort_groups(self):
+        """Return ``dict`` with the group of each member for cohort report
+
+        Samples of the same group are expected to match.
+        """
+        if self.get_schema_type() == 'hla_check_pairs':
+            return {name: member['donor']
+                    for name, member in self.data['members'].items()}
+        else:  # each pedigree member is an individual
+            return {name: name for name in self.data['members']}
+
+    def write_cohort_report(self, out_path, out_samples, out_dist_2,
+                            out_dist_4):
+        """Compare calls of all members and write ranked suspicious matches
+
+        The full distance matrices at two and four digits precision are
+        written as ``.npy`` files, in the order of ``out_samples``.
+        """
+        import numpy as np
+        from . import cohort
+
+        groups = self.get_cohort_groups()
+        names = sorted(groups)
+        calls = [load_calls('{}.d/hla_types.txt'.format(name))
+                 for name in names]
+        shape = (len(names), len(names))
+        dist_2 = np.lib.format.open_memmap(out_dist_2, 'w+', np.int8, shape)
+        dist_4 = np.lib.format.open_memmap(out_dist_4, 'w+', np.int8, shape)
+        suspicious = cohort.compare_all(
+            names, calls, [groups[name] for name in names],
+            out_2=dist_2, out_4=dist_4)
+        dist_2.flush()
+        dist_4.flush()
+        with open(out_samples, 'wt') as f:
+            print('\n'.join(names), file=f)
+        with open(out_path, 'wt') as f:
+            cohort.write_report(f, suspicious)
+
+    def write_mendel_report(self, out_path):
+        """Check the transmission of alleles in the whole pedigree and
+        write the inconsistencies
+        """
+        from . import mendel
+
+        calls = {name: load_calls('{}.d/hla_types.txt'.format(name))
+                 for name in self.data['members']}
+        findings = mendel.check_pedigree(self._build_pedigree(), calls)
+        with open(out_path, 'wt') as f:
+            mendel.write_report(f, findings)
+
+    def get_shard_key(self):
+        """Return member key defining the report shards
+
+        The report is sharded by donor for tumor/normal pairs and by family
+        for pedigrees.
+        """
+        return report.shard_key(self.get_schema_type())
+
+    def get_shard_members(self, shard):
+        """Return the ``data.json`` entries of the members of ``shard``"""
+        return self._get_shards()[shard]
+
+    def _get_shards(self):
+        """Return ``dict`` with sorted member entries by shard, cached
+
+        Empty without report shards, e.g., for identifying samples.
+        """
+        if self._shards is None:
+            key = self.get_shard_key()
+            self._shards = {}
+            members = sorted(self.data['members'].items()) if key else []
+            for _, member in members:
+                self._shards.setdefault(member[key], []).append(member)
+        return self._shards
+
+    def get_report_shards(self):
+        """Return paths of the report shards, in report order"""
+        return ['{}report.d/{}.txt'.format(self.prefix, shard)
+                for shard in sorted(self._get_shards())]
+
+    def get_report_shard_metrics(self):
+        """Return paths of the metrics files of the report shards"""
+        return [path[:-len('.txt')] + '.metrics.json'
+                for path in self.get_report_shards()]
+
+    def get_shard_input(self, wildcards):
+        """Return paths to the calls of the members of a report shard"""
+        return ['{}.d/hla_types.txt'.format(member['name'])
+                for member in self.get_shard_members(wildcards.shard)]
+
+    def write_report_shard(self, shard, out_path):
+        """Write the report lines of the members of ``shard``"""
+        members = self.get_shard_members(shard)
+        calls = {member['name']: report.load_calls(
+            '{}.d/hla_types.txt'.format(member['name']))
+            for member in members}
+        if self.get_schema_type() == 'hla_pedigree':
+            lines = report.pedigree_lines(
+                self._build_pedigree(members), calls)
+        else:
+            lines = report.pair_lines(members, calls)
+        report.write_shard(out_path, lines)
+
+
+def _match_paths(paths, patterns):
+    """Return the paths whose file name matches one of the patterns"""
+    result = []
+    for path in paths:
+        filename = os.path.basename(path)
+        if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+            result.append(path)
+    return result
+
+
+def _has_contents(path, contents):
+    """Return whether the file at ``path`` exists with ``contents``"""
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rt') as f:
+        return f.read() == contents
 
 
 def build_schema(path):
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Table of the performance metrics of typed samples
+
+``hlama stats`` combines the ``SAMPLE.d/metrics.json`` files of one or more
+work directories into a tab-separated table with one row per sample,
+followed by rows with the sum and the maximum of each column, e.g., for
+capacity planning.
+
+Usage::
+
+    hlama stats WORK_DIR [WORK_DIR ...] > stats.tsv
+"""
+
+import argparse
+import json
+import os
+import sys
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Columns before the per-stage columns
+COLUMNS = ('work_dir', 'sample', 'prefilter_reads_in',
+           'prefilter_reads_out', 'hla_reads', 'subsampled', 'temp_mb',
+           'scratch_peak_mb')
+#: Suffix of the per-stage columns and the key in the stage metrics
+STAGE_COLUMNS = (('wall_s', 'wall_s'), ('cpu_s', 'cpu_s'),
+                 ('max_rss_mb', 'max_rss_kb'))
+
+
+def load_metrics(work_dir):
+    """Yield pairs of sample name and metrics in work directory
+
+    Samples without ``metrics.json`` or with calls taken from the call
+    store are skipped.
+    """
+    with open(os.path.join(work_dir, 'data.json'), 'rt') as f:
+        data = json.load(f)
+    for name in sorted(data['members']):
+        path = os.path.join(work_dir, '{}.d'.format(name), 'metrics.json')
+        if os.path.exists(path):
+            with open(path, 'rt') as f:
+                metrics = json.load(f)
+            if not metrics.get('precomputed'):
+                yield name, metrics
+
+
+def to_row(work_dir, sample, metrics):
+    """Return ``dict`` with the table columns for a sample"""
+    row = {
+        'work_dir': work_dir,
+        'sample': sample,
+        'prefilter_reads_in': metrics['prefilter']['reads_in'],
+        'prefilter_reads_out': metrics['prefilter']['reads_out'],
+        'hla_reads': metrics['read_budget']['hla_reads'],
+        'subsampled': int(metrics['read_budget']['subsampled']),
+        'temp_mb': round(metrics['temp_bytes'] / 1024 ** 2, 1),
+        'scratch_peak_mb': round(
+            metrics['scratch']['peak_bytes'] / 1024 ** 2, 1),
+    }
+    for stage, stats in metrics['stages'].items():
+        for suffix, key in STAGE_COLUMNS:
+            value = stats[key]
+            if key == 'max_rss_kb' and value is not None:
+                value = round(value / 1024, 1)
+            row['{}_{}'.format(stage, suffix)] = value
+    return row
+
+
+def summarize(rows, columns):
+    """Return rows with the sum and the maximum of the numeric columns"""
+    result = []
+    for label, func in (('sum', sum), ('max', max)):
+        summary = {'work_dir': label, 'sample': label}
+        for column in columns[2:]:
+            values = [row[column] for row in rows
+                      if row.get(column) is not None]
+            summary[column] = round(func(values), 3) if values else None
+        result.append(summary)
+    return result
+
+
+def write_table(f, rows):
+    """Write table with rows and summary rows to file-like object ``f``"""
+    stages = sorted({key for row in rows for key in row} - set(COLUMNS))
+    columns = list(COLUMNS) + stages
+    print('\t'.join(columns), file=f)
+    for row in rows + summarize(rows, columns):
+        print('\t'.join('.' if row.get(column) is None else str(row[column])
+                        for column in columns), file=f)
+
+
+def run(args):
+    """Main entry point after parsing command line parameters"""
+    rows = []
+    for work_dir in args.work_dirs:
+        if not os.path.exists(os.path.join(work_dir, 'data.json')):
+            print('ERROR: No data.json in {}'.format(work_dir),
+                  file=sys.stderr)
+            return 1
+        for sample, metrics in load_metrics(work_dir):
+            rows.append(to_row(work_dir, sample, metrics))
+    write_table(sys.stdout, rows)
+
+
+def main(argv=None):
+    """Main entry point of ``hlama stats``"""
+    parser = argparse.ArgumentParser(
+        prog='hlama stats',
+        description='Print table of the performance metrics of samples')
+    parser.add_argument('work_dirs', nargs='+', metavar='WORK_DIR',
+                        help='hlama work directory with typed samples')
+    args = parser.parse_args(argv)
+    return run(args)
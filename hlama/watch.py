@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Type the samples of a sheet while their input files are arriving
+
+The sequencer output often reaches the ``--reads-base-dir`` locations over
+several hours, while hlama requires all input files of the sheet up front.
+``hlama watch`` takes the same arguments as ``hlama`` and polls the base
+directories instead:
+
+- A member is ready when all of its input files are present (and, with
+  the checks enabled, consistent and indexed) and none of them changed its
+  size or modification time for ``--stable-seconds``.  Files last modified
+  earlier count as stable right away.
+- Whenever members became ready, ``data.json`` is updated to contain the
+  ready members (as with ``--update``) and Snakemake is run for typing them
+  and for writing the report shards of the donors or families whose
+  members are all ready.
+- Once all members are ready, the merged reports are written and the
+  command exits.
+
+Newly arriving files are picked up after the running Snakemake round, so
+typing overlaps with the data arrival.  Polling uses the cached directory
+listings of locating the files, i.e., one listing per base directory and
+poll.  As the work directory is updated in place, an interrupted or failed
+``hlama watch`` can simply be started again.
+
+Usage::
+
+    hlama watch --pedigree families.ped --reads-base-dir /incoming \\
+        [--stable-seconds N] [--poll-interval N] [--timeout HOURS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from . import app
+from . import report
+from .app import Batch, InputDataException
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Default seconds the input files must be unchanged before typing
+STABLE_SECONDS = 300
+#: Default seconds between polls of the base directories
+POLL_INTERVAL = 60
+
+
+class StabilityTracker:
+    """Track the size and modification time of files
+
+    A file is stable once its size and modification time did not change
+    for ``stable_seconds``.
+    """
+
+    def __init__(self, stable_seconds=STABLE_SECONDS):
+        #: Seconds without changes before a file is stable
+        self.stable_seconds = stable_seconds
+        #: ``((size, mtime), since)`` of the files seen by path, ``since``
+        #: is the time of the last observed change
+        self.seen = {}
+
+    def is_stable(self, path, now=None):
+        """Return whether the file at ``path`` exists and is stable"""
+        now = time.time() if now is None else now
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.seen.pop(path, None)
+            return False
+        key = (stat.st_size, stat.st_mtime)
+        if path not in self.seen or self.seen[path][0] != key:
+            # Changed at most at its modification time
+            self.seen[path] = (key, min(now, stat.st_mtime))
+        return now - self.seen[path][1] >= self.stable_seconds
+
+
+def restrict(info, names):
+    """Return copy of ``Cohort``, ``Pedigree``, or ``Batch`` ``info`` with
+    the members in ``names`` only
+    """
+    if isinstance(info, Batch):
+        return Batch([(name, schema, restrict(sheet, names))
+                      for name, schema, sheet in info.sheets])
+    return type(info)(m for m in info.members if m.name in names)
+
+
+def get_shards(info, schema):
+    """Return list of ``(path, member names)`` of the report shards
+
+    ``schema`` is the ``data.json`` schema of ``info``.
+    """
+    if isinstance(info, Batch):
+        sheets = [('sheets/{}/'.format(name), sheet_schema, sheet)
+                  for name, sheet_schema, sheet in info.sheets]
+    else:
+        sheets = [('', schema, info)]
+    result = []
+    for prefix, sheet_schema, sheet in sheets:
+        key = report.shard_key(sheet_schema)
+        shards = {}
+        for member in sheet.members:
+            shards.setdefault(getattr(member, key), []).append(member.name)
+        result += [('{}report.d/{}.txt'.format(prefix, shard), names)
+                   for shard, names in sorted(shards.items())]
+    return result
+
+
+class Watcher:
+    """Type the members of a sheet as their input files become ready"""
+
+    def __init__(self, hlama_app, tracker):
+        #: The ``BaseApp`` for the sheets
+        self.app = hlama_app
+        #: The ``StabilityTracker`` of the input files
+        self.tracker = tracker
+
+    def is_ready(self, member):
+        """Return whether the input files of ``member`` are complete
+
+        The files must have been located by the application before.
+        """
+        paths = member.data[0].split(',')
+        located = [self.app.located.get(path) for path in paths]
+        if None in located:
+            return False
+        if self.app.args.perform_checks:
+            try:
+                self.app.check_member_paths(member.name, paths)
+            except InputDataException:
+                return False  # e.g., index not written yet
+        return all([self.tracker.is_stable(path) for path in located])
+
+    def poll(self, info):
+        """Locate the input files again, return names of ready members"""
+        self.app.forget_files()
+        self.app.locate_files(info)
+        return {member.name for member in info.members
+                if self.is_ready(member)}
+
+    def get_targets(self, info, ready):
+        """Return the calls of the ``ready`` members and the report shards
+        whose members are all ready
+        """
+        result = ['{}.d/hla_types.txt'.format(name) for name in sorted(ready)]
+        result += [path for path, names in get_shards(info, self.app.SCHEMA)
+                   if ready.issuperset(names)]
+        return result
+
+    def type_members(self, info, ready):
+        """Update the work dir for the ``ready`` members and run Snakemake
+
+        All outputs are created once all members of ``info`` are ready.
+        Return ``True`` on success.
+        """
+        path = os.path.join(self.app.args.work_dir, 'data.json')
+        self.app.args.update = os.path.exists(path)
+        self.app.write_work_dir(
+            self.app.build_data_json(restrict(info, ready)))
+        if not self.app.args.run_snakemake:
+            return True
+        if len(ready) == len(info.members):
+            targets = None
+        else:
+            targets = self.get_targets(info, ready)
+        return self.app.call_snakemake(targets)
+
+    def run(self, poll_interval=POLL_INTERVAL, timeout=None):
+        """Watch until all members are typed, return exit code"""
+        self.app.create_out_dir()
+        self.app.conf = self.app.load_config()
+        info = self.app.load_info()
+        start = time.time()
+        typed = set()
+        while True:
+            # Members stay typed, also if their files are touched again
+            ready = self.poll(info) | typed
+            if ready - typed:
+                print('{} of {} members ready, typing {} new'.format(
+                    len(ready), len(info.members), len(ready - typed)),
+                    file=sys.stderr)
+                if not self.type_members(info, ready):
+                    print('ERROR: Snakemake failed, start hlama watch again '
+                          'for resuming', file=sys.stderr)
+                    return 1
+                typed = ready
+            if len(typed) == len(info.members):
+                print('All {} members ready, see {}/{}'.format(
+                    len(typed), self.app.args.work_dir, self.app.RESULT),
+                    file=sys.stderr)
+                return 0
+            if timeout is not None and time.time() - start > timeout:
+                missing = sorted(m.name for m in info.members
+                                 if m.name not in typed)
+                print('ERROR: Input files of {} members incomplete after '
+                      'timeout: {}'.format(len(missing), ', '.join(missing)),
+                      file=sys.stderr)
+                return 1
+            time.sleep(poll_interval)
+
+
+def main(argv=None):
+    """Main entry point of ``hlama watch``"""
+    parser = argparse.ArgumentParser(
+        prog='hlama watch',
+        description=('Type the samples of the sheets as soon as their input '
+                     'files are complete'))
+    app.add_sheet_args(parser)
+    app.add_common_args(parser)
+    parser.add_argument('--stable-seconds', type=float,
+                        default=STABLE_SECONDS,
+                        help=('Seconds the size and modification time of '
+                              'the input files must be unchanged before '
+                              'typing, defaults to {}').format(
+                                  STABLE_SECONDS))
+    parser.add_argument('--poll-interval', type=float,
+                        default=POLL_INTERVAL,
+                        help=('Seconds between looking for new input files, '
+                              'defaults to {}').format(POLL_INTERVAL))
+    parser.add_argument('--timeout', type=float, default=None,
+                        help=('Give up when input files are still missing '
+                              'after this many hours, by default waits '
+                              'forever'))
+    args = parser.parse_args(argv)
+    if not (args.tumor_normal or args.pedigree):
+        parser.error('at least one --tumor-normal or --pedigree file is '
+                     'required')
+    if args.plan:
+        parser.error('--plan cannot be used with hlama watch')
+    app.make_paths_absolute(args)
+
+    print(app.BANNER + '\n', file=sys.stderr)
+    watcher = Watcher(app.make_app(args), StabilityTracker(
+        args.stable_seconds))
+    timeout = None if args.timeout is None else args.timeout * 3600
+    try:
+        return watcher.run(args.poll_interval, timeout)
+    except InputDataException as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
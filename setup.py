@@ -20,8 +20,12 @@ setup(
             'hlama = hlama.app:main',
         ],
     },
+    python_requires='>=3.6',
     install_requires=[
-        'snakemake==3.7.1',
+        'snakemake>=5.25',
+        # Snakemake before 8 calls pulp.list_solvers(), removed in PuLP 2.8
+        'pulp<2.8',
+        'numpy',
     ],
     package_data={
         '': ['Snakefile', '*.ini', '*.fasta.gz'],
@@ -33,6 +37,9 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
         'Topic :: Scientific/Engineering :: Bio-Informatics'
     ],
     zip_safe=False,
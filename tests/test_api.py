@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Tests for the library API"""
+
+import subprocess
+import sys
+
+import pytest
+
+from hlama import api
+from hlama.base import HLAType
+from hlama.matched_pairs import Donor
+from hlama.pedigree import Pedigree, PedigreeMember
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+#: Calls of the samples
+CALLS = {
+    'father': ['A*01:01', 'A*02:01', 'B*07:02', 'B*08:01', 'C*01:06',
+               'C*02:02'],
+    'mother': ['A*03:01', 'A*24:02', 'B*15:01', 'B*27:05', 'C*03:04',
+               'C*07:02'],
+    'child': ['A*01:01', 'A*24:02', 'B*07:02', 'B*27:05', 'C*02:02',
+              'C*07:01'],
+}
+
+
+def test_parse_calls():
+    calls = api.parse_calls(['B*08:01\n', '', HLAType.parse('A*02:01'),
+                             'A*01:01'])
+    assert calls == {
+        'A': [HLAType.parse('A*01:01'), HLAType.parse('A*02:01')],
+        'B': [HLAType.parse('B*08:01')], 'C': []}
+
+
+def test_check_trio():
+    result = api.check_trio(CALLS['child'], CALLS['father'],
+                            CALLS['mother'], name='child')
+    assert (result.num_parents, result.mismatches_2,
+            result.mismatches_4) == (2, 0, 1)
+    assert not result.ok
+    assert result.to_line() == 'child\t2\tOK\t1\tOK'
+    # Only one parent
+    result = api.check_trio(CALLS['child'], mother_calls=CALLS['mother'])
+    assert (result.num_parents, result.mismatches_2,
+            result.mismatches_4) == (1, 0, 1)
+    assert api.check_trio(CALLS['child'], CALLS['father']).ok
+    # Identical to the father
+    result = api.check_trio(CALLS['father'], CALLS['father'], name='x')
+    assert result.flags == ['WARN:identity-father:2',
+                            'WARN:identity-father:4']
+    assert result.to_line() == ('x\t1\tOK\tOK\t'
+                                'WARN:identity-father:2,'
+                                'WARN:identity-father:4')
+    with pytest.raises(ValueError):
+        api.check_trio(CALLS['child'])
+
+
+def test_check_pedigree():
+    pedigree = Pedigree([
+        PedigreeMember('fam', 'father', '0', '0', '1', '1'),
+        PedigreeMember('fam', 'mother', '0', '0', '2', '1'),
+        PedigreeMember('fam', 'child', 'father', 'mother', '2', '2'),
+        PedigreeMember('fam', 'child2', '0', 'mother', '2', '2'),
+    ])
+    calls = dict(CALLS, child2=CALLS['child'])
+    results = api.check_pedigree(pedigree, calls)
+    assert [r.to_line() for r in results] == [
+        'child\t2\tOK\t1\tOK', 'child2\t1\tOK\t1\tOK']
+
+
+def test_check_pairs():
+    cohort = [Donor('d', name, 'father', 'DNA')
+              for name in ('mother', 'father', 'child')]
+    results = api.check_pairs(cohort, CALLS)
+    assert [(r.sample, r.reference, r.ok) for r in results] == [
+        ('child', 'father', False), ('mother', 'father', False)]
+    assert [r.to_line() for r in results] == [
+        'child\t3\t3', 'mother\t6\t6']
+    assert api.check_pair(CALLS['father'], CALLS['father']).ok
+
+
+def test_no_heavy_imports():
+    code = ('import sys; from hlama import api; '
+            'print(" ".join(sorted(m for m in ("numpy", "snakemake") '
+            'if m in sys.modules)))')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.decode().strip() == ''
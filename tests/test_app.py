@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Tests for input file handling and work dir updates in the hlama app"""
+
+import argparse
+import json
+
+import pytest
+
+from hlama import __version__, app, call_store, config
+from hlama.fastq import DEFAULT_MAX_HLA_READS
+from hlama.matched_pairs import Cohort, Donor
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def make_app(*reads_base_dirs):
+    return app.BaseApp(argparse.Namespace(
+        reads_base_dirs=list(reads_base_dirs), check_threads=4))
+
+
+def test_locate_files(tmpdir):
+    first = tmpdir.mkdir('first')
+    second = tmpdir.mkdir('second')
+    first.join('a_R1.fastq.gz').write('')
+    second.join('a_R2.fastq.gz').write('')
+    second.join('b.bam').write('')
+    second.join('b.bam.bai').write('')
+    cohort = Cohort([
+        Donor('a', 'a', '.', 'DNA', data=['a_R1.fastq.gz,a_R2.fastq.gz']),
+        Donor('b', 'b', '.', 'DNA', data=['b.bam']),
+    ])
+    the_app = make_app(str(first), str(second))
+    the_app.locate_files(cohort)
+    the_app.check_info(cohort)
+    assert the_app.locate_file('a_R2.fastq.gz') == str(
+        second.join('a_R2.fastq.gz'))
+    # Each directory is listed once
+    assert sorted(the_app.listings) == [str(first), str(second)]
+    with pytest.raises(app.InputDataException):
+        the_app.locate_file('missing.fastq.gz')
+
+
+def test_get_mode():
+    the_app = make_app()
+    assert the_app.get_mode(['a.bam']) == app.ALIGNED
+    assert the_app.get_mode(['a.cram', 'b.cram']) == app.ALIGNED
+    assert the_app.get_mode(['a_R1.fastq.gz']) == app.SINGLE_END
+    assert the_app.get_mode(
+        ['a_R1.fastq.gz', 'a_R2.fastq.gz']) == app.PAIRED_END
+    with pytest.raises(app.InputDataException):
+        the_app.get_mode(['a_R1.fastq.gz', 'b.bam'])
+
+
+def test_check_index(tmpdir):
+    tmpdir.join('b.cram').write('')
+    cohort = Cohort([Donor('b', 'b', '.', 'DNA', data=['b.cram'])])
+    the_app = make_app(str(tmpdir))
+    the_app.locate_files(cohort)
+    with pytest.raises(app.InputDataException):
+        the_app.check_info(cohort)
+    # Index next to the full or the stripped file name
+    for index in ('b.cram.crai', 'b.crai'):
+        tmpdir.join(index).write('')
+        the_app = make_app(str(tmpdir))
+        the_app.locate_files(cohort)
+        the_app.check_info(cohort)
+        tmpdir.join(index).remove()
+
+
+def test_update_work_dir(tmpdir):
+    def member(donor, files):
+        return {'donor': donor, 'files': files, 'fingerprint': None,
+                'precomputed': False}
+
+    old_data = {'schema': 'hla_check_pairs', 'members': {
+        'a_normal': member('a', ['a_normal.fq']),
+        'a_tumor': member('a', ['a_tumor.fq']),
+        'b_normal': member('b', ['b_normal.fq']),
+        'c_normal': member('c', ['c_normal.fq']),
+    }}
+    new_data = {'schema': 'hla_check_pairs', 'members': {
+        'a_normal': member('a', ['a_normal.fq']),
+        'a_tumor': member('a', ['a_tumor.fq']),
+        'b_normal': member('b', ['b_normal_new.fq']),
+        'd_normal': member('d', ['d_normal.fq']),
+    }}
+    tmpdir.join('data.json').write(json.dumps(old_data))
+    paths = ['report.txt', 'cohort_report.txt', 'report.d/a.txt',
+             'report.d/b.txt', 'report.d/c.txt']
+    for name in old_data['members']:
+        paths.append('{}.d/hla_types.txt'.format(name))
+    paths += ['a_normal.d/prefilter/lane_0_1.fq',
+              'b_normal.d/prefilter/lane_0_1.fq',
+              'b_normal.d/prefilter/lane_0_metrics.json']
+    for path in paths:
+        tmpdir.join(path).ensure()
+    the_app = app.BaseApp(argparse.Namespace(work_dir=str(tmpdir)))
+    the_app.update_work_dir(str(tmpdir.join('data.json')), new_data)
+    remaining = [path for path in paths if tmpdir.join(path).exists()]
+    assert remaining == ['report.d/a.txt', 'a_normal.d/hla_types.txt',
+                         'a_tumor.d/hla_types.txt',
+                         'c_normal.d/hla_types.txt',
+                         'a_normal.d/prefilter/lane_0_1.fq']
+
+
+def test_update_work_dir_relations(tmpdir):
+    def member(father, files):
+        return {'family': 'FAM', 'father': father, 'mother': '0',
+                'files': files, 'mode': 'single-end', 'max_hla_reads': 0,
+                'fingerprint': None, 'precomputed': False}
+
+    old_data = {'schema': 'hla_pedigree', 'members': {
+        'child': member('0', ['child.fq']),
+    }}
+    new_data = {'schema': 'hla_pedigree', 'members': {
+        'child': member('father', ['child.fq']),
+        'father': member('0', ['father.fq']),
+    }}
+    tmpdir.join('data.json').write(json.dumps(old_data))
+    paths = ['report.txt', 'report.d/FAM.txt', 'child.d/hla_types.txt',
+             'child.d/prefilter/lane_0_1.fq']
+    for path in paths:
+        tmpdir.join(path).ensure()
+    the_app = app.BaseApp(argparse.Namespace(work_dir=str(tmpdir)))
+    the_app.update_work_dir(str(tmpdir.join('data.json')), new_data)
+    # Only the reports are affected by the new father of the child
+    remaining = [path for path in paths if tmpdir.join(path).exists()]
+    assert remaining == ['child.d/hla_types.txt',
+                         'child.d/prefilter/lane_0_1.fq']
+
+
+def test_lookup_calls(tmpdir):
+    tmpdir.join('a.fq').write('')
+    member_data = {'name': 'a', 'files': [str(tmpdir.join('a.fq'))],
+                   'max_hla_reads': 0}
+    the_app = app.BaseApp(argparse.Namespace(
+        work_dir=str(tmpdir.join('work')), use_call_store=True, plan=False))
+    the_app.conf = argparse.Namespace(
+        call_store_path=str(tmpdir.join('calls.sqlite')),
+        call_store_hash_bytes=0)
+    the_app.lookup_calls(member_data)
+    assert not member_data['precomputed']
+    the_app.get_call_store().put(member_data['fingerprint'], ['A*01:01'])
+    the_app.lookup_calls(member_data)
+    assert member_data['precomputed']
+    # Both outputs of the typing step are written
+    assert tmpdir.join('work', 'a.d', 'hla_types.txt').read() == 'A*01:01\n'
+    assert json.loads(tmpdir.join('work', 'a.d', 'metrics.json').read()) == {
+        'sample': 'a', 'precomputed': True}
+
+
+def test_batch(tmpdir, capsys):
+    reads = tmpdir.mkdir('reads')
+    for name in ('N', 'T', 'father', 'mother', 'child', 'other'):
+        for i in (1, 2):
+            reads.join('{}_R{}.fastq.gz'.format(name, i)).write('')
+    tmpdir.join('pairs.tsv').write(
+        'donor\tN\tN\tDNA\tN_R1.fastq.gz,N_R2.fastq.gz\n'
+        'donor\tT\tN\tDNA\tT_R1.fastq.gz,T_R2.fastq.gz\n')
+    tmpdir.join('fam.ped').write(
+        'FAM\tfather\t0\t0\t1\t1\tfather_R1.fastq.gz,father_R2.fastq.gz\n'
+        'FAM\tmother\t0\t0\t2\t1\tmother_R1.fastq.gz,mother_R2.fastq.gz\n'
+        'FAM\tchild\tfather\tmother\t1\t2\t'
+        'child_R1.fastq.gz,child_R2.fastq.gz\n')
+    # The normal sample is also the father of the pedigree
+    tmpdir.join('fam2.ped').write(
+        'FAM2\tN\t0\t0\t1\t1\tN_R1.fastq.gz,N_R2.fastq.gz\n'
+        'FAM2\tother\tN\t0\t1\t1\tother_R1.fastq.gz,other_R2.fastq.gz\n')
+    work_dir = tmpdir.join('work')
+
+    def run_batch(*extra):
+        return app.main([
+            '--tumor-normal', str(tmpdir.join('pairs.tsv')),
+            '--pedigree', str(tmpdir.join('fam.ped')),
+            '--pedigree', str(tmpdir.join('fam2.ped')),
+            '--reads-base-dir', str(reads), '--work-dir', str(work_dir),
+            '--no-call-store', '--dont-run-snakemake'] + list(extra))
+
+    run_batch()
+    data = json.loads(work_dir.join('data.json').read())
+    assert data['schema'] == 'hla_batch'
+    assert sorted(data['sheets']) == ['fam', 'fam2', 'pairs']
+    assert sorted(data['members']) == [
+        'N', 'T', 'child', 'father', 'mother', 'other']
+    assert data['members']['N']['seq_type'] == 'DNA'
+    assert data['sheets']['fam2']['members']['N']['family'] == 'FAM2'
+    assert data['sheets']['pairs']['members']['N']['donor'] == 'donor'
+    assert 'Batch of 3 sheets with 6 distinct samples' in (
+        capsys.readouterr().err)
+
+    # Updating only invalidates the reports of the changed sheet
+    paths = ['N.d/hla_types.txt', 'other.d/hla_types.txt',
+             'sheets/pairs/report.txt', 'sheets/pairs/report.d/donor.txt',
+             'sheets/fam2/report.txt', 'sheets/fam2/report.d/FAM2.txt']
+    for path in paths:
+        work_dir.join(path).ensure()
+    tmpdir.join('fam2.ped').write(
+        'FAM2\tN\t0\t0\t1\t1\tN_R1.fastq.gz,N_R2.fastq.gz\n')
+    run_batch('--update')
+    remaining = [path for path in paths if work_dir.join(path).exists()]
+    assert remaining == [
+        'N.d/hla_types.txt', 'other.d/hla_types.txt',
+        'sheets/pairs/report.txt', 'sheets/pairs/report.d/donor.txt']
+
+
+def test_batch_conflict(tmpdir, capsys):
+    reads = tmpdir.mkdir('reads')
+    for name in ('a', 'b'):
+        reads.join('{}_R1.fastq.gz'.format(name)).write('')
+    tmpdir.join('one.tsv').write('d\tN\tN\tDNA\ta_R1.fastq.gz\n')
+    tmpdir.join('two.tsv').write('d\tN\tN\tDNA\tb_R1.fastq.gz\n')
+    assert app.main([
+        '--tumor-normal', str(tmpdir.join('one.tsv')),
+        '--tumor-normal', str(tmpdir.join('two.tsv')),
+        '--reads-base-dir', str(reads),
+        '--work-dir', str(tmpdir.join('work')),
+        '--no-call-store', '--dont-run-snakemake']) == 1
+    assert 'Sample N is listed with different input files' in (
+        capsys.readouterr().err)
+
+
+def test_plan(tmpdir, capsys):
+    reads = tmpdir.mkdir('reads')
+    for name, size in (('N', 10), ('T', 1000)):
+        for i in (1, 2):
+            with reads.join('{}_R{}.fastq.gz'.format(name, i)).open(
+                    'wb') as f:
+                f.truncate(size * 1024 ** 2)  # sparse
+    tmpdir.join('pairs.tsv').write(
+        'donor\tN\tN\tDNA\tN_R1.fastq.gz,N_R2.fastq.gz\n'
+        'donor\tT\tN\tDNA\tT_R1.fastq.gz,T_R2.fastq.gz\n')
+    work_dir = tmpdir.join('work')
+
+    def run_plan(*extra):
+        app.main(['--tumor-normal', str(tmpdir.join('pairs.tsv')),
+                  '--reads-base-dir', str(reads), '--work-dir',
+                  str(work_dir), '--plan'] + list(extra))
+        return capsys.readouterr().out.splitlines()
+
+    lines = run_plan('--no-call-store')
+    assert [line.split('\t')[0] for line in lines[1:3]] == ['T', 'N']
+    assert lines[1].endswith('\tyes') and lines[2].endswith('\tno')
+    assert lines[3].startswith('# total core-hours: ')
+    assert not work_dir.exists()
+
+    # Calls found in the call store cost nothing but are not written
+    tmpdir.join('hlama.cfg').write(
+        '[hlama.call_store]\npath = {}\n'.format(tmpdir.join('calls.db')))
+    conf = config.Configuration.find(str(tmpdir.join('hlama.cfg')))
+    call_store.CallStore(conf.call_store_path).put(call_store.fingerprint(
+        [str(reads.join('T_R1.fastq.gz')), str(reads.join('T_R2.fastq.gz'))],
+        conf.call_store_hash_bytes, seq_type='DNA',
+        max_hla_reads=DEFAULT_MAX_HLA_READS['DNA'], version=__version__),
+        ['A*01:01', 'A*02:01'])
+    lines = run_plan('--config', str(tmpdir.join('hlama.cfg')))
+    assert [line.split('\t')[0] for line in lines[1:3]] == ['N', 'T']
+    assert lines[2].endswith('\t0.0\tno')
+    assert not work_dir.exists()
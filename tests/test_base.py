@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Tests for the HLA type representation"""
+
+import concurrent.futures
+import os
+import pickle
+import subprocess
+import sys
+
+from hlama.base import HLAType
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_parse():
+    hla = HLAType.parse('HLA-A*02:01')
+    assert (hla.gene_name, hla.two_digits, hla.four_digits) == \
+        ('A', '02', '01')
+    assert HLAType.parse('A*02:01') is HLAType.parse('A*02:01')
+    assert str(HLAType.parse('B*07')) == 'HLA-B*07'
+
+
+def test_keys_match_prec_str():
+    hla_strs = ['A*02:01', 'A*02:02', 'A*02', 'A*03:01', 'A', 'B*02:01']
+    hlas = [HLAType.parse(s) for s in hla_strs]
+    for precision in (0, 2, 4):
+        for lhs in hlas:
+            for rhs in hlas:
+                assert ((lhs.key(precision) == rhs.key(precision)) ==
+                        (lhs.prec_str(precision) == rhs.prec_str(precision)))
+
+
+def test_eq_and_hash():
+    assert HLAType('A', '02', '01') == HLAType.parse('A*02:01')
+    assert HLAType('A', '02') != HLAType.parse('A*02:01')
+    assert len({HLAType('A', '02', '01'), HLAType.parse('A*02:01')}) == 1
+    assert HLAType.parse('A*02:01') != 'A*02:01'
+    assert HLAType.parse('A*02:01') != None  # noqa: E711
+    assert HLAType.parse('A*02:01') not in ['A*02:01', None]
+    assert pickle.loads(pickle.dumps(HLAType.parse('A*02:01'))) == \
+        HLAType.parse('A*02:01')
+
+
+def test_pickle_other_process():
+    # Keys are assigned in order of first use, differently in each process
+    data = pickle.dumps([HLAType.parse('A*02:01'), HLAType.parse('B*07:02')])
+    script = (
+        'import pickle, sys\n'
+        'from hlama.base import HLAType\n'
+        'HLAType.parse("C*01:02")\n'
+        'hlas = pickle.loads(sys.stdin.buffer.read())\n'
+        'assert hlas == [HLAType.parse("A*02:01"), HLAType.parse("B*07:02")]\n'
+        'assert hlas[0] != HLAType.parse("C*01:02")\n')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', script], input=data, env=env,
+                   check=True)
+
+
+def test_keys_threads():
+    hla_strs = ['{}*{:02d}:{:02d}'.format(gene, two, four)
+                for gene in 'ABC' for two in range(90, 99)
+                for four in range(80, 99)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        hlas = list(pool.map(lambda s: HLAType(*s.replace('*', ':').split(
+            ':')), hla_strs))
+    assert len({hla.key(4) for hla in hlas}) == len(hla_strs)
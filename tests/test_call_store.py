@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Tests for the HLA call store"""
+
+import os
+
+from hlama import call_store
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_fingerprint(tmpdir):
+    path = tmpdir.join('reads_1.fq')
+    path.write('@r\nACGT\n+\nIIII\n')
+    fp = call_store.fingerprint([str(path)], 2, seq_type='DNA')
+    assert fp == call_store.fingerprint([str(path)], 2, seq_type='DNA')
+    assert fp != call_store.fingerprint([str(path)], 2, seq_type='RNA')
+    assert fp != call_store.fingerprint([str(path)], 0, seq_type='DNA')
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert fp != call_store.fingerprint([str(path)], 2, seq_type='DNA')
+
+
+def test_store(tmpdir):
+    store = call_store.CallStore(str(tmpdir.join('cache', 'calls.sqlite')))
+    assert store.get('abc') is None
+    store.put('abc', ['A*01:01', 'A*02:01'])
+    assert store.get('abc') == ['A*01:01', 'A*02:01']
+    store.put('abc', ['A*01:01', 'A*01:01'])
+    assert store.get('abc') == ['A*01:01', 'A*01:01']
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Tests for the checksummed intermediate files"""
+
+import hashlib
+import json
+
+from hlama import checksums
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_seal_verify(tmpdir):
+    paths = [str(tmpdir.join('lane_0_1.fq')), str(tmpdir.join('lane_0_2.fq'))]
+    tmpdir.join('lane_0_1.fq').write('@r1\nACGT\n+\nIIII\n')
+    tmpdir.join('lane_0_2.fq').write('')
+    sealed = checksums.seal(paths)
+    assert sealed == {
+        paths[0]: hashlib.sha256(b'@r1\nACGT\n+\nIIII\n').hexdigest(),
+        paths[1]: hashlib.sha256(b'').hexdigest(),
+    }
+    assert checksums.verify(sealed) == []
+    # Truncated by a preempted job and removed
+    tmpdir.join('lane_0_1.fq').write('@r1\nAC')
+    tmpdir.join('lane_0_2.fq').remove()
+    assert checksums.verify(sealed) == sorted(paths)
+
+
+def test_write_json(tmpdir):
+    path = str(tmpdir.join('lane_0_metrics.json'))
+    checksums.write_json(path, {'checksums': {'a': 'b'}})
+    checksums.write_json(path, {'checksums': {'a': 'c'}})
+    assert json.loads(tmpdir.join('lane_0_metrics.json').read()) == {
+        'checksums': {'a': 'c'}}
+    assert tmpdir.listdir() == [tmpdir.join('lane_0_metrics.json')]
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Tests for the all-vs-all cohort comparison"""
+
+from hlama import cohort
+from hlama.base import HLAType
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def parse(*hla_strs):
+    return [HLAType.parse(s) for s in hla_strs]
+
+
+#: Calls of the samples
+CALLS = {
+    'donor1_normal': parse('A*01:01', 'A*02:01', 'B*07:02', 'B*08:01',
+                           'C*01:06', 'C*02:02'),
+    'donor1_tumor': parse('A*01:01', 'A*02:01', 'B*07:02', 'B*08:01',
+                          'C*01:06', 'C*02:02'),
+    'donor2_normal': parse('A*01:01', 'A*02:01', 'B*07:02', 'B*08:01',
+                           'C*01:06', 'C*02:03'),
+    'donor3_normal': parse('A*02:01', 'A*02:01', 'B*08:01', 'B*15:01',
+                           'C*02:02'),
+}
+
+
+def test_distances():
+    names = sorted(CALLS)
+    codes = cohort.encode_calls([CALLS[name] for name in names], 4)
+    dist = cohort.distances(codes, codes)
+    assert dist.tolist() == [
+        [0, 0, 1, 3],
+        [0, 0, 1, 3],
+        [1, 1, 0, 4],
+        [3, 3, 4, 1],  # missing allele never matches
+    ]
+
+
+def test_compare_all():
+    names = sorted(CALLS)
+    groups = [name.split('_')[0] for name in names]
+    suspicious = cohort.compare_all(
+        names, [CALLS[name] for name in names], groups, block_size=3)
+    assert suspicious == [
+        ('donor1_normal', 'donor2_normal', 0, 1),
+        ('donor1_tumor', 'donor2_normal', 0, 1),
+    ]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Tests for the snapshot of the environment providing the tools"""
+
+import subprocess
+
+import pytest
+
+from hlama import environment
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_take(tmpdir, monkeypatch):
+    monkeypatch.setenv('HLAMA_TEST_UNSET', 'x')
+    tmpdir.join('mytool').write('#!/bin/sh\n')
+    tmpdir.join('mytool').chmod(0o755)
+    prefix = ('echo "Activating"\n'
+              'export PATH={}:$PATH\n'
+              'export HLAMA_TEST_VAR="a \'b\' c"\n'
+              'unset HLAMA_TEST_UNSET\n'
+              'myfunc() {{ true; }}; export -f myfunc').format(tmpdir)
+    snapshot = environment.EnvSnapshot.take(prefix, ('mytool', 'notatool'))
+    assert sorted(snapshot.set_vars) == ['HLAMA_TEST_VAR', 'PATH']
+    assert snapshot.unset_vars == ['HLAMA_TEST_UNSET']
+    assert snapshot.tools == {'mytool': str(tmpdir.join('mytool')),
+                              'notatool': None}
+    assert snapshot.missing_tools() == ['notatool']
+    # Sourcing the script reproduces the environment
+    out = subprocess.check_output(
+        ['bash', '-c', snapshot.to_script() +
+         'echo "$HLAMA_TEST_VAR;${HLAMA_TEST_UNSET-unset}";'
+         'command -v mytool'])
+    assert out.decode().splitlines() == [
+        "a 'b' c;unset", str(tmpdir.join('mytool'))]
+
+
+def test_take_fails():
+    with pytest.raises(environment.SnapshotException):
+        environment.EnvSnapshot.take('echo "no such env" >&2; false')
+
+
+def test_load_or_take(tmpdir):
+    path = str(tmpdir.join('env.json'))
+    first, taken = environment.load_or_take(path, 'export A=1')
+    assert taken and first.set_vars == {'A': '1'}
+    assert tmpdir.join('env.sh').read().endswith('export A=1\n')
+    second, taken = environment.load_or_take(path, 'export A=1')
+    assert not taken and second.set_vars == {'A': '1'}
+    _, taken = environment.load_or_take(path, 'export A=1', refresh=True)
+    assert taken
+    # Taken again for a changed prefix
+    third, taken = environment.load_or_take(path, 'export A=2')
+    assert taken and third.set_vars == {'A': '2'}
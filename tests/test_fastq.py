@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Tests for the FASTQ helpers"""
+
+import gzip
+
+import pytest
+
+from hlama import fastq
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def write_fastq(path, names):
+    with open(path, 'wt') as f:
+        for name in names:
+            print('@{}\nACGT\n+\nIIII'.format(name), file=f)
+
+
+def read_names(path):
+    with open(path, 'rt') as f:
+        return [line.strip() for line in f][0::4]
+
+
+def test_read_name():
+    assert fastq.read_name([b'@r1/1 x\n']) == b'r1'
+    assert fastq.read_name([b'@r1\n']) == b'r1'
+
+
+def test_split_lane(tmpdir):
+    lane = [str(tmpdir.join('lane_1.fq')), str(tmpdir.join('lane_2.fq'))]
+    write_fastq(lane[0], ['a/1', 'b/1', 'c/1'])
+    write_fastq(lane[1], ['a/2', 'b/2', 'c/2'])
+    chunk = [str(tmpdir.join('chunk_1.fq')), str(tmpdir.join('chunk_2.fq'))]
+    chunks = fastq.split_lane(lane, chunk, 2)
+    assert next(chunks) == 2
+    assert read_names(chunk[0]) == ['@a/1', '@b/1']
+    assert read_names(chunk[1]) == ['@a/2', '@b/2']
+    assert next(chunks) == 1
+    assert read_names(chunk[1]) == ['@c/2']
+    assert list(chunks) == []
+
+    write_fastq(lane[1], ['a/2'])
+    with pytest.raises(ValueError):
+        list(fastq.split_lane(lane, chunk, 2))
+
+
+def test_read_budget(tmpdir):
+    # Yara kept different reads of the mates
+    lane = [str(tmpdir.join('lane_1.fq')), str(tmpdir.join('lane_2.fq'))]
+    write_fastq(lane[0], ['a/1', 'b/1', 'd/1', 'e/1'])
+    write_fastq(lane[1], ['c/2', 'b/2', 'e/2'])
+    out = [str(tmpdir.join('out_1.fq')), str(tmpdir.join('out_2.fq'))]
+
+    def add(max_reads, chunks=1):
+        with open(out[0], 'wb') as f1, open(out[1], 'wb') as f2:
+            budget = fastq.ReadBudget([f1, f2], max_reads)
+            for _ in range(chunks):
+                budget.add(lane)
+        return budget.to_dict()
+
+    assert add(2) == {'hla_reads': 2, 'truncated': True}
+    assert read_names(out[0]) == ['@a/1', '@b/1']
+    assert read_names(out[1]) == ['@b/2']
+
+    # Second reads without mate fill the remaining budget
+    assert add(5) == {'hla_reads': 5, 'truncated': False}
+    assert read_names(out[0]) == ['@a/1', '@b/1', '@d/1', '@e/1']
+    assert read_names(out[1]) == ['@c/2', '@b/2', '@e/2']
+
+    assert add(4)['truncated']
+    assert read_names(out[1]) == ['@b/2', '@e/2']
+
+    # Later chunks fill the remaining budget
+    assert add(7, chunks=2) == {'hla_reads': 7, 'truncated': True}
+    assert read_names(out[0]) == ['@a/1', '@b/1', '@d/1', '@e/1', '@a/1',
+                                  '@b/1']
+
+
+def test_merge_lanes(tmpdir):
+    lanes = []
+    for lane, (first, second) in enumerate([
+            (['a', 'b'], ['b', 'c']), (['d'], ['d']), (['e'], ['e'])]):
+        lanes.append((str(tmpdir.join('{}_1.fq'.format(lane))),
+                      str(tmpdir.join('{}_2.fq'.format(lane)))))
+        write_fastq(lanes[-1][0], ['{}/1'.format(n) for n in first])
+        write_fastq(lanes[-1][1], ['{}/2'.format(n) for n in second])
+    out = [str(tmpdir.join('out_1.fq')), str(tmpdir.join('out_2.fq'))]
+
+    assert fastq.merge_lanes(lanes, out) == {
+        'max_hla_reads': 0, 'hla_reads': 5, 'subsampled': False}
+    assert read_names(out[0]) == ['@a/1', '@b/1', '@d/1', '@e/1']
+
+    assert fastq.merge_lanes(lanes, out, 2) == {
+        'max_hla_reads': 2, 'hla_reads': 2, 'subsampled': True}
+    assert read_names(out[0]) == ['@a/1', '@b/1']
+    assert read_names(out[1]) == ['@b/2']
+
+    assert fastq.merge_lanes(lanes, out, 4)['hla_reads'] == 4
+    assert read_names(out[1]) == ['@b/2', '@c/2', '@d/2']
+
+    # Lanes filling the budget exactly are not subsampled
+    assert fastq.merge_lanes(lanes[1:], out, 2) == {
+        'max_hla_reads': 2, 'hla_reads': 2, 'subsampled': False}
+    write_fastq(lanes[2][0], [])
+    write_fastq(lanes[2][1], [])
+    assert not fastq.merge_lanes(lanes, out, 4)['subsampled']
+
+
+def test_merge_lanes_compressed(tmpdir):
+    write_fastq(str(tmpdir.join('l1_1.fq')), ['a', 'b'])
+    write_fastq(str(tmpdir.join('l1_2.fq')), ['a', 'b'])
+    out = [str(tmpdir.join('out_1.fq.gz')), str(tmpdir.join('out_2.fq.gz'))]
+    fastq.merge_lanes(
+        [(str(tmpdir.join('l1_1.fq')), str(tmpdir.join('l1_2.fq')))], out,
+        opener=lambda path: gzip.open(path, 'wb'))
+    with fastq.open_fastq(out[1]) as f:
+        assert [fastq.read_name(r) for r in fastq.read_records(f)] == [
+            b'a', b'b']
+    assert fastq.has_records(out[0])
+    tmpdir.join('empty.fq.gz').write('')
+    assert not fastq.has_records(str(tmpdir.join('empty.fq.gz')))
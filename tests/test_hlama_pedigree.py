@@ -29,10 +29,13 @@ def data_dir():
                         'data/pedigree')
 
 
-def test_app(tmpdir, report, tsv_file, data_dir):
+@pytest.mark.parametrize('extra_args', [
+    [], ['--low-scratch', '--kmer-prescreen']])
+def test_app(tmpdir, report, tsv_file, data_dir, extra_args):
+    # With --low-scratch, Yara and OptiType get gzip-compressed reads
     work_dir = str(tmpdir.mkdir('hlama_pedigree'))
     args = ['--pedigree', tsv_file, '--reads-base-dir', data_dir,
-            '--work-dir', work_dir]
+            '--work-dir', work_dir] + extra_args
     app.main(args)
 
     with open(os.path.join(os.path.dirname(__file__), work_dir,
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Tests for identifying donors from the inverted allele index"""
+
+import json
+import os
+
+from hlama import identify
+from hlama.base import HLAType
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def parse(*hla_strs):
+    return [HLAType.parse(s) for s in hla_strs]
+
+
+#: Known samples
+ENTRIES = [
+    identify.Entry('donor1', 'donor1_normal', parse(
+        'A*01:01', 'A*02:01', 'B*07:02', 'B*08:01', 'C*01:06', 'C*02:02')),
+    identify.Entry('donor2', 'donor2_normal', parse(
+        'A*01:01', 'A*02:01', 'B*07:02', 'B*08:01', 'C*01:06', 'C*02:03')),
+    identify.Entry('donor3', 'donor3_normal', parse(
+        'A*02:01', 'A*02:01', 'B*08:01', 'B*15:01', 'C*02:02')),
+]
+
+
+def test_query(tmpdir):
+    path = str(tmpdir.join('index'))
+    identify.DonorIndex.build(ENTRIES).save(path)
+    index = identify.DonorIndex.load(path)
+    assert len(index) == 3
+    matches = index.query(ENTRIES[1].calls, top_k=2)
+    assert [(m.sample, m.dist_2, m.dist_4) for m in matches] == [
+        ('donor2_normal', 0, 0), ('donor1_normal', 0, 1)]
+    # Homozygous alleles are only shared twice with homozygous samples
+    matches = index.query(parse('A*02:01', 'A*02:01'), top_k=3)
+    assert [(m.sample, m.dist_4) for m in matches] == [
+        ('donor3_normal', 4), ('donor1_normal', 5), ('donor2_normal', 5)]
+
+
+def test_index_work_dirs(tmpdir):
+    work_dir = tmpdir.mkdir('work')
+    data = {'members': {}}
+    for entry in ENTRIES[:2]:
+        data['members'][entry.sample] = {
+            'donor': entry.donor, 'name': entry.sample}
+        work_dir.mkdir(entry.sample + '.d').join('hla_types.txt').write(
+            ''.join(str(hla) + '\n' for hla in entry.calls))
+    data['members']['missing'] = {'donor': 'donor4', 'name': 'missing'}
+    work_dir.join('data.json').write(json.dumps(data))
+    path = str(tmpdir.join('index'))
+    identify.DonorIndex.build(ENTRIES[2:]).save(path)
+    # Samples are added to the existing index
+    assert identify.main(['index', '--index', path, str(work_dir)]) is None
+    entries = list(identify.DonorIndex.load(path).entries())
+    assert [e.sample for e in entries] == [
+        'donor1_normal', 'donor2_normal', 'donor3_normal']
+    assert [str(x) for x in entries[0].calls] == [
+        str(x) for x in ENTRIES[0].calls]
+    # Rebuilding only keeps the samples of the given work directories
+    assert identify.main(
+        ['index', '--index', path, '--rebuild', str(work_dir)]) is None
+    assert len(identify.DonorIndex.load(path)) == 2
+    assert sorted(os.listdir(str(tmpdir))) == ['index', 'work']
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Tests for the shared Yara index cache"""
+
+import os.path
+
+from hlama.index_cache import IndexCache
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def fake_build(calls):
+    """Return build function writing dummy index files"""
+    def build(path):
+        calls.append(path)
+        for ext in ('', '.sa.ind'):
+            with open(path + ext, 'wt') as f:
+                print('index', file=f)
+    return build
+
+
+def test_key(tmpdir):
+    ref = tmpdir.join('ref.fasta.gz')
+    ref.write('ACGT')
+    cache = IndexCache(str(tmpdir.join('cache')))
+    assert cache.key(str(ref), '0.9.6') == cache.key(str(ref), '0.9.6\n')
+    assert cache.key(str(ref), '0.9.6') != cache.key(str(ref), '0.9.7')
+
+
+def test_fetch_and_link(tmpdir):
+    cache = IndexCache(str(tmpdir.join('cache')))
+    calls = []
+    entry = cache.fetch('abc', fake_build(calls))
+    assert cache.fetch('abc', fake_build(calls)) == entry
+    assert len(calls) == 1
+
+    prefix = str(tmpdir.join('ref_dna.fasta'))
+    cache.link(entry, prefix, ('', '.sa.ind'))
+    cache.link(entry, prefix, ('', '.sa.ind'))  # relinking is fine
+    assert os.path.islink(prefix + '.sa.ind')
+    assert os.path.realpath(prefix) == os.path.join(entry, 'ref.fasta')
+
+
+def test_failed_build_leaves_no_entry(tmpdir):
+    cache = IndexCache(str(tmpdir.join('cache')))
+
+    def build(path):
+        raise RuntimeError('yara_indexer failed')
+
+    try:
+        cache.fetch('abc', build)
+    except RuntimeError:
+        pass
+    assert os.listdir(cache.path) == ['abc.lock']
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Tests for the Mendelian checks of whole pedigrees"""
+
+import io
+
+from hlama import mendel
+from hlama.base import HLAType
+from hlama.pedigree import Pedigree, PedigreeMember
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+#: Calls of the members, the father ``f`` is not genotyped
+CALLS = {
+    'gf': 'A*01:01 A*02:01 B*07:02 B*08:01 C*01:06 C*02:02',
+    'gm': 'A*03:01 A*24:02 B*15:01 B*27:05 C*03:04 C*07:02',
+    'm': 'A*11:01 A*26:01 B*35:01 B*40:01 C*04:01 C*05:01',
+    'c1': 'A*01:01 A*11:01 B*27:05 B*35:01 C*02:02 C*04:01',
+    'c2': 'A*02:01 A*26:01 B*08:01 B*40:01 C*03:04 C*05:01',
+    'c3': 'A*68:01 A*11:01 B*27:05 B*35:01 C*02:02 C*04:02',
+    'gc': 'A*01:01 A*31:01 B*27:05 B*51:01 C*04:01 C*12:03',
+    's': 'A*31:01 A*32:01 B*51:01 B*57:01 C*12:03 C*16:01',
+}
+
+
+def parse(calls):
+    return {name: [HLAType.parse(x) for x in hla_types.split()]
+            for name, hla_types in calls.items()}
+
+
+def make_pedigree():
+    return Pedigree([
+        PedigreeMember('FAM', 'gf', '0', '0', '1', '1'),
+        PedigreeMember('FAM', 'gm', '0', '0', '2', '1'),
+        PedigreeMember('FAM', 'f', 'gf', 'gm', '1', '1'),
+        PedigreeMember('FAM', 'm', '0', '0', '2', '1'),
+        PedigreeMember('FAM', 'c1', 'f', 'm', '1', '2'),
+        PedigreeMember('FAM', 'c2', 'f', 'm', '2', '2'),
+        PedigreeMember('FAM', 'c3', 'f', 'm', '1', '2'),
+        PedigreeMember('FAM', 's', '0', '0', '2', '1'),
+        PedigreeMember('FAM', 'gc', 'c1', 's', '1', '2'),
+    ])
+
+
+def test_consistent():
+    calls = parse(CALLS)
+    del calls['c3']
+    assert mendel.check_pedigree(make_pedigree(), calls) == []
+
+
+def test_inconsistent():
+    findings = mendel.check_pedigree(make_pedigree(), parse(CALLS))
+    # c3 has an A allele of neither side, and at four digits a C allele
+    # the mother does not have; the siblings carry five A alleles and at
+    # four digits five C alleles
+    assert findings == [
+        ('FAM', 'grandparents', ['c3'], ['gf', 'gm', 'm'], 1, 2),
+        ('FAM', 'siblings', ['c1', 'c2', 'c3'], ['f', 'm'], 1, 2),
+    ]
+    f = io.StringIO()
+    mendel.write_report(f, findings)
+    assert f.getvalue().splitlines()[0] == (
+        'FAM\tgrandparents\tc3\tgf,gm,m\t1\t2')
+
+
+def test_parents():
+    calls = parse(CALLS)
+    # Homozygous at A, one allele found in each parent
+    calls['gc'] = parse({'gc': 'A*01:01 B*27:05 B*51:01 C*04:01 C*12:03'})[
+        'gc']
+    assert mendel.check_pedigree(make_pedigree(), {
+        name: calls[name] for name in ('c1', 's', 'gc')}) == [
+            ('FAM', 'parents', ['gc'], ['c1', 's'], 1, 1)]
+    # Only one genotyped parent
+    calls = parse(CALLS)
+    assert mendel.check_pedigree(make_pedigree(), {
+        name: calls[name] for name in ('s', 'gc')}) == []
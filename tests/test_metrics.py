@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Tests for measuring the resource usage"""
+
+import resource
+import threading
+import time
+
+import pytest
+
+from hlama import metrics
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_scratch_monitor(tmpdir):
+    scratch = tmpdir.mkdir('scratch')
+    with metrics.ScratchMonitor(
+            [str(scratch), str(tmpdir.join('missing'))],
+            interval=0.01) as monitor:
+        scratch.join('a').write('x' * 100000)
+        peak = metrics.disk_usage([str(scratch)])
+        time.sleep(0.1)  # wait for background measurement
+        scratch.join('a').remove()
+    assert peak > 0
+    assert monitor.peak >= peak
+    assert metrics.disk_usage([str(scratch)]) == 0
+
+
+def test_run_command(tmpdir):
+    out = str(tmpdir.join('stages', 'sleep.1.json'))
+    tmpdir.mkdir('stages')
+    assert metrics.main([out, 'sh', '-c', 'sleep 0.1; exit 3']) == 3
+    metrics.run_command(
+        str(tmpdir.join('stages', 'sleep.2.json')), ['true'])
+    stages = metrics.Stages()
+    stages.load_dir(str(tmpdir.join('stages')))
+    assert list(stages.stats) == ['sleep']
+    assert stages.stats['sleep']['wall_s'] >= 0.1
+    assert stages.stats['sleep']['max_rss_kb'] > 0
+
+
+def test_stages_measure():
+    stages = metrics.Stages()
+    for _ in range(2):
+        with stages.measure('busy'):
+            sum(range(100000))
+    assert stages.stats['busy']['cpu_s'] >= 0
+    assert stages.stats['busy']['max_rss_kb'] is None
+    stages.add('busy', metrics.stage_stats(1, 1, 100))
+    assert stages.stats['busy']['max_rss_kb'] == 100
+
+
+@pytest.mark.skipif(not hasattr(resource, 'RUSAGE_THREAD'),
+                    reason='per-thread resource usage needs Linux')
+def test_stages_measure_thread():
+    # Other jobs running in threads of the process are not counted
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            pass
+
+    thread = threading.Thread(target=spin)
+    thread.start()
+    stages = metrics.Stages()
+    try:
+        with stages.measure('sleep'):
+            time.sleep(0.5)
+    finally:
+        stop.set()
+        thread.join()
+    assert stages.stats['sleep']['cpu_s'] < 0.1
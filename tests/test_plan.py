@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Tests for the cost estimates and priorities of the typing jobs"""
+
+import io
+
+from hlama import __version__
+from hlama import plan
+from hlama import snake
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+GB = 1024 ** 3
+
+
+def make_schema(members):
+    return snake.HlamaSchema({
+        'schema': 'hla_check_pairs', 'members': members, 'config': None,
+        'version': __version__, 'num_threads': 1, 'ilp_threads': 1,
+        'kmer_prescreen': False, 'low_scratch': False,
+        'keep_prefiltered': False, 'call_store': None,
+        'env_snapshot': None, 'serve_socket': None,
+    })
+
+
+def make_member(tmpdir, name, sizes, seq_type='DNA', mode='paired-end',
+                precomputed=False):
+    files = []
+    for i, size in enumerate(sizes):
+        path = tmpdir.join('{}_L{}_R{}.fastq.gz'.format(
+            name, i // 2, i % 2 + 1))
+        with path.open('wb') as f:
+            f.truncate(size)  # sparse
+        files.append(str(path))
+    return {'name': name, 'seq_type': seq_type, 'mode': mode,
+            'files': files, 'max_hla_reads': 500000,
+            'precomputed': precomputed}
+
+
+def test_estimate(tmpdir):
+    schema = make_schema({
+        'wgs': make_member(tmpdir, 'wgs', [50 * GB] * 4),
+        'panel': make_member(tmpdir, 'panel', [GB // 10] * 2),
+        'stored': make_member(tmpdir, 'stored', [GB] * 2, precomputed=True),
+    })
+    wgs = plan.estimate(schema, 'wgs')
+    assert (wgs.lanes, wgs.input_bytes) == (2, 200 * GB)
+    # Dominated by pre-filtering the reads with Yara
+    prefilter = 200 * GB / snake.BYTES_PER_READ / \
+        plan.PREFILTER_READS_PER_CORE_S
+    assert wgs.core_seconds == (
+        2 * plan.LANE_STARTUP_CORE_S + prefilter + plan.OPTITYPE_CORE_S +
+        plan.OPTITYPE_CORE_S_PER_1K_READS * 500)
+    assert plan.estimate(schema, 'panel').core_seconds < wgs.core_seconds
+    assert plan.estimate(schema, 'stored').core_seconds == 0
+
+
+def test_make_plan(tmpdir):
+    members = {name: make_member(tmpdir, name, [size * GB, size * GB])
+               for name, size in (('a', 1), ('b', 30), ('c', 2), ('d', 1))}
+    members['e'] = make_member(tmpdir, 'e', [GB], precomputed=True)
+    schema = make_schema(members)
+    the_plan = plan.make_plan(schema, 2)
+    assert [(e.name, e.priority) for e in the_plan] == [
+        ('b', True), ('c', True), ('a', False), ('d', False),
+        ('e', False)]
+    # The largest sample starts first and determines the wall-clock time
+    assert plan.makespan(the_plan, 2) == the_plan[0].core_seconds
+    assert plan.makespan(the_plan, 1) == sum(
+        e.core_seconds for e in the_plan)
+    assert plan.makespan(the_plan, 2, threads=4) == \
+        the_plan[0].core_seconds / 4
+    f = io.StringIO()
+    plan.write_table(f, the_plan, 2, 4)
+    lines = f.getvalue().splitlines()
+    assert lines[0] == '\t'.join(plan.COLUMNS)
+    assert lines[1].split('\t')[:4] == ['b', 'DNA', '1', '60.0']
+    assert lines[1].endswith('\tyes')
+    assert lines[-1].startswith(
+        '# predicted wall-clock hours with 2 slots of 4 threads: ')
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Tests for the k-mer pre-screen"""
+
+import gzip
+
+from hlama import prescreen
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Sequence to build the k-mer set from
+REF = b'TGAGTGCGGGGTCGGGAGGGAAACCGCCTCTGCGGGGAGAAGCAAGGGGCCCTCCTGGCGGG'
+#: Sequence not sharing a k-mer with REF
+OTHER = b'ATATATATATATATATATATATATATATATATATATATATATATATATATATATAT'
+
+
+def revcomp(seq):
+    return seq[::-1].translate(bytes.maketrans(b'ACGT', b'TGCA'))
+
+
+def write_fastq(path, seqs):
+    with open(path, 'wb') as f:
+        for i, seq in enumerate(seqs):
+            f.write(b'@r%d\n%s\n+\n%s\n' % (i, seq, b'I' * len(seq)))
+
+
+def test_kmer_set(tmpdir):
+    path = str(tmpdir.join('ref.fasta.gz'))
+    with gzip.open(path, 'wb') as f:
+        f.write(b'>ref\n' + REF[:30] + b'\n' + REF[30:] + b'\n')
+    kmer_set = prescreen.KmerSet.from_fasta(path)
+    assert len(kmer_set) == len(REF) - prescreen.DEFAULT_K + 1
+
+    kmer_set.save(str(tmpdir.join('kmers.npy')))
+    loaded = prescreen.KmerSet.load(str(tmpdir.join('kmers.npy')))
+    assert loaded.k == kmer_set.k
+    assert list(loaded.kmers) == list(kmer_set.kmers)
+
+    hits = loaded.hits([REF[10:50], revcomp(REF[5:45]), OTHER, b'ACGT',
+                        REF[10:20] + b'N' + REF[21:40]])
+    assert list(hits) == [True, True, False, False, False]
+
+
+def test_screen_fastq(tmpdir):
+    path = str(tmpdir.join('ref.fasta'))
+    with open(path, 'wb') as f:
+        f.write(b'>ref\n' + REF + b'\n')
+    kmer_set = prescreen.KmerSet.from_fasta(path)
+
+    in_paths = [str(tmpdir.join('in_1.fq')), str(tmpdir.join('in_2.fq'))]
+    write_fastq(in_paths[0], [REF[:40], OTHER, OTHER])
+    write_fastq(in_paths[1], [OTHER, OTHER, revcomp(REF[20:60])])
+    out_paths = [str(tmpdir.join('out_1.fq')), str(tmpdir.join('out_2.fq'))]
+    assert prescreen.screen_fastq(kmer_set, in_paths, out_paths,
+                                  chunk_size=2) == (3, 2)
+    for path in out_paths:
+        with open(path, 'rt') as f:
+            assert [line.strip() for line in f][0::4] == ['@r0', '@r2']
+
+    # Compressed output, as with --low-scratch
+    gz_paths = [path + '.gz' for path in out_paths]
+    assert prescreen.screen_fastq(
+        kmer_set, in_paths, gz_paths,
+        opener=lambda path: gzip.open(path, 'wb')) == (3, 2)
+    for path in gz_paths:
+        with gzip.open(path, 'rt') as f:
+            assert [line.strip() for line in f][0::4] == ['@r0', '@r2']
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Tests for the sharded consistency report"""
+
+from hlama import report
+from hlama.pedigree import Pedigree, PedigreeMember
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+#: Calls of the samples
+CALLS = {
+    'father': ['A*01:01', 'A*02:01', 'B*07:02', 'B*08:01', 'C*01:06',
+               'C*02:02'],
+    'mother': ['A*03:01', 'A*24:02', 'B*15:01', 'B*27:05', 'C*03:04',
+               'C*07:02'],
+    'child': ['A*01:01', 'A*24:02', 'B*07:02', 'B*27:05', 'C*02:02',
+              'C*07:01'],
+}
+
+
+def load_all(tmpdir):
+    result = {}
+    for name, hla_types in CALLS.items():
+        path = tmpdir.join(name + '.txt')
+        path.write(''.join(x + '\n' for x in hla_types))
+        result[name] = report.load_calls(str(path))
+    return result
+
+
+def test_pedigree_lines(tmpdir):
+    pedigree = Pedigree([
+        PedigreeMember('fam', 'father', '0', '0', '1', '1'),
+        PedigreeMember('fam', 'mother', '0', '0', '2', '1'),
+        PedigreeMember('fam', 'child', 'father', 'mother', '2', '2'),
+    ])
+    lines = list(report.pedigree_lines(pedigree, load_all(tmpdir)))
+    assert lines == ['child\t2\tOK\t1\tOK']
+
+
+def test_pair_lines(tmpdir):
+    members = [
+        {'sample': 'mother', 'reference': 'father'},
+        {'sample': 'father', 'reference': 'father'},
+        {'sample': 'child', 'reference': 'father'},
+    ]
+    lines = list(report.pair_lines(members, load_all(tmpdir)))
+    assert lines == ['child\t3\t3', 'mother\t6\t6']
+
+
+def test_merge_shards(tmpdir):
+    paths = []
+    for name in ('a', 'b', 'c'):
+        paths.append(str(tmpdir.join(name + '.txt')))
+        report.write_shard(paths[-1], [name] if name != 'b' else [])
+    report.merge_shards(str(tmpdir.join('report.txt')), paths)
+    assert tmpdir.join('report.txt').read() == 'a\nc\n'
+
+
+def test_load_calls_changed(tmpdir):
+    # Same relative path in two work dirs, and a retyped sample
+    for name, hla_type in (('one', 'A*01:01'), ('two', 'A*02:01')):
+        tmpdir.join(name, 'sample.d', 'hla_types.txt').write(
+            hla_type + '\n', ensure=True)
+    with tmpdir.join('one').as_cwd():
+        assert str(report.load_calls('sample.d/hla_types.txt')['A'][0]) == (
+            'HLA-A*01:01')
+    with tmpdir.join('two').as_cwd():
+        assert str(report.load_calls('sample.d/hla_types.txt')['A'][0]) == (
+            'HLA-A*02:01')
+        tmpdir.join('two', 'sample.d', 'hla_types.txt').write(
+            'A*03:01\nA*03:01\n')
+        assert [str(hla) for hla in report.load_calls(
+            'sample.d/hla_types.txt')['A']] == ['HLA-A*03:01', 'HLA-A*03:01']
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Tests for the warm worker daemon"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from hlama import serve
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+#: Script writing the calls as the typing rule does
+SCRIPT = ('mkdir -p sample.d\n'
+          'printf "A*01:01\\nA*02:01\\n" | sort -V > sample.d/hla_types.txt\n'
+          'echo "typed $HLAMA_TEST"')
+#: Environment of the client, finding hlama also if it is not installed
+ENV = dict(os.environ, PYTHONPATH=os.path.dirname(
+    os.path.dirname(os.path.abspath(serve.__file__))))
+
+
+@pytest.fixture
+def server(tmpdir):
+    server = serve.Server(str(tmpdir.join('serve.sock')), 2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_socket_mode(server):
+    assert os.stat(server.server_address).st_mode & 0o077 == 0
+
+
+def test_file_warmer(tmpdir):
+    tmpdir.join('index', 'ref.fasta.sa.val').write('x' * 10000, ensure=True)
+    tmpdir.join('index', 'empty').write('')
+    tmpdir.join('other.txt').write('abc')
+    warmer = serve.FileWarmer()
+    assert warmer.add([str(tmpdir.join('index')),
+                       str(tmpdir.join('other.txt')),
+                       str(tmpdir.join('missing'))]) == 2
+    assert warmer.add([str(tmpdir.join('other.txt'))]) == 0
+    assert warmer.touch() == 10003
+
+
+def test_submit(tmpdir, server):
+    work_dir = tmpdir.mkdir('work')
+    work_dir.join('tmp', 'ref_dna.fasta.sa.val').write('x', ensure=True)
+    result = serve.submit(
+        server.server_address, SCRIPT, cwd=str(work_dir),
+        env=dict(os.environ, HLAMA_TEST='in daemon'))
+    assert result == {'returncode': 0, 'stdout': 'typed in daemon\n',
+                      'stderr': ''}
+    assert work_dir.join('sample.d', 'hla_types.txt').read() == (
+        'A*01:01\nA*02:01\n')
+    assert list(server.warmer.maps) == [
+        str(work_dir.join('tmp', 'ref_dna.fasta.sa.val'))]
+    assert serve.submit(server.server_address, 'false')['returncode'] == 1
+    assert serve.submit(str(tmpdir.join('missing.sock')), 'true') is None
+
+
+@pytest.mark.parametrize('use_server', [True, False])
+def test_wrap_script(tmpdir, server, use_server):
+    path = server.server_address if use_server else str(
+        tmpdir.join('missing.sock'))
+    out = subprocess.check_output(
+        ['bash', '-c', serve.wrap_script(path, SCRIPT)], cwd=str(tmpdir),
+        env=dict(ENV, HLAMA_TEST='ok'))
+    assert out.decode() == 'typed ok\n'
+    assert tmpdir.join('sample.d', 'hla_types.txt').read() == (
+        'A*01:01\nA*02:01\n')
+    assert subprocess.call(
+        ['bash', '-c', serve.wrap_script(path, 'exit 3')], env=ENV) == 3
+
+
+def test_client_gone(tmpdir, server):
+    # Killing the client, e.g., the Snakemake job, kills the job's script
+    client = subprocess.Popen(
+        [sys.executable, '-m', 'hlama.serve', 'submit', server.server_address],
+        stdin=subprocess.PIPE, cwd=str(tmpdir), env=ENV)
+    client.stdin.write(b'echo $$ > job.pid\nsleep 60\n')
+    client.stdin.close()
+    for _ in range(100):
+        if tmpdir.join('job.pid').exists() and tmpdir.join('job.pid').read():
+            break
+        time.sleep(0.1)
+    pid = int(tmpdir.join('job.pid').read())
+    client.kill()
+    client.wait()
+    for _ in range(100):
+        if not server.jobs:
+            break
+        time.sleep(0.1)
+    assert not server.jobs
+    with pytest.raises(ProcessLookupError):
+        os.killpg(pid, 0)
+
+
+def test_daemon_gone(tmpdir):
+    # The daemon closes the connection without answering
+    path = str(tmpdir.join('serve.sock'))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def answer():
+        conn, _ = listener.accept()
+        conn.makefile('rb').readline()
+        conn.close()
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    proc = subprocess.run(
+        [sys.executable, '-m', 'hlama.serve', 'submit', path], input=b'true',
+        env=ENV, stderr=subprocess.PIPE)
+    thread.join()
+    listener.close()
+    assert proc.returncode == 1
+    assert b'stopped before the job finished' in proc.stderr
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Tests for the connection between the Snakefile and hlama"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from hlama import __version__
+from hlama import environment
+from hlama import snake
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def make_schema(num_threads, ilp_threads=1, members=None,
+                env_snapshot=None, serve_socket=None):
+    return snake.HlamaSchema({
+        'schema': 'hla_check_pairs', 'members': members or {},
+        'config': None, 'version': __version__, 'num_threads': num_threads,
+        'ilp_threads': ilp_threads, 'kmer_prescreen': False,
+        'low_scratch': False, 'keep_prefiltered': False,
+        'call_store': None,
+        'env_snapshot': env_snapshot, 'serve_socket': serve_socket,
+    })
+
+
+def test_get_optitype_ini(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    schema = make_schema(4)
+    path = schema.get_optitype_ini()
+    assert path == str(tmpdir.join('optitype.ini'))
+    assert 'threads=4' in tmpdir.join('optitype.ini').read()
+    # Kept as long as the contents do not change
+    mtime = os.path.getmtime(path)
+    os.utime(path, (mtime - 10, mtime - 10))
+    assert make_schema(4).get_optitype_ini() == path
+    assert os.path.getmtime(path) == mtime - 10
+    assert make_schema(8, 2).get_optitype_ini() == path
+    assert 'threads=8' in tmpdir.join('optitype.ini').read()
+    assert 'threads=2' in tmpdir.join('optitype.ini').read()
+    assert tmpdir.listdir() == [tmpdir.join('optitype.ini')]
+
+
+def test_lazy_imports():
+    # Parsing the Snakefile imports neither NumPy nor SQLite
+    code = ('import sys; from hlama import fastq, metrics, report, snake; '
+            'print(" ".join(sorted(m for m in ("numpy", "sqlite3") '
+            'if m in sys.modules)))')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.decode().strip() == ''
+
+
+def test_env_snapshot(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    path = str(tmpdir.join('env.json'))
+    environment.EnvSnapshot(
+        'source activate hlama', {'PATH': '/env/bin:/usr/bin'}, [],
+        {'razers3': '/env/bin/razers3', 'pigz': None}).save(path)
+    schema = make_schema(1, env_snapshot=path)
+    assert schema.command_prefix().endswith(
+        '\nsource {}'.format(tmpdir.join('env.sh')))
+    assert schema.get_tool_path('razers3') == '/env/bin/razers3'
+    assert schema.get_tool_path('pigz') == 'pigz'
+    schema.get_optitype_ini()
+    assert 'razers3=/env/bin/razers3' in tmpdir.join('optitype.ini').read()
+    # Without snapshot, the tools are taken from $PATH
+    assert make_schema(1).get_tool_path('razers3') == 'razers3'
+
+
+def test_resources(tmpdir):
+    def member(name, seq_type, size, max_hla_reads):
+        path = tmpdir.join('{}_R1.fastq.gz'.format(name))
+        with path.open('wb') as f:
+            f.truncate(size)  # sparse
+        return {'name': name, 'seq_type': seq_type, 'files': [str(path)],
+                'max_hla_reads': max_hla_reads}
+
+    schema = make_schema(4, 2, {
+        'small': member('small', 'DNA', 7000000, 500000),
+        'rna': member('rna', 'RNA', 7000000, 500000),
+        'capped': member('capped', 'RNA', 70000000, 5000),
+        'missing': dict(member('missing', 'DNA', 0, 0), files=['/missing']),
+    })
+    assert schema.optitype_threads() == 4
+    assert schema.get_prefilter_mem_mb(None) == 2048 + 4 * 256
+    assert schema.get_prefilter_mem_mb(None, attempt=2) == 2 * 3072
+
+    def mem_mb(sample, attempt=1):
+        return schema.get_optitype_mem_mb(
+            argparse.Namespace(sample=sample), attempt)
+
+    assert schema.get_expected_hla_reads('small') == 100
+    assert schema.get_expected_hla_reads('rna') == 1000
+    assert schema.get_expected_hla_reads('capped') == 5000
+    assert schema.get_expected_hla_reads('missing') == 0
+    assert mem_mb('small') == 2048 + 2
+    assert mem_mb('capped') == 2048 + 100
+    assert mem_mb('capped', attempt=2) == 2 * (2048 + 100)
+
+
+def test_batch(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    calls = {
+        'father': ['A*01:01', 'A*02:01', 'B*07:02', 'B*08:01', 'C*01:06',
+                   'C*02:02'],
+        'mother': ['A*03:01', 'A*24:02', 'B*15:01', 'B*27:05', 'C*03:04',
+                   'C*07:02'],
+        'child': ['A*01:01', 'A*24:02', 'B*07:02', 'B*27:05', 'C*02:02',
+                  'C*07:01'],
+    }
+    for name, hla_types in calls.items():
+        tmpdir.join(name + '.d', 'hla_types.txt').write(
+            ''.join(x + '\n' for x in hla_types), ensure=True)
+
+    def typing(name):
+        return {'name': name, 'files': [name + '.fq'], 'mode': 'single-end',
+                'max_hla_reads': 0, 'seq_type': 'DNA', 'fingerprint': None,
+                'precomputed': False}
+
+    def ped(family, name, father='0', mother='0'):
+        return {'family': family, 'name': name, 'father': father,
+                'mother': mother, 'gender': '1', 'disease': '1'}
+
+    schema = make_schema(1, members={
+        name: typing(name) for name in calls})
+    schema.data['schema'] = 'hla_batch'
+    schema.data['sheets'] = {
+        'fam': {'schema': 'hla_pedigree', 'members': {
+            'father': ped('FAM', 'father'), 'mother': ped('FAM', 'mother'),
+            'child': ped('FAM', 'child', 'father', 'mother')}},
+        'pairs': {'schema': 'hla_check_pairs', 'members': {
+            'father': {'donor': 'd', 'sample': 'father', 'name': 'father',
+                       'reference': 'father'},
+            'child': {'donor': 'd', 'sample': 'child', 'name': 'child',
+                      'reference': 'father'}}},
+    }
+    assert schema.get_final_outputs() == [
+        'sheets/fam/report.txt', 'sheets/fam/cohort_report.txt',
+        'sheets/fam/mendel_report.txt', 'sheets/pairs/report.txt',
+        'sheets/pairs/cohort_report.txt']
+    # No reports of the batch itself
+    assert schema.get_report_shards() == []
+    wildcards = argparse.Namespace(sheet='pairs', shard='d')
+    assert schema.get_sheet_report_shards(wildcards) == [
+        'sheets/pairs/report.d/d.txt']
+    assert schema.get_sheet_shard_input(wildcards) == [
+        'child.d/hla_types.txt', 'father.d/hla_types.txt']
+    sheet = schema.get_sheet('fam')
+    assert sheet.data['members']['child']['files'] == ['child.fq']
+    tmpdir.mkdir('sheets').mkdir('fam').mkdir('report.d')
+    sheet.write_report_shard('FAM', 'sheets/fam/report.d/FAM.txt')
+    assert tmpdir.join('sheets/fam/report.d/FAM.txt').read() == (
+        'child\t2\tOK\t1\tOK\n')
+    sheet.write_mendel_report('sheets/fam/mendel_report.txt')
+    assert tmpdir.join('sheets/fam/mendel_report.txt').read() == (
+        'FAM\tparents\tchild\tfather,mother\tOK\t1\n')
+
+
+def test_serve_script(tmpdir):
+    script = 'echo {output[0]}\n'
+    assert make_schema(1).serve_script(script) == script
+    path = str(tmpdir.join('serve.sock'))
+    schema = make_schema(1, serve_socket=path)
+    # Not wrapped before the daemon created its socket
+    assert schema.serve_script(script) == script
+    tmpdir.join('serve.sock').write('')
+    wrapped = schema.serve_script(script)
+    assert wrapped.startswith('{} -m hlama.serve submit {} <<'.format(
+        sys.executable, path))
+    assert wrapped.format(output=['out.txt']).splitlines()[1:] == [
+        'echo out.txt', '', 'HLAMA_SERVE_SCRIPT']
+
+
+@pytest.mark.skipif(not shutil.which('awk'), reason='needs awk')
+def test_mates_bed_awk():
+    sam = ''.join('\t'.join(fields) + '\n' for fields in [
+        # QNAME, FLAG, RNAME, POS, MAPQ, CIGAR, RNEXT, PNEXT
+        ['same', '99', 'chr6', '100', '60', '10M', '=', '250'],
+        ['other', '65', 'chr6', '200', '60', '10M', 'chr1', '1000'],
+        ['mate_unmapped', '73', 'chr6', '300', '60', '10M', '=', '300'],
+        ['single', '0', 'chr6', '400', '60', '10M', '*', '0'],
+        ['no_mate_pos', '1', 'chr6', '500', '60', '10M', '*', '0'],
+    ])
+    out = subprocess.run(
+        ['awk', '-F', '\t', snake.MATES_BED_AWK], input=sam.encode(),
+        stdout=subprocess.PIPE, check=True).stdout.decode()
+    # 1-based PNEXT to BED, "=" is the contig of the record
+    assert out == 'chr6\t249\t250\nchr1\t999\t1000\n'
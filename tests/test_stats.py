@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Tests for the table of performance metrics"""
+
+import io
+import json
+
+from hlama import stats
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def make_metrics(reads_in, wall_s):
+    return {
+        'prefilter': {'reads_in': reads_in, 'reads_out': 10},
+        'read_budget': {'hla_reads': 10, 'subsampled': False,
+                        'max_hla_reads': 0},
+        'temp_bytes': 1024 ** 2,
+        'scratch': {'peak_bytes': 2 * 1024 ** 2},
+        'stages': {'optitype': {'wall_s': wall_s, 'cpu_s': 1.0,
+                                'max_rss_kb': 2048},
+                   # Measured within the Snakemake process
+                   'merge_lanes': {'wall_s': 1.0, 'cpu_s': 0.5,
+                                   'max_rss_kb': None}},
+    }
+
+
+def test_write_table(tmpdir):
+    work_dir = tmpdir.mkdir('work')
+    members = {'a': {}, 'b': {}, 'c': {}, 'd': {}}
+    work_dir.join('data.json').write(json.dumps({'members': members}))
+    work_dir.mkdir('a.d').join('metrics.json').write(
+        json.dumps(make_metrics(100, 2.0)))
+    work_dir.mkdir('b.d').join('metrics.json').write(
+        json.dumps(make_metrics(None, 3.0)))
+    work_dir.mkdir('d.d').join('metrics.json').write(
+        json.dumps({'sample': 'd', 'precomputed': True}))
+    rows = [stats.to_row('work', name, metrics)
+            for name, metrics in stats.load_metrics(str(work_dir))]
+    f = io.StringIO()
+    stats.write_table(f, rows)
+    lines = [line.split('\t') for line in f.getvalue().splitlines()]
+    assert lines[0][-6:] == [
+        'merge_lanes_cpu_s', 'merge_lanes_max_rss_mb', 'merge_lanes_wall_s',
+        'optitype_cpu_s', 'optitype_max_rss_mb', 'optitype_wall_s']
+    assert lines[1][-5] == '.' and lines[4][-5] == '.'
+    assert [line[:3] for line in lines[1:]] == [
+        ['work', 'a', '100'], ['work', 'b', '.'], ['sum', 'sum', '100'],
+        ['max', 'max', '100']]
+    assert lines[3][-1] == '5.0'
+    assert lines[4][-2:] == ['2.0', '3.0']
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Tests for typing samples while their input files arrive"""
+
+import argparse
+import json
+import os
+
+from hlama import app, watch
+
+__author__ = 'Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>'
+
+
+def test_stability_tracker(tmpdir):
+    path = str(tmpdir.join('a_R1.fastq.gz'))
+    tracker = watch.StabilityTracker(stable_seconds=60)
+    assert not tracker.is_stable(path)
+    with open(path, 'wb') as f:
+        f.write(b'@read')
+    now = os.stat(path).st_mtime
+    assert not tracker.is_stable(path, now)
+    assert tracker.is_stable(path, now + 60)
+    # Growing files start over
+    with open(path, 'ab') as f:
+        f.write(b'\nACGT')
+    os.utime(path, (now + 90, now + 90))
+    assert not tracker.is_stable(path, now + 120)
+    assert tracker.is_stable(path, now + 150)
+    # Files written long ago are stable right away
+    os.utime(path, (now - 3600, now - 3600))
+    assert tracker.is_stable(path, now)
+
+
+def test_watch(tmpdir, monkeypatch):
+    reads = tmpdir.mkdir('reads')
+    for name in ('father', 'mother', 'child', 'other'):
+        reads.join('{}_R1.fastq.gz'.format(name)).write('')
+    tmpdir.join('fam.ped').write(
+        'FAM\tfather\t0\t0\t1\t1\tfather_R1.fastq.gz\n'
+        'FAM\tmother\t0\t0\t2\t1\tmother_R1.fastq.gz\n'
+        'FAM\tchild\tfather\tmother\t1\t2\t'
+        'child_R1.fastq.gz,child_R2.fastq.gz\n'
+        'FAM2\tother\t0\t0\t1\t1\tother_R1.fastq.gz\n')
+    work_dir = tmpdir.join('work')
+
+    rounds = []
+
+    def call_snakemake(self, targets=None):
+        data = json.loads(work_dir.join('data.json').read())
+        rounds.append((sorted(data['members']), targets))
+        return True
+
+    def sleep(seconds):
+        reads.join('child_R2.fastq.gz').write('')
+
+    monkeypatch.setattr(app.BaseApp, 'call_snakemake', call_snakemake)
+    monkeypatch.setattr(watch.time, 'sleep', sleep)
+    assert watch.main([
+        '--pedigree', str(tmpdir.join('fam.ped')),
+        '--reads-base-dir', str(reads), '--work-dir', str(work_dir),
+        '--no-call-store', '--stable-seconds', '0']) == 0
+    # The child is typed once its second file arrived, the report shard of
+    # its family is only written then
+    assert rounds == [
+        (['father', 'mother', 'other'],
+         ['father.d/hla_types.txt', 'mother.d/hla_types.txt',
+          'other.d/hla_types.txt', 'report.d/FAM2.txt']),
+        (['child', 'father', 'mother', 'other'], None),
+    ]
+
+
+def test_restrict_batch(tmpdir):
+    tmpdir.join('pairs.tsv').write(
+        'donor\tN\tN\tDNA\tN_R1.fastq.gz\n'
+        'donor\tT\tN\tDNA\tT_R1.fastq.gz\n')
+    tmpdir.join('fam.ped').write(
+        'FAM\tN\t0\t0\t1\t1\tN_R1.fastq.gz\n')
+    with open(str(tmpdir.join('pairs.tsv'))) as pairs, \
+            open(str(tmpdir.join('fam.ped'))) as fam:
+        the_app = app.make_app(argparse.Namespace(
+            tumor_normal=[pairs], pedigree=[fam]))
+        batch = the_app.load_info()
+    shards = watch.get_shards(batch, the_app.SCHEMA)
+    assert shards == [('sheets/pairs/report.d/donor.txt', ['N', 'T']),
+                      ('sheets/fam/report.d/FAM.txt', ['N'])]
+    restricted = watch.restrict(batch, {'N'})
+    assert [[m.name for m in sheet.members]
+            for _, _, sheet in restricted.sheets] == [['N'], ['N']]